@@ -0,0 +1,203 @@
+"""
+Stream AF3 full_data JSON into memory-mapped matrices and compute interface confidence metrics.
+
+The full_data JSON of a large complex holds N x N `pae` and `contact_probs`
+matrices as hundreds of MB of text. They are decoded chunk by chunk straight
+into `.npy` files, which are then memory-mapped; the remaining (per token and per
+atom) values are small and decoded as JSON.
+"""
+import re
+import json
+
+import numpy as np
+
+from PDBToolkit.tracing import count, traced
+
+CHUNK_SIZE = 1 << 20
+BLOCK_SIZE = 1024
+MATRIX_KEYS = ("pae", "contact_probs")
+CONTACT_CUTOFF = 0.5
+
+_WHITESPACE = b" \t\r\n"
+_SEPARATORS = bytes.maketrans(b"[],", b"   ")
+_MATRIX_END = re.compile(rb"\]\s*\]")
+
+
+class _Reader:
+    """
+    Byte buffer over a binary stream, refilled in chunks.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.buffer = b""
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.handle.read(CHUNK_SIZE)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self, skip = _WHITESPACE):
+        """
+        Skip the bytes in `skip` and return the next byte, or None at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos:self.pos + 1]
+            if not self.fill():
+                return None
+
+    def decode_value(self):
+        decoder = json.JSONDecoder()
+        while True:
+            text = self.buffer[self.pos:].decode("utf-8", errors="ignore")
+            try:
+                value, end = decoder.raw_decode(text)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            self.pos += len(text[:end].encode("utf-8"))
+            return value
+
+    def read_matrix(self, output_path, dtype):
+        """
+        Decode a square matrix of numbers into the `.npy` file `output_path`, row by row as text arrives.
+        """
+        self.pos += 1
+        if self.peek() == b"]":
+            self.pos += 1
+            np.save(output_path, np.zeros((0, 0), dtype=dtype))
+            return np.load(output_path, mmap_mode="r")
+        while self.buffer.find(b"]", self.pos) < 0:
+            if not self.fill():
+                raise ValueError("Unterminated matrix.")
+        first_row = self.buffer[self.pos:self.buffer.find(b"]", self.pos)]
+        n_columns = len(np.fromstring(first_row.translate(_SEPARATORS), dtype=np.float32, sep=" "))
+
+        matrix = np.lib.format.open_memmap(output_path, mode="w+", dtype=dtype, shape=(n_columns, n_columns))
+        flat = matrix.reshape(-1)
+        n_filled = 0
+        while True:
+            match = _MATRIX_END.search(self.buffer, self.pos)
+            if match is not None:
+                end = match.end()
+            else:
+                end = self.buffer.rfind(b",", self.pos) + 1
+            if end > self.pos:
+                values = np.fromstring(self.buffer[self.pos:end].translate(_SEPARATORS), dtype=np.float32, sep=" ")
+                if n_filled + len(values) > flat.size:
+                    raise ValueError(f"Matrix is not {n_columns} x {n_columns}.")
+                flat[n_filled:n_filled + len(values)] = values
+                n_filled += len(values)
+                self.pos = end
+            if match is not None:
+                break
+            if not self.fill():
+                raise ValueError("Unterminated matrix.")
+        if n_filled != flat.size:
+            raise ValueError(f"Matrix is not {n_columns} x {n_columns}.")
+        matrix.flush()
+        count("bytes_written", matrix.nbytes)
+        del matrix, flat
+        return np.load(output_path, mmap_mode="r")
+
+
+@traced("read_full_data")
+def read_full_data(handle, output_prefix, dtype = "float16"):
+    """
+    Stream an AF3 full_data JSON from the binary `handle`.
+
+    `pae` and `contact_probs` are written to `<output_prefix>.<key>.npy` and returned
+    memory-mapped; every other value is returned as decoded JSON.
+    """
+    reader = _Reader(handle)
+    if reader.peek() != b"{":
+        raise ValueError("full_data JSON must be an object.")
+    reader.pos += 1
+    data = {}
+    while True:
+        char = reader.peek(_WHITESPACE + b",")
+        if char is None:
+            raise ValueError("Unterminated full_data JSON.")
+        if char == b"}":
+            break
+        key = reader.decode_value()
+        reader.peek(_WHITESPACE + b":")
+        if key in MATRIX_KEYS and reader.peek() == b"[":
+            data[key] = reader.read_matrix(f"{output_prefix}.{key}.npy", dtype)
+        else:
+            data[key] = reader.decode_value()
+    return data
+
+
+def residue_plddt(table):
+    """
+    Mean pLDDT (0-100) of each residue as `{(chain_id, resseq): plddt}`.
+    """
+    starts = table.residue_starts[:-1]
+    sums = np.add.reduceat(table.bfactor.astype(np.float64), starts)
+    counts = np.diff(table.residue_starts)
+    keys = zip(table.chain_id[starts].tolist(), table.resseq[starts].tolist())
+    return dict(zip(keys, (sums / counts).tolist()))
+
+
+@traced("interface_metrics")
+def interface_metrics(pae, contact_probs, token_chain_ids, token_res_ids, plddt = None):
+    """
+    Interface confidence of one model from its PAE and contact probability matrices.
+
+    The matrices are reduced over blocks of rows with a token-to-chain indicator
+    matrix, so memory-mapped inputs are never loaded whole. Returns `(metrics, pairs)`:
+    `metrics` holds `ipae` (mean inter-chain PAE), `ipae_min` (the best chain pair,
+    PAE averaged over both directions), `contact_ipae` (inter-chain PAE weighted by
+    contact probability) and `interface_plddt` (mean pLDDT of residues with an
+    inter-chain contact probability above 0.5, from the `residue_plddt` mapping);
+    `pairs` maps "A/B" chain pairs to their mean PAE.
+    """
+    chain_ids = list(dict.fromkeys(token_chain_ids))
+    chain_index = np.array([chain_ids.index(chain_id) for chain_id in token_chain_ids])
+    n_tokens, n_chains = len(chain_index), len(chain_ids)
+    indicator = np.zeros((n_tokens, n_chains))
+    indicator[np.arange(n_tokens), chain_index] = 1
+
+    pae_sum = np.zeros((n_chains, n_chains))
+    contact_sum = np.zeros((n_chains, n_chains))
+    contact_pae_sum = np.zeros((n_chains, n_chains))
+    interface = np.zeros(n_tokens, dtype=bool)
+    for start in range(0, n_tokens, BLOCK_SIZE):
+        rows = slice(start, start + BLOCK_SIZE)
+        block = np.asarray(pae[rows], dtype=np.float64)
+        pae_sum += indicator[rows].T @ (block @ indicator)
+        if contact_probs is not None:
+            contacts = np.asarray(contact_probs[rows], dtype=np.float64)
+            contacts[chain_index[rows, None] == chain_index[None, :]] = 0
+            contact_sum += indicator[rows].T @ (contacts @ indicator)
+            contact_pae_sum += indicator[rows].T @ ((contacts * block) @ indicator)
+            interface[rows] = contacts.max(axis=1, initial=0) >= CONTACT_CUTOFF
+
+    sizes = indicator.sum(axis=0)
+    pair_pae = pae_sum / np.outer(sizes, sizes)
+    symmetric = (pair_pae + pair_pae.T) / 2
+    off_diagonal = ~np.eye(n_chains, dtype=bool)
+    metrics = {"ipae": np.nan, "ipae_min": np.nan, "contact_ipae": np.nan, "interface_plddt": np.nan}
+    if n_chains > 1:
+        metrics["ipae"] = pae_sum[off_diagonal].sum() / np.outer(sizes, sizes)[off_diagonal].sum()
+        metrics["ipae_min"] = symmetric[off_diagonal].min()
+    if contact_sum.sum() > 0:
+        metrics["contact_ipae"] = contact_pae_sum.sum() / contact_sum.sum()
+    if plddt is not None and interface.any():
+        keys = set(zip(np.asarray(token_chain_ids)[interface].tolist(), np.asarray(token_res_ids)[interface].tolist()))
+        values = [plddt[key] for key in keys if key in plddt]
+        if values:
+            metrics["interface_plddt"] = np.mean(values) / 100
+
+    pairs = {
+        f"{chain_ids[i]}/{chain_ids[j]}": float(symmetric[i, j])
+        for i in range(n_chains) for j in range(i + 1, n_chains)
+    }
+    return metrics, pairs
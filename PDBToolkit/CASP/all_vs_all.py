@@ -0,0 +1,380 @@
+"""
+All-vs-all TM-scores of a model pool, consensus ranking and clustering.
+
+`M[i, j]` is the TM-score of model i superposed on model j, normalised by the
+length of j. Only pairs i < j are aligned: one USalign run prints both
+normalisations, so each run fills both sides of the diagonal. The pairs are split
+into chunks of up to `chunk_size` pairs of one row; shards take whole chunks,
+balanced by their number of pairs, and within a run the pairs are pulled one at a
+time by `n_cpu` lanes so no core idles before the last pair.
+
+The matrix is a memory-mapped `tm_matrix.npy` (float32, NaN for pairs not scored
+yet) written as results arrive, next to `models.txt` naming its rows. A killed or
+partly failed run therefore resumes with the missing pairs only. The consensus
+score of a model is its mean symmetric TM-score `(M[i, j] + M[j, i]) / 2` to all
+other models; `consensus.csv` ranks the models by it and assigns clusters.
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from PDBToolkit.config import USALIGN_PATH
+from PDBToolkit.CASP.executor import SubprocessExecutor
+from PDBToolkit.CASP.sup_template import TMSCORE_PATTERN
+from PDBToolkit.CASP.tmscore import calc_d0, map_residues, representative_atoms, tmscore_search
+from PDBToolkit.PDBOps.atom_table import read_structure
+from PDBToolkit.PDBOps.compression import decompressed_all, has_extension
+from PDBToolkit.shard import parse_shard, shard_path, shard_paths
+from PDBToolkit.tracing import count, span, tracing
+
+logging.basicConfig(level=logging.INFO)
+
+MATRIX_NAME = "tm_matrix.npy"
+MODELS_NAME = "models.txt"
+CONSENSUS_NAME = "consensus.csv"
+PROGRESS_SECONDS = 30.0
+
+_worker = {}
+
+
+def pair_chunks(n_models, chunk_size = 256):
+    """
+    Split the pairs i < j into `(i, start, end)` chunks holding the pairs `(i, j)` for `start <= j < end`.
+    """
+    chunks = []
+    for i in range(n_models - 1):
+        for start in range(i + 1, n_models, chunk_size):
+            chunks.append((i, start, min(start + chunk_size, n_models)))
+    return chunks
+
+
+def select_chunks(chunks, shard):
+    """
+    The chunks of `shard` (all chunks when None), largest first.
+
+    Chunks are placed largest first on the shard with the fewest pairs so far (the
+    lowest index on ties), so every job computes the same partition.
+    """
+    chunks = sorted(chunks, key=lambda chunk: (chunk[1] - chunk[2], chunk))
+    if shard is None:
+        return chunks
+    index, n_shards = shard
+    totals = [0] * n_shards
+    selected = []
+    for chunk in chunks:
+        target = min(range(n_shards), key=lambda k: (totals[k], k))
+        totals[target] += chunk[2] - chunk[1]
+        if target == index:
+            selected.append(chunk)
+    return selected
+
+
+def read_models(output_dir):
+    try:
+        with open(os.path.join(output_dir, MODELS_NAME), "r") as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return None
+
+
+def _write_models(output_dir, names):
+    path = os.path.join(output_dir, MODELS_NAME)
+    # shards of one run write the same list concurrently
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write("".join(f"{name}\n" for name in names))
+    os.replace(temp_path, path)
+
+
+def open_matrix(matrix_path, models):
+    """
+    Open the matrix of `models` for update, starting a new one unless it was made for the same models.
+    """
+    output_dir = os.path.dirname(matrix_path)
+    names = [os.path.basename(model) for model in models]
+    if os.path.exists(matrix_path):
+        if read_models(output_dir) == names:
+            matrix = np.lib.format.open_memmap(matrix_path, mode="r+")
+            if matrix.shape == (len(models), len(models)):
+                return matrix
+        logging.warning(f"The models changed since {matrix_path} was written, starting a new matrix.")
+    _write_models(output_dir, names)
+    temp_path = matrix_path + ".tmp.npy"
+    matrix = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float32, shape=(len(models), len(models)))
+    matrix[:] = np.nan
+    np.fill_diagonal(matrix, 1.0)
+    matrix.flush()
+    os.replace(temp_path, matrix_path)
+    return matrix
+
+
+class _Progress:
+    """
+    Count scored pairs; log the rate and flush the matrix every `PROGRESS_SECONDS`.
+    """
+
+    def __init__(self, total, matrix):
+        self.total = total
+        self.matrix = matrix
+        self.done = 0
+        self.failed = 0
+        self.start = self.last_report = time.perf_counter()
+
+    def step(self, n_pairs = 1):
+        self.done += n_pairs
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_SECONDS or self.done == self.total:
+            self.last_report = now
+            self.matrix.flush()
+            logging.info(
+                f"{self.done}/{self.total} pairs, {self.done / max(now - self.start, 1e-9):.1f} pairs/s, {self.failed} failed"
+            )
+
+
+async def _score_usalign(models, pairs, matrix, extra_args, executor, progress):
+    pairs = iter(pairs)
+
+    async def lane():
+        for i, j in pairs:
+            command = [USALIGN_PATH, models[i], models[j]] + (extra_args or [])
+            result = await executor.run(command, TMSCORE_PATTERN)
+            if result.ok and len(result.matches) >= 2:
+                # normalised by Structure_1 (model i), then by Structure_2 (model j)
+                matrix[j, i], matrix[i, j] = float(result.matches[0]), float(result.matches[1])
+            else:
+                error = result.error() if not result.ok else f"no TM-score in output: {result.stdout.strip()}"
+                logging.error(f"Error aligning {models[i]} and {models[j]}: {error}")
+                progress.failed += 1
+            progress.step()
+
+    await asyncio.gather(*(lane() for _ in range(executor.max_concurrency)))
+
+
+def _init_native(atoms):
+    _worker["atoms"] = atoms
+
+
+def _search(mobile_atoms, reference_atoms):
+    """
+    TM-scores of `mobile_atoms` (a list) on `reference_atoms`, normalised by the reference.
+    """
+    keys, reference, nucleotide = reference_atoms
+    l_norm = len(keys)
+    if not l_norm:
+        return np.zeros(len(mobile_atoms))
+    index = {key: k for k, key in enumerate(keys)}
+    d0 = calc_d0(l_norm, nucleotide=nucleotide.sum() * 2 > l_norm)
+    mapped = [map_residues(atom_keys, coords, index, l_norm) for atom_keys, coords, _ in mobile_atoms]
+    mobile = np.stack([coords for coords, _ in mapped])
+    mask = np.stack([found for _, found in mapped])
+    scores, _, _ = tmscore_search(mobile, reference, mask, l_norm, d0)
+    return scores
+
+
+def _score_row_native(task):
+    """
+    Score models `js` on model `i` as reference with the vectorized engine, and `i` on each of them.
+
+    Models with the residues of `i` share its length and aligned pairs, so both
+    normalisations have the same optimum and the reverse score is copied; any
+    other model is searched again with itself as reference and its own d0.
+    """
+    i, js = task
+    atoms = _worker["atoms"]
+    scores_ji = _search([atoms[j] for j in js], atoms[i])
+    scores_ij = scores_ji.copy()
+    for k, j in enumerate(js):
+        if atoms[j][0] != atoms[i][0]:
+            scores_ij[k] = _search([atoms[i]], atoms[j])[0]
+    return i, js, scores_ji, scores_ij
+
+
+def _score_native(models, tasks, matrix, n_cpu, progress):
+    atoms = [representative_atoms(read_structure(model)) for model in models]
+    with Pool(n_cpu, initializer=_init_native, initargs=(atoms,)) as pool:
+        for i, js, scores_ji, scores_ij in pool.imap_unordered(_score_row_native, tasks):
+            matrix[js, i] = scores_ji
+            matrix[i, js] = scores_ij
+            progress.step(len(js))
+
+
+def all_vs_all(models, output_dir, backend = "usalign", n_cpu = 1, chunk_size = 256, extra_args = None, timeout = None, retries = 0, shard = None):
+    """
+    Fill the TM-score matrix of `models` in `output_dir`, or its part for `shard`, and return its path.
+
+    Pairs that are already scored are skipped; pairs that fail stay NaN and are
+    retried by the next run. A shard writes `tm_matrix.shardI-of-N.npy`, merged by
+    `reduce_shards`.
+    """
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    matrix_path = os.path.join(output_dir, shard_path(MATRIX_NAME, shard))
+    matrix = open_matrix(matrix_path, models)
+
+    chunks = select_chunks(pair_chunks(len(models), chunk_size), shard)
+    tasks = []
+    for i, start, end in chunks:
+        js = np.arange(start, end)
+        pending = js[np.isnan(matrix[i, start:end]) | np.isnan(matrix[start:end, i])]
+        if len(pending):
+            tasks.append((i, pending))
+    n_pairs = sum(len(js) for _, js in tasks)
+    n_total = sum(end - start for _, start, end in chunks)
+    logging.info(f"{n_pairs} of {n_total} pairs of {len(models)} models to score.")
+
+    progress = _Progress(n_pairs, matrix)
+    if n_pairs:
+        with span("all_vs_all", backend=backend, pairs=n_pairs):
+            if backend == "native":
+                _score_native(models, tasks, matrix, n_cpu, progress)
+            else:
+                executor = SubprocessExecutor(n_cpu, timeout, retries)
+                pairs = ((i, int(j)) for i, js in tasks for j in js)
+                # every model takes part in many pairs: decompress compressed ones to scratch once
+                with decompressed_all(models) as plain_models:
+                    asyncio.run(_score_usalign(plain_models, pairs, matrix, extra_args, executor, progress))
+    matrix.flush()
+    count("pairs_scored", n_pairs - progress.failed)
+    if progress.failed:
+        logging.error(f"{progress.failed} pairs failed; run again to retry them.")
+    return matrix_path
+
+
+def consensus_scores(matrix):
+    """
+    Return the symmetric similarity `(M + M.T) / 2` and each model's mean similarity to the others.
+    """
+    similarity = (np.asarray(matrix, dtype=np.float64) + np.asarray(matrix, dtype=np.float64).T) / 2
+    np.fill_diagonal(similarity, np.nan)
+    scored = ~np.isnan(similarity)
+    consensus = np.nansum(similarity, axis=1) / np.maximum(scored.sum(axis=1), 1)
+    consensus[~scored.any(axis=1)] = np.nan
+    return similarity, consensus
+
+
+def cluster_models(similarity, threshold = 0.5):
+    """
+    Greedy (Taylor-Butina) clustering on a similarity matrix.
+
+    The model with the most unassigned neighbours (similarity >= `threshold`)
+    becomes a centroid and takes them as its cluster; this repeats until every
+    model is assigned. Returns the cluster index (0 for the first, largest
+    cluster) and the centroid index of every model.
+    """
+    n_models = len(similarity)
+    neighbours = np.nan_to_num(similarity, nan=0.0) >= threshold
+    np.fill_diagonal(neighbours, True)
+    counts = neighbours.sum(axis=1)
+    unassigned = np.ones(n_models, dtype=bool)
+    cluster = np.full(n_models, -1)
+    centroid = np.full(n_models, -1)
+    n_clusters = 0
+    while unassigned.any():
+        leader = int(np.argmax(np.where(unassigned, counts, -1)))
+        members = neighbours[leader] & unassigned
+        cluster[members] = n_clusters
+        centroid[members] = leader
+        unassigned &= ~members
+        counts -= neighbours[:, members].sum(axis=1)
+        n_clusters += 1
+    return cluster, centroid
+
+
+def write_consensus(matrix, names, output_path, threshold = 0.5):
+    """
+    Write models ranked by consensus score, with their cluster and its centroid, as a tab-separated table.
+    """
+    import pandas as pd
+
+    similarity, consensus = consensus_scores(matrix)
+    cluster, centroid = cluster_models(similarity, threshold)
+    data = pd.DataFrame({
+        "model": names,
+        "consensus": consensus.round(4),
+        "n_pairs": (~np.isnan(similarity)).sum(axis=1),
+        "cluster": cluster,
+        "centroid": [names[index] for index in centroid],
+    })
+    data = data.sort_values("consensus", ascending=False, kind="stable", na_position="last")
+    data["rank"] = range(1, len(data) + 1)
+    data.to_csv(output_path, index=False, sep="\t")
+    logging.info(f"Ranked {len(data)} models in {cluster.max() + 1 if len(data) else 0} clusters, see {output_path}")
+
+
+def reduce_shards(output_dir, n_shards, threshold = 0.5):
+    """
+    Merge the shard matrices of `output_dir` into `tm_matrix.npy` and write the consensus table.
+    """
+    output_dir = os.path.abspath(output_dir)
+    matrix = None
+    for path in shard_paths(os.path.join(output_dir, MATRIX_NAME), n_shards):
+        part = np.load(path, mmap_mode="r")
+        matrix = np.array(part) if matrix is None else np.fmax(matrix, part)
+    missing = int(np.isnan(matrix).sum())
+    if missing:
+        logging.warning(f"{missing // 2} pairs are missing from the shards.")
+    matrix_path = os.path.join(output_dir, MATRIX_NAME)
+    np.save(matrix_path + ".tmp.npy", matrix)
+    os.replace(matrix_path + ".tmp.npy", matrix_path)
+    write_consensus(matrix, read_models(output_dir), os.path.join(output_dir, CONSENSUS_NAME), threshold)
+
+
+def main(args):
+    model_dir = os.path.abspath(args.model_dir)
+    output_dir = os.path.abspath(args.output_dir)
+    models = sorted(
+        os.path.join(model_dir, model) for model in os.listdir(model_dir) if has_extension(model, (".pdb", ".cif"))
+    )
+    matrix_path = all_vs_all(
+        models, output_dir, args.backend, args.n_cpu, args.chunk_size, args.extra_args,
+        args.timeout, args.retries, args.shard,
+    )
+    if args.shard is None:
+        write_consensus(
+            np.load(matrix_path, mmap_mode="r"), read_models(output_dir),
+            os.path.join(output_dir, CONSENSUS_NAME), args.cluster_threshold,
+        )
+
+
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description=
+                                     "All-vs-all TM-scores of a model pool with consensus ranking and clustering.")
+    parser.add_argument("model_dir", help="Directory of the models (.pdb or .cif).")
+    parser.add_argument("output_dir", help=
+                        "Directory of tm_matrix.npy, models.txt and consensus.csv. Rerunning resumes an interrupted run.")
+    parser.add_argument("--backend", choices=["usalign", "native"], default="usalign", help=
+                        "'native' scores models sharing one sequence with the built-in vectorized TM-score engine.")
+    parser.add_argument("--n_cpu", type=int, default=1, help="Number of concurrent USalign runs or native workers.")
+    parser.add_argument("--chunk_size", type=int, default=256, help="Pairs per chunk (the unit of sharding and native batches).")
+    parser.add_argument("--extra_args", nargs="*", default=None, help="Additional arguments for USalign.")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which a USalign run is killed.")
+    parser.add_argument("--retries", type=int, default=0, help="Retries for USalign runs that time out or crash.")
+    parser.add_argument("--cluster_threshold", type=float, default=0.5, help=
+                        "Symmetric TM-score at or above which two models are neighbours in the clustering.")
+    parser.add_argument("--shard", type=parse_shard, default=None, help=
+                        "Score only shard I of N (0-based, e.g. 3/8) of the pairs; merge the shards with "
+                        "\"python -m PDBToolkit.shard reduce tm_matrix OUTPUT_DIR --n_shards N\".")
+    parser.add_argument("--trace", type=str, default=None, help=
+                        "Write a Chrome trace JSON of the run to this path and print a timing summary.")
+    args = parser.parse_args(argv)
+
+    print("-----------------------------------------------------------------------------", flush=True)
+    print("User settings:", flush=True)
+    for key, value in vars(args).items():
+        print(f"{key}: {value}", flush=True)
+    print("-----------------------------------------------------------------------------", flush=True)
+
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,168 @@
+"""
+Native clash detection over NumPy coordinates.
+
+Close atom pairs are found with a cell list, so the cost grows linearly with the
+number of atoms. Two atoms clash when their van der Waals spheres overlap by at
+least 0.4 A, as in MolProbity; polar N/O pairs get extra room for hydrogen bonds.
+Pairs within three covalent bonds of each other and pairs of different alternate
+locations are not scored. Bonds are assigned from covalent radii within residues,
+between consecutive polymer residues and between cysteine SG atoms. Atoms of
+elements without a radius (metal ions) are skipped. Without hydrogens the values
+are lower than phenix.clashscore, which adds them; use them to rank or prefilter.
+"""
+import numpy as np
+
+from PDBToolkit.PDBOps.atom_table import read_structure
+from PDBToolkit.tracing import traced
+
+VDW_RADII = {
+    "H": 1.10, "C": 1.70, "N": 1.55, "O": 1.52, "S": 1.80, "P": 1.80,
+    "SE": 1.90, "F": 1.47, "CL": 1.75, "BR": 1.85, "I": 1.98,
+}
+COVALENT_RADII = {
+    "H": 0.31, "C": 0.76, "N": 0.71, "O": 0.66, "S": 1.05, "P": 1.07,
+    "SE": 1.20, "F": 0.57, "CL": 1.02, "BR": 1.20, "I": 1.39,
+}
+CLASH_OVERLAP = 0.4
+HBOND_ALLOWANCE = 0.3
+BOND_TOLERANCE = 0.45
+EXCLUDED_BONDS = 3
+CHUNK_SIZE = 1 << 16
+
+_HALF_SHELL = [(0, 0, 0)] + [
+    (dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)
+]
+
+
+def _expand(starts, counts):
+    """
+    Concatenate the ranges `[start, start + count)`.
+    """
+    total = counts.sum()
+    return np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+
+def close_pairs(coord, cutoff):
+    """
+    All atom pairs `(i, j)` with `i < j` closer than `cutoff`, and their distances.
+
+    Atoms are binned into cubic cells of edge `cutoff`; each cell is compared with
+    itself and half of its 26 neighbours, in chunks of atoms to bound memory.
+    """
+    coord = np.asarray(coord, dtype=np.float64)
+    if len(coord) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    cells = np.floor((coord - coord.min(axis=0)) / cutoff).astype(np.int64)
+    shape = cells.max(axis=0) + 1
+    keys = np.ravel_multi_index(cells.T, shape)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    pairs_i, pairs_j, distances = [], [], []
+    for offset in _HALF_SHELL:
+        neighbour = cells + offset
+        atoms = np.flatnonzero(((neighbour >= 0) & (neighbour < shape)).all(axis=1))
+        for chunk_start in range(0, len(atoms), CHUNK_SIZE):
+            chunk = atoms[chunk_start:chunk_start + CHUNK_SIZE]
+            neighbour_keys = np.ravel_multi_index(neighbour[chunk].T, shape)
+            starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+            ends = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+            if offset == (0, 0, 0):
+                starts = position[chunk] + 1
+            counts = np.maximum(ends - starts, 0)
+            i = np.repeat(chunk, counts)
+            j = order[_expand(starts, counts)]
+            distance = np.sqrt(((coord[i] - coord[j]) ** 2).sum(axis=1))
+            close = distance < cutoff
+            pairs_i.append(np.minimum(i[close], j[close]))
+            pairs_j.append(np.maximum(i[close], j[close]))
+            distances.append(distance[close])
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(distances)
+
+
+def _neighbours_within(n_atoms, bonds_i, bonds_j, n_bonds):
+    """
+    Keys `i * n_atoms + j` (i < j) of atom pairs joined by a path of at most `n_bonds` bonds.
+    """
+    source = np.concatenate([bonds_i, bonds_j])
+    target = np.concatenate([bonds_j, bonds_i])
+    order = np.argsort(source, kind="stable")
+    neighbours = target[order]
+    offsets = np.searchsorted(source[order], np.arange(n_atoms + 1))
+
+    keys = []
+    start, end = source, target
+    for step in range(n_bonds):
+        keys.append(np.minimum(start, end) * n_atoms + np.maximum(start, end))
+        if step == n_bonds - 1:
+            break
+        counts = offsets[end + 1] - offsets[end]
+        next_end = neighbours[_expand(offsets[end], counts)]
+        start = np.repeat(start, counts)
+        keep = next_end != start
+        start, end = start[keep], next_end[keep]
+    return np.unique(np.concatenate(keys))
+
+
+@traced("find_clashes")
+def find_clashes(table):
+    """
+    Return `(clashscore, clashes)` for an AtomTable.
+
+    `clashscore` is the number of clashes per 1000 scored atoms; `clashes` lists
+    `(atom_a, atom_b, overlap)` with atoms labelled `chain:resname resseq icode:name`.
+    """
+    element = np.char.upper(np.char.strip(table.element.astype(str)))
+    vdw = np.array([VDW_RADII.get(e, np.nan) for e in element.tolist()])
+    covalent = np.array([COVALENT_RADII.get(e, np.nan) for e in element.tolist()])
+    scored = ~np.isnan(vdw)
+    atoms = np.flatnonzero(scored)
+    n_atoms = len(table.element)
+    if not len(atoms):
+        return 0.0, []
+
+    cutoff = 2 * max(VDW_RADII.values()) - CLASH_OVERLAP
+    i, j, distance = close_pairs(table.coord[atoms], cutoff)
+    i, j = atoms[i], atoms[j]
+
+    residue = np.repeat(np.arange(len(table.residue_starts) - 1), np.diff(table.residue_starts))
+    chain = np.repeat(np.arange(len(table.chain_starts) - 1), np.diff(table.chain_starts))
+    polymer = ~table.hetatm
+    name = np.char.strip(table.name.astype(str))
+    linked = (
+        (residue[i] == residue[j])
+        | ((chain[i] == chain[j]) & (np.abs(residue[i] - residue[j]) == 1) & polymer[i] & polymer[j])
+        | ((name[i] == "SG") & (name[j] == "SG"))
+    )
+    bonded = linked & (distance < covalent[i] + covalent[j] + BOND_TOLERANCE)
+    excluded = _neighbours_within(n_atoms, i[bonded], j[bonded], EXCLUDED_BONDS)
+
+    altloc = np.char.strip(table.altloc.astype(str))
+    polar = np.isin(element, ["N", "O"])
+    allowed = CLASH_OVERLAP + np.where(polar[i] & polar[j], HBOND_ALLOWANCE, 0)
+    overlap = vdw[i] + vdw[j] - distance
+    clash = (
+        (overlap >= allowed)
+        & ~np.isin(i * n_atoms + j, excluded)
+        & ~((altloc[i] != "") & (altloc[j] != "") & (altloc[i] != altloc[j]))
+    )
+
+    def label(atom):
+        return f"{table.chain_id[atom]}:{table.resname[atom]} {table.resseq[atom]}{table.icode[atom].strip()}:{name[atom]}"
+
+    clashes = [
+        (label(a), label(b), round(float(value), 3))
+        for a, b, value in zip(i[clash].tolist(), j[clash].tolist(), overlap[clash].tolist())
+    ]
+    clashes.sort(key=lambda clash: -clash[2])
+    return len(clashes) * 1000 / len(atoms), clashes
+
+
+def calc_native_clashscore(file):
+    """
+    Clashscore and clashing atom pairs of a PDB or mmCIF file.
+    """
+    clashscore, clashes = find_clashes(read_structure(file))
+    return round(clashscore, 2), clashes
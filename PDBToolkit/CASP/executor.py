@@ -0,0 +1,195 @@
+"""
+Shared asyncio execution layer for external binaries (USalign, phenix).
+
+One controller process keeps up to `max_concurrency` binaries running; waiting on
+a child costs a coroutine instead of a forked Python worker. Every run has an
+optional timeout after which its whole process group is killed, and timed-out or
+crashed (killed by a signal) runs are retried with exponential backoff. Standard
+output is parsed line by line as it arrives.
+"""
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+import weakref
+import resource
+from collections import deque
+
+from PDBToolkit import tracing
+
+TAIL_LINES = 200
+
+
+class JobResult:
+    """
+    Outcome of one command: return code, regex matches from stdout, the stdout tail and stderr.
+    """
+
+    def __init__(self, command, returncode, matches, stdout, stderr, attempts, elapsed, timed_out = False):
+        self.command = command
+        self.returncode = returncode
+        self.matches = matches
+        self.stdout = stdout
+        self.stderr = stderr
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def error(self):
+        if self.timed_out:
+            return f"timed out after {self.attempts} attempt(s)"
+        return self.stderr.strip() or f"exit status {self.returncode}"
+
+    def check(self):
+        """
+        Raise `subprocess.SubprocessError` unless the command succeeded.
+        """
+        if not self.ok:
+            raise subprocess.SubprocessError(f"Error occurred while running {os.path.basename(self.command[0])}: {self.error()}")
+        return self
+
+
+class SubprocessExecutor:
+    """
+    Run commands concurrently under a semaphore with timeouts and retries.
+
+    `timeout` is in seconds per attempt (None waits forever); a run that times out
+    or dies from a signal is retried up to `retries` times, sleeping `backoff`,
+    `2 * backoff`, ... seconds in between. Ordinary non-zero exits are not retried.
+    """
+
+    def __init__(self, max_concurrency = 1, timeout = None, retries = 0, backoff = 1.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._staging = weakref.WeakKeyDictionary()
+        self._children_cpu = 0.0
+
+    def _semaphore(self):
+        """
+        The semaphore of the running loop and its free lanes (trace rows, one per running job).
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = (asyncio.Semaphore(self.max_concurrency), list(range(self.max_concurrency, 0, -1)))
+        return self._semaphores[loop]
+
+    def staging(self):
+        """
+        Semaphore of the running loop admitting `max_concurrency` jobs at a time to prepare their inputs.
+
+        Jobs that stage files before `run` (e.g. decompressed copies in scratch
+        space) hold it around staging and running, so only the files of about as
+        many jobs as can run exist at once.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._staging:
+            self._staging[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._staging[loop]
+
+    def _record(self, start):
+        """
+        Add the wall time and the CPU time of reaped children since the last call to the trace counters.
+
+        CPU time comes from RUSAGE_CHILDREN, so with concurrent jobs it is only
+        attributed approximately to each job; the totals are exact.
+        """
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        children_cpu = usage.ru_utime + usage.ru_stime
+        cpu, self._children_cpu = children_cpu - self._children_cpu, children_cpu
+        tracing.count("subprocesses")
+        tracing.count("subprocess_wall_s", time.perf_counter() - start)
+        tracing.count("subprocess_cpu_s", cpu)
+        return cpu
+
+    async def run(self, command, pattern = None, timeout = None):
+        """
+        Run `command` and return a `JobResult`.
+
+        `pattern` (a regex with one group) is searched in every stdout line as it
+        arrives; the first group of each match is collected in `result.matches`.
+        `timeout` replaces the executor's timeout for this command, e.g. for a batch
+        doing the work of several jobs.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        command = [str(arg) for arg in command]
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        semaphore, lanes = self._semaphore()
+        queued = time.perf_counter()
+        async with semaphore:
+            start = time.perf_counter()
+            tracing.count("queue_wait_s", start - queued)
+            lane = lanes.pop()
+            try:
+                for attempt in range(1, self.retries + 2):
+                    with tracing.span(os.path.basename(command[0]), "subprocess", tid=lane, attempt=attempt) as job:
+                        attempt_start = time.perf_counter()
+                        result = await self._attempt(command, pattern, timeout)
+                        if tracing.enabled():
+                            job.args.update(returncode=result.returncode, cpu_s=round(self._record(attempt_start), 3))
+                    result.attempts = attempt
+                    result.elapsed = time.perf_counter() - start
+                    if not (result.timed_out or result.returncode < 0) or attempt > self.retries:
+                        return result
+                    delay = self.backoff * 2 ** (attempt - 1)
+                    logging.warning(f"{os.path.basename(command[0])} failed ({result.error()}), retrying in {delay:.1f} s")
+                    await asyncio.sleep(delay)
+            finally:
+                lanes.append(lane)
+
+    async def _attempt(self, command, pattern, timeout):
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True
+        )
+        matches = []
+        tail = deque(maxlen=TAIL_LINES)
+
+        async def read_stdout():
+            async for line in process.stdout:
+                line = line.decode(errors="replace")
+                tail.append(line)
+                if pattern is not None:
+                    match = pattern.search(line)
+                    if match:
+                        matches.append(match.group(1))
+
+        async def communicate():
+            _, stderr = await asyncio.gather(read_stdout(), process.stderr.read())
+            await process.wait()
+            return stderr.decode(errors="replace")
+
+        try:
+            stderr = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            return JobResult(command, None, matches, "".join(tail), "", 1, 0.0, timed_out=True)
+        finally:
+            if process.returncode is None:
+                _kill_group(process)
+                await process.wait()
+        return JobResult(command, process.returncode, matches, "".join(tail), stderr, 1, 0.0)
+
+    def gather(self, coroutines):
+        """
+        Run coroutines (typically built on `run`) on a fresh event loop and return their results in order.
+        """
+        async def gather_all():
+            return await asyncio.gather(*coroutines)
+
+        return asyncio.run(gather_all())
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
@@ -2,7 +2,7 @@
 Calculate phenix clashscore.
 """
 import os
-import subprocess
+import asyncio
 from multiprocessing import Pool
 import json
 import logging
@@ -10,66 +10,165 @@ import re
 import argparse
 
 from PDBToolkit.config import PHENIX_CLASHSCORE_PATH
+from PDBToolkit.cache import ResultCache
+from PDBToolkit.CASP.executor import SubprocessExecutor
+from PDBToolkit.PDBOps.compression import decompressed_async, has_extension
+from PDBToolkit.tracing import tracing
+from PDBToolkit.shard import parse_shard, select_shard, shard_path
 
 logging.basicConfig(level=logging.INFO)
 
 
-def calc_clashscore(file):
-    command = [
-        PHENIX_CLASHSCORE_PATH, file,
-        'nuclear=True',
-        'keep_hydrogens=True'
-    ]
-    result = subprocess.run(command, capture_output=True, text=True)
+PHENIX_ARGS = ['nuclear=True', 'keep_hydrogens=True']
+CLASHSCORE_PATTERN = re.compile(r'clashscore\s*=\s*([\d.]+)')
 
-    if result.returncode != 0:
-        logging.error(f"Error processing {file}: {result.stderr.strip()}")
+
+def calc_clashscore(file, cache = None, executor = None):
+    executor = executor or SubprocessExecutor()
+    return asyncio.run(calc_clashscore_async(file, cache, executor))
+
+
+async def calc_clashscore_async(file, cache, executor):
+    if cache is not None:
+        key = cache.key([PHENIX_CLASHSCORE_PATH] + PHENIX_ARGS, [file])
+        cached = cache.get(key)
+        if cached is not None:
+            logging.info(f"Clashscore for {file}: {cached['clashscore']} (cached)")
+            return cached["clashscore"]
+
+    async with executor.staging(), decompressed_async(file) as plain_file:
+        command = [PHENIX_CLASHSCORE_PATH, plain_file] + PHENIX_ARGS
+        result = await executor.run(command, CLASHSCORE_PATTERN)
+
+    if not result.ok:
+        logging.error(f"Error processing {file}: {result.error()}")
+        return None
+    if not result.matches:
+        logging.error(f"Error parsing clashscore for {file}: {result.stdout.strip()}")
         return None
     
-    match = re.search(r'clashscore\s*=\s*([\d.]+)', result.stdout)
-    clashscore = float(match.group(1))
+    clashscore = float(result.matches[0])
     logging.info(f"Clashscore for {file}: {clashscore}")
+    if cache is not None:
+        cache.put(key, {"clashscore": clashscore})
     
     return clashscore
 
-def wrapper(file):
-    clashscore = calc_clashscore(file)
-    return file, clashscore
-
-
-def process_in_parallel(file_list, output_path, n_cpu):
-    with Pool(n_cpu) as pool:
-        results = pool.map(wrapper, file_list)
-    results = dict(results)
+def native_wrapper(file):
+    from PDBToolkit.CASP.clash import calc_native_clashscore
+
+    clashscore, clashes = calc_native_clashscore(file)
+    logging.info(f"Native clashscore for {file}: {clashscore}")
+    return file, clashscore, clashes
+
+
+def source_path(output_path):
+    """
+    `out/clash.json` -> `out/clash_source.json`, the engine that scored each file of a prefiltered run.
+    """
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_source{ext}"
+
+
+def process_in_parallel(file_list, output_path, n_cpu, cache = None, backend = "phenix", prefilter = None, pairs_path = None, timeout = None, retries = 0, sources_path = None):
+    """
+    Score files with phenix.clashscore or the native clash engine.
+
+    With `prefilter=(low, high)`, every file is first scored natively and only files
+    whose native clashscore lies within `[low, high]` are sent to phenix; the others
+    keep their native score, which is systematically lower (no hydrogens, see
+    `clash`). `sources_path` receives `{file: "native" or "phenix"}` so the two
+    scales are not mixed blindly. `pairs_path` receives the native clashing atom
+    pairs. Up to `n_cpu` phenix runs go concurrently, each killed after `timeout` seconds.
+    """
+    native = {}
+    if backend == "native" or prefilter is not None:
+        with Pool(n_cpu) as pool:
+            for file, clashscore, clashes in pool.map(native_wrapper, file_list):
+                native[file] = (clashscore, clashes)
+
+    if backend == "native":
+        results = {file: native[file][0] for file in file_list}
+        sources = {file: "native" for file in file_list}
+    else:
+        if prefilter is not None:
+            low, high = prefilter
+            phenix_files = [file for file in file_list if low <= native[file][0] <= high]
+            logging.info(f"Prefilter sends {len(phenix_files)} of {len(file_list)} files to phenix.")
+        else:
+            phenix_files = file_list
+        executor = SubprocessExecutor(n_cpu, timeout, retries)
+        phenix = dict(zip(phenix_files, executor.gather([calc_clashscore_async(file, cache, executor) for file in phenix_files])))
+        results = {file: phenix[file] if file in phenix else native[file][0] for file in file_list}
+        sources = {file: "phenix" if file in phenix else "native" for file in file_list}
+        if cache is not None:
+            cache.prune()
 
     with open(output_path, 'w') as f:
         json.dump(results, f, indent=4)
+    if sources_path is not None:
+        with open(sources_path, 'w') as f:
+            json.dump(sources, f, indent=4)
+    if pairs_path is not None:
+        with open(pairs_path, 'w') as f:
+            json.dump({file: clashes for file, (_, clashes) in native.items()}, f, indent=4)
 
 
 def main(args):
     if args.file:
         files = [args.file]
     if args.directory:
-        files = [os.path.join(args.directory, f) for f in os.listdir(args.directory) if f.endswith('.pdb')]
+        files = [os.path.join(args.directory, f) for f in os.listdir(args.directory) if has_extension(f, '.pdb')]
     if args.list:
         with open(args.list, 'r') as file_list:
             files = [line.strip() for line in file_list]
+    files = select_shard(sorted(files), args.shard)
 
-    output_path = os.path.abspath(args.output_path)
+    output_path = shard_path(os.path.abspath(args.output_path), args.shard)
     dirname = os.path.dirname(output_path)
     os.makedirs(dirname, exist_ok=True)
 
-    process_in_parallel(files, output_path, args.n_cpu)
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_max_gb * 2 ** 30) if args.cache_max_gb else None
+        cache = ResultCache(args.cache_dir, max_bytes)
 
+    pairs_path = shard_path(os.path.abspath(args.pairs_path), args.shard) if args.pairs_path else None
+    sources_path = None
+    if args.prefilter is not None and args.backend == 'phenix':
+        sources_path = shard_path(source_path(os.path.abspath(args.output_path)), args.shard)
+    process_in_parallel(files, output_path, args.n_cpu, cache, args.backend, args.prefilter, pairs_path, args.timeout, args.retries, sources_path)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Calculate phenix clashscore.')
+
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Calculate phenix clashscore.')
     parser.add_argument('-f', '--file', type=str, help='Single PDB file to process.')
     parser.add_argument('-d', '--directory', type=str, help='Directory containing PDB files.')
     parser.add_argument('-l', '--list', type=str, help='File containing list of PDB files.')
     parser.add_argument('output_path', type=str, help='Path to the output file.')
     parser.add_argument('--n_cpu', type=int, default=1, help='Number of CPUs to use for parallel processing.')
-    args = parser.parse_args()
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds after which a phenix run is killed.')
+    parser.add_argument('--retries', type=int, default=0, help='Retries for phenix runs that time out or crash.')
+    parser.add_argument('--cache_dir', type=str, default=None, help=
+                        'Directory of the result cache. Reruns on unchanged files reuse cached clashscores.')
+    parser.add_argument('--cache_max_gb', type=float, default=None, help=
+                        'Evict least recently used cache entries above this size.')
+    parser.add_argument('--backend', choices=['phenix', 'native'], default='phenix', help=
+                        "'native' scores clashes with the built-in cell-list engine instead of phenix.")
+    parser.add_argument('--prefilter', type=float, nargs=2, default=None, metavar=('LOW', 'HIGH'), help=
+                        'Score natively first and send only files with a native clashscore in [LOW, HIGH] to phenix. '
+                        'The engine behind each score is written to OUTPUT_source.json, as native scores run lower.')
+    parser.add_argument('--pairs_path', type=str, default=None, help=
+                        'Write the clashing atom pairs found by the native engine to this JSON file.')
+    parser.add_argument('--shard', type=parse_shard, default=None, help=
+                        'Process only shard I of N (0-based, e.g. 3/8) of the files and write '
+                        'OUTPUT.shardI-of-N.EXT; see "python -m PDBToolkit.shard".')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -80,5 +179,12 @@ if __name__ == "__main__":
     options = [args.file, args.directory, args.list]
     if options.count(None) != 2:
         raise ValueError("You must specify exactly one of --file, --directory, or --list.")
+    if args.pairs_path and args.backend != 'native' and args.prefilter is None:
+        raise ValueError("--pairs_path requires --backend native or --prefilter.")
 
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,61 +1,123 @@
 """
 Calculate QA scores and rank for CASP models.
+
+numpy, the structure and confidence readers and multiprocessing are imported where they are
+used, so that `--help` starts quickly.
 """
+import io
 import os
-import subprocess
+import posixpath
 import shutil
 import zipfile
-from pathlib import Path
 import json
-import pandas as pd
 import argparse
-import numpy as np
-from multiprocessing import Pool
 import logging
-from Bio import PDB
+
+from PDBToolkit.cache import hash_file
+from PDBToolkit.tracing import count, span, traced, tracing
+from PDBToolkit.shard import parse_shard, select_shard, shard_path, shard_paths
 
 logging.basicConfig(level=logging.INFO)
-cif2pdb_path = Path(__file__).parent.parent / "PDBOps" / "cif2pdb.py"
 
+MANIFEST_NAME = "manifest.json"
+METRIC_FORMATS = {
+    "plddt": '{:.4f}',
+    "ipae": '{:.2f}',
+    "ipae_min": '{:.2f}',
+    "contact_ipae": '{:.2f}',
+    "interface_plddt": '{:.4f}',
+}
 
-def extract_files(zip_file, target_dir):
-    with zipfile.ZipFile(zip_file, "r") as zip_ref:
-        for file in zip_ref.namelist():
-            if file.endswith(".cif") or ("summary" in file and file.endswith(".json")):
-                zip_ref.extract(file, target_dir)
 
-def calc_qa(directory, only_ptm = False):
-    ptm_list = []
-    iptm_list = []
-    has_clash_list = []
-    pdb_list = []
-    qa_list = []
-    for file in os.listdir(directory):
-        name, ext = os.path.splitext(file)
-        if ext == ".json":
-            pdb_file = name.replace("summary_confidences", "model") + ".pdb"
-            pdb_list.append(pdb_file)
-            with open(os.path.join(directory, file), "r") as f:
+def summary_record(pdb_file, metrics):
+    return {
+        "file": pdb_file,
+        "iptm": metrics["iptm"],
+        "ptm": metrics["ptm"],
+        "has_clash": metrics["has_clash"],
+    }
+
+
+def model_stem(directory, model_name):
+    """
+    Output name of the model `model_name` in the zip folder `directory`.
+
+    The folders are prefixed (`job/fold_job_model_0` -> `job_fold_job_model_0`), so
+    models of different jobs in one zip do not overwrite each other.
+    """
+    return "_".join(directory.split("/") + [model_name]) if directory else model_name
+
+
+@traced("ingest_zip")
+def ingest_zip(zip_file, output_dir, renumber = True, pae = False):
+    """
+    Convert the models of one AF3 zip to PDB without extracting the archive.
+
+    Each summary JSON and its model CIF are read straight from the zip. The model
+    is parsed once, and that parse gives both the PDB file and the pLDDT. With `pae`,
+    the full_data JSON is streamed into `<model>.pae.npy` and `<model>.contact_probs.npy`
+    and the interface metrics of `interface_metrics` are added. Returns one record
+    per model with its summary metrics and pLDDT (and the matrices written, under
+    "matrices"). Models are named by `model_stem`.
+    """
+    import numpy as np
+    from PDBToolkit.PDBOps.atom_table import read_mmcif_handle, write_pdb
+    from PDBToolkit.CASP.af3_confidence import MATRIX_KEYS, read_full_data, residue_plddt, interface_metrics
+
+    records = []
+    with zipfile.ZipFile(zip_file, "r") as zip_ref:
+        members = set(zip_ref.namelist())
+        for member in sorted(members):
+            directory, filename = posixpath.split(member)
+            name, ext = os.path.splitext(filename)
+            if ext != ".json" or "summary_confidences" not in name:
+                continue
+            model_name = name.replace("summary_confidences", "model")
+            with zip_ref.open(member) as f:
                 metrics = json.load(f)
-                iptm = metrics["iptm"]
-                ptm = metrics["ptm"]
-                has_clash = metrics["has_clash"]
-                if only_ptm:
-                    qa = ptm
-                else:
-                    qa = iptm * 0.8 + ptm * 0.2
-                has_clash_list.append(has_clash)
-                iptm_list.append(iptm)
-                ptm_list.append(ptm)
-                qa_list.append(qa)
-
-    data = pd.DataFrame({
-        "file": pdb_list, 
-        "iptm": iptm_list, 
-        "ptm": ptm_list, 
-        "has_clash": has_clash_list,
-        "qa": qa_list, 
-    })
+            with zip_ref.open(posixpath.join(directory, model_name + ".cif")) as f:
+                table = read_mmcif_handle(io.TextIOWrapper(f))
+
+            stem = model_stem(directory, model_name)
+            pdb_file = stem + ".pdb"
+            write_pdb(table, os.path.join(output_dir, pdb_file), renumber=renumber)
+            record = summary_record(pdb_file, metrics)
+            record["plddt"] = np.mean(table.bfactor) / 100
+            full_data_member = posixpath.join(directory, name.replace("summary_confidences", "full_data") + ".json")
+            if pae and full_data_member in members:
+                with zip_ref.open(full_data_member) as f:
+                    full_data = read_full_data(f, os.path.join(output_dir, stem))
+                record["matrices"] = [key for key in MATRIX_KEYS if isinstance(full_data.get(key), np.ndarray)]
+                interface, pairs = interface_metrics(
+                    full_data["pae"], full_data.get("contact_probs"),
+                    full_data["token_chain_ids"], full_data["token_res_ids"], residue_plddt(table),
+                )
+                record.update(interface)
+                record["pair_ipae"] = " ".join(f"{pair}:{value:.2f}" for pair, value in pairs.items())
+            records.append(record)
+    count("models_ingested", len(records))
+    return records
+
+
+@traced("rank_models")
+def rank_models(records, only_ptm = False):
+    """
+    Rank model records by `iptm * 0.8 + ptm * 0.2` (or ptm alone) into the qa.csv table.
+    """
+    import numpy as np
+    import pandas as pd
+
+    # the matrices written for a model are bookkeeping for the manifest, not a metric
+    data = pd.DataFrame(records).drop(columns="matrices", errors="ignore")
+    for column in ["file", "iptm", "ptm", "has_clash", "plddt"]:
+        if column not in data:
+            data[column] = np.nan
+    metrics = data[[column for column in data.columns if column not in ["file", "iptm", "ptm", "has_clash"]]]
+    data = data[["file", "iptm", "ptm", "has_clash"]].copy()
+    if only_ptm:
+        data["qa"] = data["ptm"]
+    else:
+        data["qa"] = data["iptm"] * 0.8 + data["ptm"] * 0.2
     data["qa"] = data["qa"].map('{:.3f}'.format)
     data["ptm"] = data["ptm"].map('{:.2f}'.format)
     if only_ptm:
@@ -64,70 +126,211 @@ def calc_qa(directory, only_ptm = False):
         data["iptm"] = data["iptm"].map('{:.2f}'.format)
     data.sort_values(by="qa", ascending=False, inplace=True)
     data["rank"] = [f"rank_{i}.pdb" for i in range(1, len(data) + 1)]
+    for column in metrics.columns:
+        if metrics[column].notna().any():
+            data[column] = metrics[column][data.index].map(METRIC_FORMATS.get(column, '{}').format)
 
     return data
+
+
+def calc_qa(directory, only_ptm = False):
+    records = []
+    for file in os.listdir(directory):
+        name, ext = os.path.splitext(file)
+        if ext == ".json":
+            pdb_file = name.replace("summary_confidences", "model") + ".pdb"
+            with open(os.path.join(directory, file), "r") as f:
+                records.append(summary_record(pdb_file, json.load(f)))
+
+    return rank_models(records, only_ptm)
     
 def calc_plddt(pdb_file):
-    parser = PDB.PDBParser(QUIET=True)
-    model = parser.get_structure('structure', pdb_file)[0]
-
-    b_factors = [
-        atom.bfactor 
-        for chain in model
-        for residue in chain
-        for atom in residue
-    ]
-
-    return np.mean(b_factors) / 100
-
-def calc_plddt_wrapper(file):
-    plddt = calc_plddt(file)
-    return file, plddt
-
-def qa_pipeline(input_dir, output_dir, renumber = True, no_clash = False, only_ptm = False, n_cpu = 1):
-    # unzip
-    for file in os.listdir(input_dir):
-        if file.endswith(".zip"):
-            extract_files(os.path.join(input_dir, file), output_dir)
-    # cif to pdb
-    logging.info("Running cif2pdb.py")
-    cif2pdb_args = [
-        "python", str(cif2pdb_path), 
-        output_dir, output_dir, 
-        "--n_cpu", str(n_cpu)
-    ]
-    if not renumber:
-        cif2pdb_args.append("--no_renumber")
-    subprocess.run(cif2pdb_args, check=True)
-    # qa
-    data = calc_qa(output_dir, only_ptm=only_ptm)
-    # plddt
-    with Pool(n_cpu) as pool:
-        plddts = pool.map(calc_plddt_wrapper, [os.path.join(output_dir, f) for f in data["file"].to_list()])
-    plddt_dict = {os.path.basename(file): plddt for file, plddt in plddts}
-    data["plddt"] = data["file"].map(f"{plddt_dict:.4f}")
-    # rank
-    for pdb_file, rank in zip(data["file"], data["rank"]):
-        shutil.copy(os.path.join(output_dir, pdb_file), os.path.join(output_dir, rank))
+    import numpy as np
+    from PDBToolkit.PDBOps.atom_table import read_pdb
+
+    table = read_pdb(pdb_file)
+    return np.mean(table.bfactor) / 100
+
+def link_file(source, target):
+    """
+    Hardlink `source` to `target`, copying only where hardlinks are not supported.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy(source, target)
+
+def model_files(record):
+    """
+    The PDB file of a model record and the matrices written next to it.
+    """
+    stem = os.path.splitext(record["file"])[0]
+    return [record["file"]] + [f"{stem}.{key}.npy" for key in record.get("matrices", [])]
+
+def load_manifest(output_dir, renumber, pae = False, shard = None):
+    """
+    Read the processing manifest of `output_dir` (of one shard, see `shard_path`).
+
+    A missing or unreadable manifest, or one written with other settings, gives an
+    empty manifest so every zip is processed again.
+    """
+    settings = {"renumber": renumber, "pae": pae}
+    try:
+        with open(os.path.join(output_dir, shard_path(MANIFEST_NAME, shard)), "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = None
+    if manifest is None or manifest.get("settings") != settings:
+        manifest = {"settings": settings, "zips": {}}
+    return manifest
+
+def write_atomic(output_path, write):
+    """
+    Write through `write(handle)` into a temporary file that replaces `output_path` when complete.
+    """
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w") as f:
+        write(f)
+    os.replace(temp_path, output_path)
+
+def save_manifest(manifest, output_dir, shard = None):
+    write_atomic(os.path.join(output_dir, shard_path(MANIFEST_NAME, shard)), lambda f: json.dump(manifest, f, indent=1))
+
+def is_current(entry, zip_file, output_dir):
+    """
+    Whether a manifest entry still describes `zip_file` and all files of its models are on disk.
+
+    Size and mtime are compared first; the content hash is computed only when the
+    mtime alone changed, so a touched but identical zip is not processed again.
+    """
+    if entry is None:
+        return False
+    if not all(os.path.exists(os.path.join(output_dir, file)) for record in entry["records"] for file in model_files(record)):
+        return False
+    stat = os.stat(zip_file)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns != entry["mtime_ns"]:
+        if hash_file(zip_file) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+def ingest_entry(zip_file, output_dir, renumber = True, pae = False):
+    """
+    Ingest one zip and return its manifest entry: size, mtime, hash and model records.
+    """
+    stat = os.stat(zip_file)
+    with span("hash_zip"):
+        sha256 = hash_file(zip_file)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "records": ingest_zip(zip_file, output_dir, renumber, pae),
+    }
+
+def _ingest_task(task):
+    zip_name, zip_file, output_dir, renumber, pae = task
+    return zip_name, ingest_entry(zip_file, output_dir, renumber, pae)
+
+def write_ranking(records, output_dir, only_ptm = False, no_clash = False, qa_name = "qa.csv", link_ranks = True):
+    """
+    Rank model records into `qa_name` and, with `link_ranks`, link `rank_<i>.pdb` to the ranked models.
+    """
+    data = rank_models(records, only_ptm=only_ptm)
+    if link_ranks:
+        ranks = set(data["rank"])
+        for file in os.listdir(output_dir):
+            if file.startswith("rank_") and file.endswith(".pdb") and file not in ranks:
+                os.remove(os.path.join(output_dir, file))
+        with span("link_ranks", models=len(data)):
+            for pdb_file, rank in zip(data["file"], data["rank"]):
+                link_file(os.path.join(output_dir, pdb_file), os.path.join(output_dir, rank))
     # clash
     if no_clash:
-        clash_files = data[data["has_clash"] == 1.0]["rank"]
-        for file in clash_files:
-            os.remove(os.path.join(output_dir, file))
+        if link_ranks:
+            for file in data[data["has_clash"] == 1.0]["rank"]:
+                os.remove(os.path.join(output_dir, file))
         data = data[data["has_clash"] == 0.0].copy()
-    
-    data.to_csv(os.path.join(output_dir, "qa.csv"), index=False, sep="\t")
+
+    write_atomic(os.path.join(output_dir, qa_name), lambda f: data.to_csv(f, index=False, sep="\t"))
+
+def qa_pipeline(input_dir, output_dir, renumber = True, no_clash = False, only_ptm = False, n_cpu = 1, force = False, pae = False, shard = None):
+    """
+    Ingest new or changed zips of `input_dir` and rank all models recorded in the manifest.
+
+    The manifest is saved after every finished zip, so a killed run resumes with the
+    zips it had not finished. Models of zips that left `input_dir` are removed.
+
+    With `shard` only the zips of that shard are ingested, into a manifest and a
+    `qa.csv` of their own (see `shard_path`); rank files are made by `reduce_shards`.
+    """
+    from multiprocessing import Pool
+
+    manifest = load_manifest(output_dir, renumber, pae, shard)
+    if force:
+        manifest["zips"] = {}
+    entries = manifest["zips"]
+    zip_names = sorted(file for file in os.listdir(input_dir) if file.endswith(".zip"))
+    if shard is not None:
+        zip_names = [os.path.basename(path) for path in select_shard([os.path.join(input_dir, name) for name in zip_names], shard)]
+    for zip_name in set(entries) - set(zip_names):
+        if shard is not None and os.path.exists(os.path.join(input_dir, zip_name)):
+            # moved to another shard, which now owns its model files
+            del entries[zip_name]
+            continue
+        for record in entries.pop(zip_name)["records"]:
+            for file in model_files(record):
+                if os.path.exists(os.path.join(output_dir, file)):
+                    os.remove(os.path.join(output_dir, file))
+
+    # ingest new and changed zips in parallel
+    with span("check_manifest", zips=len(zip_names)):
+        pending = [
+            zip_name for zip_name in zip_names
+            if not is_current(entries.get(zip_name), os.path.join(input_dir, zip_name), output_dir)
+        ]
+    logging.info(f"Ingesting {len(pending)} of {len(zip_names)} zip files")
+    tasks = [(zip_name, os.path.join(input_dir, zip_name), output_dir, renumber, pae) for zip_name in pending]
+    with span("ingest", zips=len(tasks), n_cpu=n_cpu), Pool(n_cpu) as pool:
+        for zip_name, entry in pool.imap_unordered(_ingest_task, tasks):
+            entries[zip_name] = entry
+            save_manifest(manifest, output_dir, shard)
+    save_manifest(manifest, output_dir, shard)
+
+    # qa and rank
+    records = [record for zip_name in zip_names for record in entries[zip_name]["records"]]
+    write_ranking(records, output_dir, only_ptm, no_clash, shard_path("qa.csv", shard), link_ranks=shard is None)
+
+def reduce_shards(output_dir, n_shards, only_ptm = False, no_clash = False):
+    """
+    Rank the models of all `n_shards` shard manifests of `output_dir` into one `qa.csv` with rank files.
+    """
+    entries = {}
+    for path in shard_paths(os.path.join(output_dir, MANIFEST_NAME), n_shards):
+        with open(path, "r") as f:
+            entries.update(json.load(f)["zips"])
+    # zips in name order, as in an unsharded run, so that ties rank the same
+    records = [record for zip_name in sorted(entries) for record in entries[zip_name]["records"]]
+    write_ranking(records, output_dir, only_ptm, no_clash)
+    logging.info(f"Ranked {len(records)} models of {n_shards} shards.")
 
 def main(args):
     input_dir = os.path.abspath(args.input_dir)
     output_dir = os.path.abspath(args.output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    qa_pipeline(input_dir, output_dir, not args.no_renumber, args.no_clash, args.only_ptm, args.n_cpu)
+    qa_pipeline(input_dir, output_dir, not args.no_renumber, args.no_clash, args.only_ptm, args.n_cpu, args.force, args.pae, args.shard)
     logging.info("QA calculation completed.")
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument("input_dir", help="The directory containing the zip files to be processed")
     parser.add_argument("output_dir", help="The directory where the processed files will be saved")
     parser.add_argument('--no_renumber', action='store_true', help='Do not renumber atoms in the structure.')
@@ -135,7 +338,16 @@ if __name__ == "__main__":
                         'Do not include structures with clashes in the final ranking.')
     parser.add_argument('--only_ptm', action='store_true', help='Only calculate the ptm score.')
     parser.add_argument('--n_cpu', type=int, default=1, help='Number of CPUs to use for processing.')
-    args = parser.parse_args()
+    parser.add_argument('--force', action='store_true', help=
+                        'Ignore the manifest and process every zip file again.')
+    parser.add_argument('--pae', action='store_true', help=
+                        'Stream PAE from the full_data JSON and add interface PAE and pLDDT columns.')
+    parser.add_argument('--shard', type=parse_shard, default=None, help=
+                        'Process only shard I of N (0-based, e.g. 3/8) of the zip files. '
+                        'Merge the shards with "python -m PDBToolkit.shard reduce qa OUTPUT_DIR --n_shards N".')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -143,4 +355,9 @@ if __name__ == "__main__":
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
     
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == "__main__":
+    cli()
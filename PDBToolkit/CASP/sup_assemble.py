@@ -2,45 +2,168 @@
 Superpose and assemble.
 """
 import os
-import subprocess
+import asyncio
 import tempfile
+import subprocess
 import argparse
 import logging
 
+import numpy as np
+
 from PDBToolkit.PDBOps.merge_structure import merge_structures
+from PDBToolkit.PDBOps.atom_table import concatenate, read_structure, write_pdb
+from PDBToolkit.PDBOps.cif_writer import open_mmcif
+from PDBToolkit.PDBOps.pdb_writer import CHAIN_IDS, chain_label
 from PDBToolkit.config import USALIGN_PATH
+from PDBToolkit.CASP.executor import SubprocessExecutor
+from PDBToolkit.PDBOps.compression import compression_from_name, decompressed, decompressed_all, decompressed_async, has_extension, strip_compression, with_compression
+from PDBToolkit.tracing import tracing
 
 logging.basicConfig(level=logging.INFO)
 
 
-def run_usalign(model, reference, output_prefix, extra_args = None):
-    command = [
-        USALIGN_PATH,
-        model, 
-        reference, 
-        "-o", output_prefix
-    ]
-    if extra_args:
-        command.extend(extra_args)
-    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
-    if result.returncode != 0:
-        raise subprocess.SubprocessError(f"Error occurred while running USalign: {result.stderr.strip()}")
+def run_usalign(model, reference, output_prefix, extra_args = None, executor = None):
+    with decompressed_all([model, reference]) as (model, reference):
+        command = [
+            USALIGN_PATH,
+            model, 
+            reference, 
+            "-o", output_prefix
+        ]
+        if extra_args:
+            command.extend(extra_args)
+        executor = executor or SubprocessExecutor()
+        asyncio.run(executor.run(command)).check()
+
+
+def run_usalign_matrix(model, reference, extra_args = None, executor = None):
+    """
+    Run USalign with `-m` and return the rotation (3x3) and translation superposing `model` onto `reference`.
+    """
+    executor = executor or SubprocessExecutor()
+    return asyncio.run(run_usalign_matrix_async(model, reference, extra_args, executor))
+
+
+async def run_usalign_matrix_async(model, reference, extra_args, executor):
+    async with executor.staging(), decompressed_async(model) as model, decompressed_async(reference) as reference:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            matrix_file = os.path.join(temp_dir, "matrix.txt")
+            command = [
+                USALIGN_PATH,
+                model,
+                reference,
+                "-m", matrix_file
+            ]
+            if extra_args:
+                command.extend(extra_args)
+            (await executor.run(command)).check()
+            with open(matrix_file, "r") as f:
+                return parse_matrix(f.read())
+
+
+async def try_usalign_matrix_async(model, reference, extra_args, executor):
+    """
+    `run_usalign_matrix_async` returning `(transform, None)`, or `(None, error)` if the run or its matrix failed.
+    """
+    try:
+        return await run_usalign_matrix_async(model, reference, extra_args, executor), None
+    except (subprocess.SubprocessError, OSError, ValueError) as error:
+        return None, str(error)
+
+
+def parse_matrix(text):
+    """
+    Parse the `m t[m] u[m][0] u[m][1] u[m][2]` rows of a USalign/TM-align matrix file.
+    """
+    rows = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 5 and fields[0] in ("0", "1", "2"):
+            rows[int(fields[0])] = [float(value) for value in fields[1:]]
+    if len(rows) != 3:
+        raise ValueError(f"Could not parse rotation matrix from USalign output:\n{text}")
+    matrix = np.array([rows[i] for i in range(3)])
+    return matrix[:, 1:], matrix[:, 0]
+
 
+def assembly_chains(source, transforms):
+    """
+    Yield the chains of one transformed copy of `source` per `(rotation, translation)`, named by `chain_label`.
+    """
+    index = 0
+    for rotation, translation in transforms:
+        for chain_id, chain in source.transform(rotation, translation).iter_chains():
+            yield chain.rename_chains({chain_id: chain_label(index)})
+            index += 1
 
-def sup_assemble(source_file, target_dir, output_path, renumber = True, extra_args = None):
+
+def write_assembly(source, transforms, output_path, renumber = True, mmcif = False):
+    """
+    Write one copy of the `source` table per `(rotation, translation)` as a single file.
+
+    Chains are named A, B, ... in transform order like `merge_structures` does. As
+    there, more than 62 chains fall back to mmCIF (extension changed to .cif, keeping
+    a compression extension: `out.pdb.gz` -> `out.cif.gz`), where the chain ids
+    continue with AA, AB, ...; `mmcif` always writes mmCIF, one copy at a time.
+    Returns the path of the written file.
+    """
+    if not mmcif and len(transforms) * len(source.chain_ids) > len(CHAIN_IDS):
+        output_path = with_compression(os.path.splitext(strip_compression(output_path))[0] + ".cif", compression_from_name(output_path))
+        logging.warning(f"More than {len(CHAIN_IDS)} chains do not fit in PDB format, writing {output_path}")
+        mmcif = True
+    if mmcif:
+        with open_mmcif(output_path) as writer:
+            for chain in assembly_chains(source, transforms):
+                writer.write_table(chain)
+    else:
+        write_pdb(concatenate(list(assembly_chains(source, transforms))), output_path, renumber=renumber)
+    return output_path
+
+
+def sup_assemble_matrix(source_file, target_files, output_path, renumber = True, extra_args = None, n_cpu = 1, mmcif = False):
+    """
+    Superpose the source onto every target and write the assembly in one pass.
+
+    Up to `n_cpu` USalign runs go concurrently and only return their
+    transformation matrices; the source is read once and each transform is applied
+    in memory. A compressed source is decompressed once for all runs. All runs
+    finish before a failure is raised, so every failed target is logged.
+    """
+    source = read_structure(source_file)
+    executor = SubprocessExecutor(n_cpu)
+    with decompressed(source_file) as source_path:
+        results = executor.gather([
+            try_usalign_matrix_async(source_path, target_file, extra_args, executor) for target_file in target_files
+        ])
+    failed = [(target_file, error) for target_file, (_, error) in zip(target_files, results) if error is not None]
+    for target_file, error in failed:
+        logging.error(f"USalign failed for {target_file}: {error}")
+    if failed:
+        raise subprocess.SubprocessError(f"{len(failed)} of {len(target_files)} alignments failed, no assembly written.")
+    transforms = [transform for transform, _ in results]
+
+    output_path = write_assembly(source, transforms, output_path, renumber, mmcif)
+    logging.info(f"Successfully merged structures into {output_path}")
+    return output_path
+
+
+def sup_assemble(source_file, target_dir, output_path, renumber = True, extra_args = None, matrix = False, n_cpu = 1, mmcif = False):
     output_path = os.path.abspath(output_path)
-    dirname = os.path.basename(output_path)
+    dirname = os.path.dirname(output_path)
     os.makedirs(dirname, exist_ok=True)
-    with tempfile.TemporaryDirectory() as temp_dir:
+    if matrix:
+        target_files = [os.path.join(target_dir, filename) for filename in sorted(os.listdir(target_dir)) if has_extension(filename, '.pdb')]
+        return sup_assemble_matrix(source_file, target_files, output_path, renumber, extra_args, n_cpu, mmcif)
+    with tempfile.TemporaryDirectory() as temp_dir, decompressed(source_file) as source_path:
         sup_structures = []
         for filename in os.listdir(target_dir):
-            if filename.endswith('.pdb'):
+            if has_extension(filename, '.pdb'):
                 target_file = os.path.join(target_dir, filename)
-                output_prefix = os.path.join(temp_dir, f"sup_{filename[:-4]}")
-                run_usalign(source_file, target_file, output_prefix, extra_args)
+                output_prefix = os.path.join(temp_dir, f"sup_{strip_compression(filename)[:-4]}")
+                run_usalign(source_path, target_file, output_prefix, extra_args)
                 sup_structures.append(output_prefix + ".pdb")
 
-        merge_structures(sup_structures, output_path, renumber=renumber)
+        return merge_structures(sup_structures, output_path, renumber=renumber, mmcif=mmcif)
 
 
 def main(args):
@@ -49,12 +172,19 @@ def main(args):
         args.target_dir, 
         args.output_path, 
         not args.no_renumber,
-        args.extra_args
+        args.extra_args,
+        args.matrix,
+        args.n_cpu,
+        args.mmcif
     )
 
 
-if __name__ == '__main__':
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
     parser = argparse.ArgumentParser(
+        prog=prog,
         description="Superimpose source structure onto target structures listed in a directory "
         "and then assemble the resulted structures. When predicting a large complex composed of "
         "multiple identical subunits, you might first predict a small complex composed of truncated "
@@ -69,7 +199,15 @@ if __name__ == '__main__':
     parser.add_argument('output_path', type=str, help="Path to save the merged PDB file.")
     parser.add_argument('--no_renumber', action='store_true', help='Do not renumber atoms in the structure.')
     parser.add_argument('--extra_args', nargs='*', default=None, help='Additional arguments for USalign.')
-    args = parser.parse_args()
+    parser.add_argument('--matrix', action='store_true', help=
+                        'Collect only the USalign rotation matrices and apply them in memory '
+                        'instead of writing and merging superposed files.')
+    parser.add_argument('--n_cpu', type=int, default=1, help='Number of concurrent USalign runs (with --matrix).')
+    parser.add_argument('--mmcif', action='store_true', help=
+                        'Write the assembly as mmCIF without chain id or atom serial limits.')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -77,4 +215,9 @@ if __name__ == '__main__':
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
 
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == '__main__':
+    cli()
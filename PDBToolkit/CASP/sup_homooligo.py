@@ -2,37 +2,153 @@
 Superpose An to Am.
 """
 import os
-from Bio import PDB
+import sys
 import argparse
+import asyncio
 import tempfile
+import hashlib
 import logging
 
-from sup_assemble import sup_assemble
+import numpy as np
+
+from PDBToolkit.CASP.sup_assemble import sup_assemble, try_usalign_matrix_async, write_assembly
+from PDBToolkit.CASP.executor import SubprocessExecutor
+from PDBToolkit.PDBOps.atom_table import read_structure, write_pdb
+from PDBToolkit.PDBOps.batch import FAILURES_NAME, write_failures
+from PDBToolkit.tracing import tracing
 
 logging.basicConfig(level=logging.INFO)
 
 
 def split_chains(input_file, output_dir):
     os.makedirs(output_dir, exist_ok=True)
-    file_extension = os.path.splitext(input_file)[1].lower()
-    if file_extension == '.pdb':
-        parser = PDB.PDBParser()
-    elif file_extension == '.cif' or file_extension == '.mmcif':
-        parser = PDB.MMCIFParser()
-    else:
-        raise ValueError("Unsupported file format. Please provide a PDB or mmCIF file.")
-    io = PDB.PDBIO()
-    
-    model = parser.get_structure('structure', input_file)[0]
-    
-    for chain in model.get_chains():
-        chain_id = chain.id
+    table = read_structure(input_file)
+    for chain_id, chain in table.reorder_chains(table.chain_ids).iter_chains():
         chain_file = os.path.join(output_dir, f"chain_{chain_id}.pdb")
-        io.set_structure(chain)
-        io.save(chain_file)
+        write_pdb(chain, chain_file)
+
+
+def chain_digest(chain):
+    """
+    Hash of a chain's residue sequence and coordinates; equal chains align identically.
+    """
+    digest = hashlib.sha256()
+    digest.update(" ".join(chain.resname[chain.residue_starts[:-1]].tolist()).encode())
+    digest.update(np.ascontiguousarray(chain.coord).tobytes())
+    return digest.hexdigest()
 
 
-def sup_homooligomers(source_file, target_file, output_dir, renumber = True, extra_args = None):
+def split_unique_chains(input_file, output_dir):
+    """
+    Split a structure into chains and write one PDB file per distinct chain.
+
+    Returns a list of `(chain, digest)` in file order and a `{digest: path}` map.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    table = read_structure(input_file)
+    chains = []
+    files = {}
+    for chain_id, chain in table.reorder_chains(table.chain_ids).iter_chains():
+        digest = chain_digest(chain)
+        if digest not in files:
+            files[digest] = os.path.join(output_dir, f"chain_{chain_id}.pdb")
+            write_pdb(chain, files[digest])
+        chains.append((chain, digest))
+    return chains, files
+
+
+async def _align_pair(source_digest, target_digest, source_path, target_path, extra_args, executor):
+    return (source_digest, target_digest, *await try_usalign_matrix_async(source_path, target_path, extra_args, executor))
+
+
+async def _write_assembly(chain, transforms, output_path, renumber):
+    await asyncio.to_thread(write_assembly, chain, transforms, output_path, renumber)
+    logging.info(f"Wrote {output_path}")
+
+
+async def _align_pairs(jobs, executor, on_done):
+    """
+    Align all pairs; the assemblies `on_done` reports complete are written in worker threads meanwhile.
+    """
+    writes = []
+    for future in asyncio.as_completed([_align_pair(*job, executor) for job in jobs]):
+        for assembly in on_done(*(await future)):
+            writes.append(asyncio.create_task(_write_assembly(*assembly)))
+    await asyncio.gather(*writes)
+
+
+def sup_homooligomers_parallel(source_file, target_file, output_dir, renumber = True, extra_args = None, n_cpu = 1):
+    """
+    Superpose every source chain onto every target chain with up to `n_cpu` pairs running at once.
+
+    Chains equal by sequence and coordinates are aligned once and their
+    transforms reused. Each output assembly `sup_{i}.pdb` is written as soon as
+    all pairs of source chain `i` have finished. A failed pair is logged and the
+    assemblies that need it are skipped and listed in `failures.tsv` in
+    `output_dir`; the other assemblies are still written. Returns the
+    `(output_path, error)` failures.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_chains, source_files = split_unique_chains(source_file, os.path.join(temp_dir, "source_chains"))
+        target_chains, target_files = split_unique_chains(target_file, os.path.join(temp_dir, "target_chains"))
+        jobs = [
+            (source_digest, target_digest, source_path, target_path, extra_args)
+            for source_digest, source_path in source_files.items()
+            for target_digest, target_path in target_files.items()
+        ]
+        logging.info(
+            f"Aligning {len(jobs)} unique chain pairs "
+            f"for {len(source_chains)} x {len(target_chains)} chains."
+        )
+
+        results = {}
+        pending = dict(enumerate(source_chains))
+        failures = []
+
+        def on_done(source_digest, target_digest, transform, error):
+            if error is not None:
+                logging.warning(
+                    f"{os.path.basename(source_files[source_digest])} onto "
+                    f"{os.path.basename(target_files[target_digest])}: {error}"
+                )
+            results[source_digest, target_digest] = transform, error
+            complete = []
+            for i, (chain, digest) in list(pending.items()):
+                pairs = [results.get((digest, target)) for _, target in target_chains]
+                if None in pairs:
+                    continue
+                del pending[i]
+                output_path = os.path.join(output_dir, f"sup_{i}.pdb")
+                errors = [error for _, error in pairs if error is not None]
+                if errors:
+                    failures.append((output_path, errors[0]))
+                    # an assembly left from an earlier run does not match this one
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                else:
+                    complete.append((chain, [transform for transform, _ in pairs], output_path, renumber))
+            return complete
+
+        asyncio.run(_align_pairs(jobs, SubprocessExecutor(n_cpu), on_done))
+
+    report_path = os.path.join(output_dir, FAILURES_NAME)
+    if failures:
+        write_failures(failures, report_path)
+        logging.error(f"{len(failures)} of {len(source_chains)} assemblies failed, see {report_path}")
+    elif os.path.exists(report_path):
+        os.remove(report_path)
+    logging.info("Superimposition completed.")
+    return failures
+
+
+    logging.info("Superimposition completed.")
+
+
+def sup_homooligomers(source_file, target_file, output_dir, renumber = True, extra_args = None, parallel = False, n_cpu = 1):
+    if parallel:
+        return sup_homooligomers_parallel(source_file, target_file, output_dir, renumber, extra_args, n_cpu)
     os.makedirs(output_dir, exist_ok=True)
 
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -49,17 +165,25 @@ def sup_homooligomers(source_file, target_file, output_dir, renumber = True, ext
 
 
 def main(args):
-    sup_homooligomers(
+    failures = sup_homooligomers(
         args.source_file, 
         args.target_file, 
         args.output_dir,  
         not args.no_renumber,
-        args.extra_args
+        args.extra_args,
+        args.parallel,
+        args.n_cpu
     )
+    if failures:
+        sys.exit(1)
 
 
-if __name__ == "__main__":
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
     parser = argparse.ArgumentParser(
+        prog=prog,
         description="Superimposition between Homooligomers (An to Am). " 
         "Superimpose each chain from structure An onto all chains from Am to obtain a new structure. "
         "A total of n new structures can be obtained. pdb and cif formats are supported. "
@@ -69,7 +193,13 @@ if __name__ == "__main__":
     parser.add_argument("output_dir", help="Output directory for combined structures")
     parser.add_argument('--no_renumber', action='store_true', help='Do not renumber atoms in the structure.')
     parser.add_argument('--extra_args', nargs='*', default=None, help='Additional arguments for USalign.')
-    args = parser.parse_args()
+    parser.add_argument('--parallel', action='store_true', help=
+                        'Align all chain pairs concurrently, once per distinct pair, '
+                        'and write each assembly as soon as its pairs finish.')
+    parser.add_argument('--n_cpu', type=int, default=1, help='Number of concurrent USalign runs (with --parallel).')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -77,4 +207,9 @@ if __name__ == "__main__":
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
     
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == "__main__":
+    cli()
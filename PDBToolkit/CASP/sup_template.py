@@ -3,102 +3,503 @@ Superpose models to template and calculate tmscore.
 """
 import os
 import re
-import subprocess
-import pandas as pd
+import math
+import asyncio
+import tempfile
+import shutil
 import logging
-from multiprocessing import Pool
 import argparse
 
 from PDBToolkit.config import USALIGN_PATH
+from PDBToolkit.cache import ResultCache
+from PDBToolkit.CASP.executor import SubprocessExecutor
+from PDBToolkit.PDBOps.compression import decompress_to, decompressed, decompressed_all, decompressed_async, detect_compression, has_extension, scratch_dir, strip_compression
+from PDBToolkit.tracing import tracing
+from PDBToolkit.shard import parse_shard, select_shard, shard_path
 
 logging.basicConfig(level=logging.INFO)
 
 
-def run_usalign(model, reference, output_prefix = None, extra_args = None):
-    command = [
-        USALIGN_PATH,
-        model, 
-        reference
-    ]
-    if output_prefix:
-        command.extend(["-o", output_prefix])
-    if extra_args:
-        command.extend(extra_args)
-    result = subprocess.run(command, capture_output=True, text=True)
+TMSCORE_PATTERN = re.compile(r'TM-score\s*=\s*([0-9.]+)')
+RESULT_PATTERN = re.compile(r'^((?:Aligned length|TM-score)\s*=.*)')
+ALIGNED_PATTERN = re.compile(r'Aligned length\s*=\s*(\d+),\s*RMSD\s*=\s*([0-9.]+)')
+BATCH_PATTERN = re.compile(r'^((?:Name of Structure_1|Aligned length|TM-score)\s*[:=].*)')
+# models per USalign process of the batch backend
+BATCH_SIZE = 64
+
+
+def parse_usalign(lines):
+    """
+    Parse the `Aligned length=` and `TM-score=` lines of USalign output into a record.
+
+    `tmscore` is normalised by the reference (Structure_2) and `tm_model` by the
+    model (Structure_1). Raises ValueError if a line is missing.
+    """
+    scores = [TMSCORE_PATTERN.search(line) for line in lines if line.startswith("TM-score")]
+    aligned = [ALIGNED_PATTERN.search(line) for line in lines if line.startswith("Aligned length")]
+    if len(scores) < 2 or not aligned or None in scores[:2] or aligned[0] is None:
+        raise ValueError("no TM-score lines in USalign output")
+    return {
+        "tmscore": float(scores[1].group(1)),
+        "tm_model": float(scores[0].group(1)),
+        "rmsd": float(aligned[0].group(2)),
+        "aligned_length": int(aligned[0].group(1)),
+    }
+
+
+def parse_usalign_batch(lines):
+    """
+    Split the output of a `-dir1` run into `{model file name: parse_usalign record}`.
+
+    Records start at each `Name of Structure_1:` line; the chain suffix USalign
+    appends to the name (`m1.pdb:A`) is dropped. Incomplete records are skipped.
+    """
+    records = {}
+    name, block = None, []
+    for line in lines + ["Name of Structure_1: "]:
+        if line.startswith("Name of Structure_1"):
+            if name is not None:
+                try:
+                    records[name] = parse_usalign(block)
+                except ValueError:
+                    pass
+            path = line.split(":", 1)[1].strip().split(" (")[0]
+            name, block = os.path.basename(path).split(":")[0], []
+        else:
+            block.append(line)
+    return records
+
+
+def run_usalign(model, reference, output_prefix = None, extra_args = None, cache = None, executor = None):
+    """
+    Return the TM-score of `model` normalised by `reference`, or None on failure.
+
+    With a `ResultCache`, runs on unchanged inputs and arguments return the stored
+    score and superposed files instead of calling USalign again.
+    """
+    executor = executor or SubprocessExecutor()
+    return asyncio.run(run_usalign_async(model, reference, output_prefix, extra_args, cache, executor))
+
+
+async def run_usalign_async(model, reference, output_prefix, extra_args, cache, executor):
+    record = await usalign_record_async(model, reference, output_prefix, extra_args, cache, executor)
+    return record["tmscore"] if record is not None else None
+
+
+async def usalign_record_async(model, reference, output_prefix, extra_args, cache, executor):
+    """
+    Align `model` to `reference` and return the `parse_usalign` record, or None on failure.
+    """
+    if cache is None:
+        return await _run_usalign(model, reference, output_prefix, extra_args, executor)
+
+    key = _cache_key(cache, model, reference, output_prefix, extra_args)
+    result = _cached_record(cache, key, model, output_prefix)
+    if result is not None:
+        return result
+
+    if not output_prefix:
+        record = await _run_usalign(model, reference, None, extra_args, executor)
+        if record is not None:
+            cache.put(key, record)
+        return record
 
-    if result.returncode != 0:
-        logging.error(f"Error processing {model}: {result.stderr.strip()}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_prefix = os.path.join(temp_dir, "sup")
+        record = await _run_usalign(model, reference, temp_prefix, extra_args, executor)
+        outputs = {filename[len("sup"):]: os.path.join(temp_dir, filename) for filename in os.listdir(temp_dir)}
+        for suffix, path in outputs.items():
+            shutil.copyfile(path, output_prefix + suffix)
+        if record is not None:
+            cache.put(key, record, outputs)
+    return record
+
+
+def _cache_key(cache, model, reference, output_prefix, extra_args):
+    return cache.key([USALIGN_PATH, "-o" if output_prefix else ""] + (extra_args or []), [model, reference])
+
+
+def _cached_record(cache, key, model, output_prefix = None):
+    result = cache.get(key)
+    # entries written before records were cached hold the TM-score only
+    if result is not None and "rmsd" in result and (not output_prefix or cache.restore(key, output_prefix)):
+        logging.info(f"TM-score for {model}: {result['tmscore']} (cached)")
+        return result
+    return None
+
+
+async def _run_usalign(model, reference, output_prefix, extra_args, executor):
+    async with executor.staging(), decompressed_async(model) as model_path, decompressed_async(reference) as reference_path:
+        command = [
+            USALIGN_PATH,
+            model_path, 
+            reference_path
+        ]
+        if output_prefix:
+            command.extend(["-o", output_prefix])
+        if extra_args:
+            command.extend(extra_args)
+        result = await executor.run(command, RESULT_PATTERN)
+
+    if not result.ok:
+        logging.error(f"Error processing {model}: {result.error()}")
         return None
     
-    tmscore_pattern = re.compile(r'TM-score\s*=\s*([0-9.]+)')
     try:
-        tmscore = float(tmscore_pattern.findall(result.stdout)[1])
-        logging.info(f"TM-score for {model}: {tmscore}")
-        return tmscore
-    except:
+        record = parse_usalign(result.matches)
+        logging.info(f"TM-score for {model}: {record['tmscore']}")
+        return record
+    except ValueError:
         logging.error(f"Error parsing TM-score for {model}: {result.stdout.strip()}")
         return None
 
 
-def wrapper(model, reference, output_prefix, extra_args):
-    tmscore = run_usalign(model, reference, output_prefix, extra_args)
-    return model, tmscore
+def batch_chunks(model_list, n_lanes, batch_size = BATCH_SIZE):
+    """
+    Split models into chunks of at most `batch_size` sharing a directory, at least `n_lanes` of them.
 
+    Models are dealt largest first, round robin, so the chunks of a directory
+    carry similar amounts of work; chunks are returned largest first.
+    """
+    by_dir = {}
+    for model in model_list:
+        by_dir.setdefault(os.path.dirname(model), []).append(model)
+    chunks = []
+    for models in by_dir.values():
+        n_chunks = min(len(models), max(n_lanes, math.ceil(len(models) / batch_size)))
+        dealt = [[] for _ in range(n_chunks)]
+        for index, model in enumerate(sorted(models, key=lambda model: (-os.path.getsize(model), model))):
+            dealt[index % n_chunks].append(model)
+        chunks.extend(dealt)
+    return sorted(chunks, key=lambda chunk: -sum(os.path.getsize(model) for model in chunk))
 
-def process_in_parallel(model_dir, reference_file, sup_dir = None, extra_args = None, n_cpu = 1):
-    model_list = [os.path.join(model_dir, model) for model in os.listdir(model_dir) if model.endswith('.pdb')]
-    reference_list = [reference_file for model in model_list]
-    if sup_dir:
-        output_prefix_list = [os.path.join(sup_dir, os.path.basename(model).replace(".pdb", "_sup")) for model in model_list]
-    else:
-        output_prefix_list = [None for model in model_list]
-    extra_args_list = [extra_args for model in model_list]
-    total_args = zip(model_list, reference_list, output_prefix_list, extra_args_list)
-    
-    with Pool(n_cpu) as pool:
-        results = pool.starmap(wrapper, total_args)
-    
+
+async def usalign_batch_async(models, reference, extra_args, cache, executor):
+    """
+    Align `models` (files of one directory) to `reference` in one USalign `-dir1` run.
+
+    Returns `{model: record or None}`. Cached pairs are not aligned again. Models
+    missing from the output, because the run failed or skipped them, are aligned
+    one by one, so a bad file only costs its own result.
+    """
+    records, keys = {}, {}
+    for model in models:
+        if cache is not None:
+            keys[model] = _cache_key(cache, model, reference, None, extra_args)
+            records[model] = _cached_record(cache, keys[model], model)
+    pending = [model for model in models if records.get(model) is None]
+    if not pending:
+        return records
+
+    async with executor.staging(), decompressed_async(reference) as reference_path:
+        with tempfile.TemporaryDirectory(dir=scratch_dir()) as temp_dir:
+            model_dir = await asyncio.to_thread(_stage_models, pending, temp_dir)
+            list_path = os.path.join(temp_dir, "models.txt")
+            with open(list_path, "w") as f:
+                f.write("".join(os.path.basename(strip_compression(model)) + "\n" for model in pending))
+            command = [USALIGN_PATH, "-dir1", model_dir + os.sep, list_path, reference_path]
+            if extra_args:
+                command.extend(extra_args)
+            timeout = executor.timeout * len(pending) if executor.timeout is not None else None
+            result = await executor.run(command, BATCH_PATTERN, timeout)
+
+    parsed = parse_usalign_batch(result.matches)
+    failed = []
+    for model in pending:
+        record = parsed.get(os.path.basename(strip_compression(model)))
+        if record is None:
+            failed.append(model)
+            continue
+        logging.info(f"TM-score for {model}: {record['tmscore']}")
+        records[model] = record
+        if cache is not None:
+            cache.put(keys[model], record)
+    if failed:
+        reason = result.error() if not result.ok else "missing from the output"
+        logging.warning(f"Batch of {len(pending)} models: {len(failed)} failed ({reason}), aligning them one by one")
+        retried = await asyncio.gather(*(
+            usalign_record_async(model, reference, None, extra_args, cache, executor) for model in failed
+        ))
+        records.update(zip(failed, retried))
+    return records
+
+
+def _stage_models(models, temp_dir):
+    """
+    The folder to pass to `-dir1`: the models' own, or a copy in `temp_dir` decompressing the chunk and linking plain files.
+    """
+    if not any(detect_compression(model) for model in models):
+        return os.path.dirname(models[0])
+    model_dir = os.path.join(temp_dir, "models")
+    os.mkdir(model_dir)
+    for model in models:
+        if detect_compression(model):
+            decompress_to(model, model_dir)
+        else:
+            os.symlink(model, os.path.join(model_dir, os.path.basename(model)))
+    return model_dir
+
+
+def gather_batches(jobs, extra_args, n_cpu, cache, executor, batch_size = BATCH_SIZE):
+    """
+    Run `{reference: model_list}` through `usalign_batch_async` as one job stream and return `{(model, reference): record}`.
+    """
+    n_lanes = math.ceil(n_cpu / max(1, len(jobs)))
+    batches = [
+        (chunk, reference)
+        for reference, model_list in jobs.items()
+        for chunk in batch_chunks(model_list, n_lanes, batch_size)
+    ]
+    batches.sort(key=lambda batch: -sum(os.path.getsize(model) for model in batch[0]) * os.path.getsize(batch[1]))
+    results = executor.gather([
+        usalign_batch_async(chunk, reference, extra_args, cache, executor) for chunk, reference in batches
+    ])
+    records = {}
+    for (_, reference), chunk_records in zip(batches, results):
+        records.update(((model, reference), record) for model, record in chunk_records.items())
+    return records
+
+
+def check_native_options(extra_args = None, n_cpu = 1, cache = None, timeout = None, retries = 0):
+    """
+    Reject or warn about USalign options the native backend does not honour.
+
+    `extra_args` would change what is computed, so it raises ValueError; the
+    others only affect how USalign runs are scheduled and are ignored with a warning.
+    """
+    if extra_args:
+        raise ValueError(f"--backend native does not run USalign and cannot apply --extra_args {' '.join(extra_args)}.")
+    ignored = [
+        option for option, unused in (
+            ("--n_cpu", n_cpu != 1), ("--cache_dir", cache is not None),
+            ("--timeout", timeout is not None), ("--retries", retries != 0),
+        ) if unused
+    ]
+    if ignored:
+        logging.warning(f"--backend native runs in this process and ignores {', '.join(ignored)}.")
+
+
+def process_native(model_list, reference_file, sup_dir = None):
+    """
+    Score same-sequence models with the vectorized TM-score engine instead of USalign.
+    """
+    from PDBToolkit.CASP.tmscore import score_models, superpose_model
+
+    results = score_models(model_list, reference_file)
+    for model, result in results.items():
+        logging.info(f"TM-score for {model}: {result['tmscore']} (RMSD {result['rmsd']})")
+        if sup_dir:
+            output_path = os.path.join(sup_dir, _stem(model) + "_sup.pdb")
+            superpose_model(model, result["rotation"], result["translation"], output_path)
     logging.info(f"Processed {len(results)} models.")
+    return {model: result["tmscore"] for model, result in results.items()}
+
+
+def list_models(model_dir, shard = None):
+    model_list = sorted(os.path.join(model_dir, model) for model in os.listdir(model_dir) if has_extension(model, '.pdb'))
+    return select_shard(model_list, shard)
+
+
+def process_in_parallel(model_dir, reference_file, sup_dir = None, extra_args = None, n_cpu = 1, cache = None, backend = "usalign", timeout = None, retries = 0, shard = None):
+    model_list = list_models(model_dir, shard)
+    if backend == "native":
+        check_native_options(extra_args, n_cpu, cache, timeout, retries)
+        return process_native(model_list, reference_file, sup_dir)
+    executor = SubprocessExecutor(n_cpu, timeout, retries)
+    # decompress a compressed reference once, not for every model
+    with decompressed(reference_file) as reference_path:
+        if backend == "batch":
+            records = gather_batches({reference_path: model_list}, extra_args, n_cpu, cache, executor)
+            logging.info(f"Processed {len(records)} models.")
+            if cache is not None:
+                cache.prune()
+            return {model: (records[model, reference_path] or {}).get("tmscore") for model in model_list}
+        if sup_dir:
+            output_prefix_list = [os.path.join(sup_dir, _stem(model) + "_sup") for model in model_list]
+        else:
+            output_prefix_list = [None for model in model_list]
+
+        tmscores = executor.gather([
+            run_usalign_async(model, reference_path, output_prefix, extra_args, cache, executor)
+            for model, output_prefix in zip(model_list, output_prefix_list)
+        ])
     
-    return dict(results)
+    logging.info(f"Processed {len(tmscores)} models.")
+    if cache is not None:
+        cache.prune()
+    
+    return dict(zip(model_list, tmscores))
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(strip_compression(path)))[0]
+
+
+def process_templates(model_dir, reference_files, sup_dir = None, extra_args = None, n_cpu = 1, cache = None, backend = "usalign", timeout = None, retries = 0, shard = None):
+    """
+    Score every model against every reference as one job stream and return long-format records.
+
+    All model x reference pairs share one executor, ordered by decreasing product of
+    file sizes (a proxy for alignment cost) so the longest runs start first and the
+    lanes stay busy until the end. Each record holds model, template, tmscore
+    (normalised by the template), tm_model (by the model), rmsd and aligned_length;
+    failed pairs have None scores.
+    """
+    model_list = list_models(model_dir, shard)
+    if backend == "native":
+        from PDBToolkit.CASP.tmscore import score_models, superpose_model
+
+        check_native_options(extra_args, n_cpu, cache, timeout, retries)
+        records = []
+        for reference_file in reference_files:
+            results = score_models(model_list, reference_file)
+            for model, result in results.items():
+                records.append({
+                    "model": model, "template": reference_file, "tmscore": result["tmscore"], "tm_model": result["tm_model"],
+                    "rmsd": result["rmsd"], "aligned_length": result["aligned_length"],
+                })
+                if sup_dir:
+                    output_path = os.path.join(sup_dir, f"{_stem(model)}_{_stem(reference_file)}_sup.pdb")
+                    superpose_model(model, result["rotation"], result["translation"], output_path)
+        logging.info(f"Processed {len(records)} model-template pairs.")
+        return records
+
+    sizes = {path: os.path.getsize(path) for path in model_list + list(reference_files)}
+    pairs = sorted(
+        ((model, reference_file) for model in model_list for reference_file in reference_files),
+        key=lambda pair: (-sizes[pair[0]] * sizes[pair[1]], pair),
+    )
+    executor = SubprocessExecutor(n_cpu, timeout, retries)
+    # decompress compressed references once, not for every model
+    with decompressed_all(reference_files) as reference_paths:
+        plain = dict(zip(reference_files, reference_paths))
+        if backend == "batch":
+            batch_records = gather_batches({plain[reference_file]: model_list for reference_file in reference_files}, extra_args, n_cpu, cache, executor)
+            results = [batch_records[model, plain[reference_file]] for model, reference_file in pairs]
+        else:
+            results = executor.gather([
+                usalign_record_async(
+                    model, plain[reference_file],
+                    os.path.join(sup_dir, f"{_stem(model)}_{_stem(reference_file)}_sup") if sup_dir else None,
+                    extra_args, cache, executor,
+                )
+                for model, reference_file in pairs
+            ])
+
+    records = []
+    for (model, reference_file), record in zip(pairs, results):
+        record = record or {"tmscore": None, "tm_model": None, "rmsd": None, "aligned_length": None}
+        records.append({"model": model, "template": reference_file, **record})
+    records.sort(key=lambda record: (record["model"], record["template"]))
+    logging.info(f"Processed {len(records)} model-template pairs.")
+    if cache is not None:
+        cache.prune()
+    return records
+
+
+def best_templates(data):
+    """
+    One row per model with the template of highest TM-score (normalised by the template).
+    """
+    scored = data.dropna(subset=["tmscore"])
+    best = scored.loc[scored.groupby("model", sort=False)["tmscore"].idxmax()]
+    best = best.rename(columns={"template": "best_template"})
+    best["n_templates"] = best["model"].map(scored.groupby("model").size())
+    return best.sort_values("tmscore", ascending=False, kind="stable").reset_index(drop=True)
 
 
 def main(args):
+    import pandas as pd
+
     model_dir = os.path.abspath(args.model_dir)
-    reference_file = os.path.abspath(args.reference)
+    reference_files = []
+    for reference in args.reference:
+        reference = os.path.abspath(reference)
+        if os.path.isdir(reference):
+            reference_files.extend(
+                os.path.join(reference, file) for file in sorted(os.listdir(reference)) if has_extension(file, ('.pdb', '.cif'))
+            )
+        else:
+            reference_files.append(reference)
     if args.sup_dir:
         sup_dir = os.path.abspath(args.sup_dir)
         os.makedirs(sup_dir, exist_ok=True)
     else:
         sup_dir = None
-    tmscore_dict = process_in_parallel(model_dir, reference_file, sup_dir, args.extra_args, args.n_cpu)
-    tmscore_dict = {os.path.basename(k): v for k, v in tmscore_dict.items()}
-    tmscore_df = pd.DataFrame({"model": tmscore_dict.keys(), "tmscore": tmscore_dict.values()})
-
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_max_gb * 2 ** 30) if args.cache_max_gb else None
+        cache = ResultCache(args.cache_dir, max_bytes)
     if args.output_file is not None:
         output_path = os.path.abspath(args.output_file)
     else:
         output_path = os.path.join(sup_dir, "tmscore.csv")
+
+    if len(reference_files) == 1:
+        tmscore_dict = process_in_parallel(model_dir, reference_files[0], sup_dir, args.extra_args, args.n_cpu, cache, args.backend, args.timeout, args.retries, args.shard)
+        tmscore_dict = {os.path.basename(k): v for k, v in tmscore_dict.items()}
+        tmscore_df = pd.DataFrame({"model": tmscore_dict.keys(), "tmscore": tmscore_dict.values()})
+    else:
+        records = process_templates(model_dir, reference_files, sup_dir, args.extra_args, args.n_cpu, cache, args.backend, args.timeout, args.retries, args.shard)
+        tmscore_df = pd.DataFrame(records, columns=["model", "template", "tmscore", "tm_model", "rmsd", "aligned_length"])
+        tmscore_df["model"] = tmscore_df["model"].map(os.path.basename)
+        tmscore_df["template"] = tmscore_df["template"].map(os.path.basename)
+        best_path = shard_path(os.path.splitext(output_path)[0] + "_best.csv", args.shard)
+        best_templates(tmscore_df).to_csv(best_path, index=False, sep="\t")
+        logging.info(f"Best templates saved to {best_path}")
+    output_path = shard_path(output_path, args.shard)
     tmscore_df.to_csv(output_path, index=False, sep="\t")
     
-    for filename in os.listdir(sup_dir):
-        if filename.endswith(".pml"):
-            file_path = os.path.join(sup_dir, filename)
-            os.remove(file_path)
+    if sup_dir is not None:
+        for filename in os.listdir(sup_dir):
+            if filename.endswith(".pml"):
+                # shards sharing sup_dir clean up concurrently
+                try:
+                    os.remove(os.path.join(sup_dir, filename))
+                except FileNotFoundError:
+                    pass
 
     logging.info(f"Results saved to {output_path}")
     
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Superpose models to template and calculate TM-score.")
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="Superpose models to template and calculate TM-score.")
     parser.add_argument("model_dir", help="Directory containing model files to process.")
-    parser.add_argument("reference", help="Reference PDB file.")
+    parser.add_argument("reference", nargs="+", help=
+                        "Reference PDB file. Several files, or directories of them, score every model against "
+                        "every template and write a long table (model, template, tmscore, tm_model, rmsd, "
+                        "aligned_length) plus the best template of each model to OUTPUT_best.csv.")
     parser.add_argument("--sup_dir", help="Directory to save the output PDB files.")
     parser.add_argument("--output_file", help="Output file to save the TM-score results.")
     parser.add_argument('--extra_args', nargs='*', default=None, 
                         help='Additional arguments for USalign.')
-    parser.add_argument("--n_cpu", type=int, default=1, help="Number of CPUs to use.")
-    args = parser.parse_args()
+    parser.add_argument("--n_cpu", type=int, default=1, help="Number of concurrent USalign runs.")
+    parser.add_argument("--timeout", type=float, default=None, help=
+                        "Seconds after which a USalign run is killed.")
+    parser.add_argument("--retries", type=int, default=0, help=
+                        "Retries for USalign runs that time out or crash.")
+    parser.add_argument("--backend", choices=["usalign", "batch", "native"], default="usalign", help=
+                        "'batch' aligns chunks of models in one USalign -dir1 run each, saving a process "
+                        "start and a reference parse per model, but writes no superposed models. "
+                        "'native' scores models sharing the reference's sequence with the built-in "
+                        "vectorized TM-score engine, matching residues by chain and number. Unlike "
+                        "USalign, which aligns only the first chain of each file unless told otherwise "
+                        "(see USalign's -mm and -ter options), 'native' superposes all chains together. It runs "
+                        "in this process: --extra_args is rejected, and --n_cpu, --cache_dir, --timeout "
+                        "and --retries are ignored.")
+    parser.add_argument("--cache_dir", default=None, help=
+                        "Directory of the result cache. Reruns on unchanged inputs reuse cached results.")
+    parser.add_argument("--cache_max_gb", type=float, default=None, help=
+                        "Evict least recently used cache entries above this size.")
+    parser.add_argument('--shard', type=parse_shard, default=None, help=
+                        'Process only shard I of N (0-based, e.g. 3/8) of the models and write '
+                        'OUTPUT.shardI-of-N.EXT; see "python -m PDBToolkit.shard".')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -109,5 +510,12 @@ if __name__ == "__main__":
     options = [args.output_file, args.sup_dir]
     if options.count(None) == 2:
         raise ValueError("You must specify at least one of --output_file, --sup_dir.")
+    if args.backend == "batch" and args.sup_dir:
+        raise ValueError("--backend batch does not write superposed models; use --output_file without --sup_dir.")
+
+    with tracing(args.trace):
+        main(args)
 
-    main(args)
+
+if __name__ == "__main__":
+    cli()
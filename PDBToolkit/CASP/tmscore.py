@@ -0,0 +1,253 @@
+"""
+Vectorized TM-score for batches of models that share the reference's sequence.
+
+When models and reference have the same residues (AF3 seeds, decoys of one
+target), the residue correspondence is known and no structural alignment is
+needed. Residues are matched on chain id, residue number and insertion code,
+one representative atom each (CA for amino acids, C3' for nucleotides), and the
+TM-score is maximised by the seeded Kabsch search of the TM-score program, run
+for all models of a batch at once. Aligned length and RMSD are reported the way
+USalign does: over the matched pairs within its `score_d8` cutoff after the
+TM-score superposition.
+"""
+import os
+
+import numpy as np
+
+from PDBToolkit.PDBOps.atom_table import read_structure, write_pdb
+from PDBToolkit.tracing import count, span
+
+MAX_ITER = 20
+N_INIT_MAX = 6
+L_INIT_MIN = 4
+SIMPLIFY_STEP = 40
+
+
+def representative_atoms(table):
+    """
+    Return `(keys, coords, is_nucleotide)` of the representative atom of each residue.
+
+    `keys` are `(chain_id, resseq, icode)` tuples in file order.
+    """
+    protein = (table.name == "CA") & ~table.hetatm
+    nucleotide = table.name == "C3'"
+    mask = protein | nucleotide
+    keys = list(zip(table.chain_id[mask].tolist(), table.resseq[mask].tolist(), table.icode[mask].tolist()))
+    return keys, table.coord[mask].astype(np.float64), nucleotide[mask]
+
+
+def calc_d0(length, nucleotide = False):
+    """
+    TM-score distance scale for a structure of `length` residues, as in USalign.
+    """
+    if nucleotide:
+        if length < 12:
+            return 0.3
+        if length < 16:
+            return 0.4
+        if length < 20:
+            return 0.5
+        if length < 24:
+            return 0.6
+        if length < 30:
+            return 0.7
+        return 0.6 * np.sqrt(length - 0.5) - 2.5
+    if length <= 21:
+        return 0.5
+    return max(1.24 * np.cbrt(length - 15) - 1.8, 0.5)
+
+
+def calc_score_d8(length):
+    """
+    USalign's cutoff for the pairs counted in "Aligned length" and RMSD, from the shorter structure's length.
+    """
+    return 1.5 * np.power(length, 0.3) + 3.5
+
+
+def kabsch(mobile, target, weights):
+    """
+    Batched weighted Kabsch superposition.
+
+    `mobile` is (M, N, 3), `target` (N, 3) and `weights` (M, N).
+    Returns rotations (M, 3, 3) and translations (M, 3) such that
+    `mobile @ R.T + t` best fits `target`.
+    """
+    weights = weights.astype(np.float64)
+    total = np.maximum(weights.sum(axis=1), 1e-12)[:, None]
+    mobile_center = (weights[:, None, :] @ mobile)[:, 0] / total
+    target_center = (weights @ target) / total
+    covariance = ((mobile - mobile_center[:, None, :]) * weights[:, :, None]).transpose(0, 2, 1) @ (target - target_center[:, None, :])
+    u, _, vt = np.linalg.svd(covariance)
+    sign = np.sign(np.linalg.det(vt.transpose(0, 2, 1) @ u.transpose(0, 2, 1)))
+    vt[:, 2, :] *= sign[:, None]
+    rotation = vt.transpose(0, 2, 1) @ u.transpose(0, 2, 1)
+    translation = target_center - (rotation @ mobile_center[:, :, None])[:, :, 0]
+    return rotation, translation
+
+
+def _distances(mobile, target, rotation, translation):
+    moved = mobile @ rotation.transpose(0, 2, 1) + translation[:, None, :]
+    return np.sqrt(((moved - target) ** 2).sum(axis=2))
+
+
+def tmscore_search(mobile, target, mask, l_norm, d0):
+    """
+    Maximise the TM-score of each model over superpositions seeded from aligned fragments.
+
+    Fragments of length L, L/2, ... (at least 4) are placed every 40 residues; each
+    seed is refined by re-superposing on the pairs closer than `d0_search` until the
+    selection no longer changes; converged models drop out of the batch. `l_norm`
+    and `d0` are scalars or one value per model. Returns TM-scores (M,), rotations and translations.
+    """
+    n_models, n_residues = mask.shape
+    l_norm = np.broadcast_to(np.asarray(l_norm, dtype=np.float64), (n_models,))
+    d0 = np.broadcast_to(np.asarray(d0, dtype=np.float64), (n_models,))
+    d0_search = np.clip(d0, 4.5, 8.0)
+    best_score = np.full(n_models, -1.0)
+    best_rotation = np.tile(np.eye(3), (n_models, 1, 1))
+    best_translation = np.zeros((n_models, 3))
+
+    lengths = []
+    length = n_residues
+    while length >= L_INIT_MIN and len(lengths) < N_INIT_MAX:
+        lengths.append(length)
+        length //= 2
+    if not lengths:
+        lengths = [n_residues]
+
+    for length in lengths:
+        for start in range(0, n_residues - length + 1, SIMPLIFY_STEP):
+            selection = mask.copy()
+            selection[:, :start] = False
+            selection[:, start + length:] = False
+            active = np.flatnonzero(selection.sum(axis=1) >= 3)
+            for _ in range(MAX_ITER):
+                if not len(active):
+                    break
+                active_mobile, active_mask, active_selection = mobile[active], mask[active], selection[active]
+                rotation, translation = kabsch(active_mobile, target, active_selection)
+                distances = _distances(active_mobile, target, rotation, translation)
+                score = np.where(active_mask, 1 / (1 + (distances / d0[active, None]) ** 2), 0).sum(axis=1) / l_norm[active]
+                better = score > best_score[active]
+                best_score[active[better]] = score[better]
+                best_rotation[active[better]] = rotation[better]
+                best_translation[active[better]] = translation[better]
+
+                new_selection = active_mask & (distances < d0_search[active, None])
+                changed = (new_selection.sum(axis=1) >= 3) & (new_selection != active_selection).any(axis=1)
+                selection[active[changed]] = new_selection[changed]
+                active = active[changed]
+
+    return best_score, best_rotation, best_translation
+
+
+def aligned_rmsd(mobile, target, mask, rotation, translation, cutoff):
+    """
+    USalign's aligned length and RMSD: the matched pairs within `cutoff` (one value
+    per model, see `calc_score_d8`) under the given superposition, and the RMSD of
+    those pairs after their own least-squares fit.
+    """
+    within = mask & (_distances(mobile, target, rotation, translation) <= np.asarray(cutoff)[:, None])
+    n_aligned = within.sum(axis=1)
+    rotation, translation = kabsch(mobile, target, within)
+    distances = _distances(mobile, target, rotation, translation)
+    rmsd = np.sqrt(np.where(within, distances ** 2, 0).sum(axis=1) / np.maximum(n_aligned, 1))
+    return n_aligned, rmsd
+
+
+def load_reference(reference_file):
+    """
+    Read the reference once: residue index, coordinates, normalisation length and d0.
+    """
+    keys, coords, nucleotide = representative_atoms(read_structure(reference_file))
+    index = {key: i for i, key in enumerate(keys)}
+    l_norm = len(keys)
+    d0 = calc_d0(l_norm, nucleotide=nucleotide.sum() * 2 > l_norm)
+    return index, coords, l_norm, d0
+
+
+def map_to_reference(table, index, n_residues):
+    """
+    Place the model's representative atoms at the reference positions; returns coords and mask.
+    """
+    keys, coords, _ = representative_atoms(table)
+    return map_residues(keys, coords, index, n_residues)
+
+
+def map_residues(keys, coords, index, n_residues):
+    """
+    Same as `map_to_reference` for representative atoms already extracted with `representative_atoms`.
+    """
+    positions = np.array([index.get(key, -1) for key in keys], dtype=np.int64)
+    found = positions >= 0
+    mapped = np.zeros((n_residues, 3))
+    mask = np.zeros(n_residues, dtype=bool)
+    mapped[positions[found]] = coords[found]
+    mask[positions[found]] = True
+    return mapped, mask
+
+
+def score_models(model_files, reference_file, batch_size = 256):
+    """
+    Score same-sequence models against a reference without running USalign.
+
+    Returns `{model_file: {"tmscore", "tm_model", "rmsd", "aligned_length", "rotation", "translation"}}`
+    with the fields of USalign's output: `tmscore` is normalised by the reference
+    length (the second `TM-score =` line), `tm_model` by the model's (the first),
+    and `aligned_length` and `rmsd` cover the matched pairs within `score_d8` under
+    the superposition normalised by the shorter of the two, as USalign does (see
+    `aligned_rmsd`). The rotation (3x3 list) and translation map model coordinates
+    onto the reference at the TM-score optimum.
+    """
+    index, reference, l_norm, d0 = load_reference(reference_file)
+    results = {}
+    for batch_start in range(0, len(model_files), batch_size):
+        batch = model_files[batch_start:batch_start + batch_size]
+        mapped, l_model, d0_model = [], [], []
+        for model_file in batch:
+            keys, coords, nucleotide = representative_atoms(read_structure(model_file))
+            mapped.append(map_residues(keys, coords, index, l_norm))
+            l_model.append(len(keys))
+            d0_model.append(calc_d0(len(keys), nucleotide=nucleotide.sum() * 2 > len(keys)))
+        mobile = np.stack([coords for coords, _ in mapped])
+        mask = np.stack([found for _, found in mapped])
+        l_model, d0_model = np.array(l_model, dtype=np.float64), np.array(d0_model)
+
+        with span("tmscore_search", models=len(batch), residues=l_norm):
+            scores, rotations, translations = tmscore_search(mobile, reference, mask, l_norm, d0)
+            # models as long as the reference score the same either way
+            model_scores = scores.copy()
+            short_rotations, short_translations = rotations.copy(), translations.copy()
+            other = np.flatnonzero(l_model != l_norm)
+            if len(other):
+                model_scores[other], model_rotations, model_translations = tmscore_search(
+                    mobile[other], reference, mask[other], l_model[other], d0_model[other]
+                )
+                shorter = l_model[other] < l_norm
+                short_rotations[other[shorter]] = model_rotations[shorter]
+                short_translations[other[shorter]] = model_translations[shorter]
+            n_aligned, rmsd = aligned_rmsd(
+                mobile, reference, mask, short_rotations, short_translations, calc_score_d8(np.minimum(l_model, l_norm))
+            )
+        count("models_scored", len(batch))
+
+        for i, model_file in enumerate(batch):
+            results[model_file] = {
+                "tmscore": round(float(scores[i]), 4),
+                "tm_model": round(float(model_scores[i]), 4),
+                "rmsd": round(float(rmsd[i]), 2),
+                "aligned_length": int(n_aligned[i]),
+                "rotation": rotations[i].tolist(),
+                "translation": translations[i].tolist(),
+            }
+    return results
+
+
+def superpose_model(model_file, rotation, translation, output_path):
+    """
+    Write `model_file` transformed onto the reference frame as PDB.
+    """
+    table = read_structure(model_file).transform(rotation, translation)
+    output_path = os.path.abspath(output_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_pdb(table, output_path)
@@ -0,0 +1,479 @@
+"""
+Columnar, NumPy-backed representation of a single-model structure.
+
+An `AtomTable` keeps one array per atom field instead of a Biopython
+Structure/Model/Chain/Residue/Atom tree. Chains and residues are contiguous
+runs of atoms, located through index offsets. Biopython is only needed for
+the `from_biopython`/`to_biopython` adapters.
+
+`read_pdb` and `read_mmcif` return tables from the structure cache when one is
+enabled (see `structure_cache`) and the file has not changed since it was parsed.
+Compressed files are read and written transparently (see `compression`).
+"""
+import os
+import functools
+
+import numpy as np
+
+from PDBToolkit.PDBOps.cif_reader import read_loop
+from PDBToolkit.PDBOps.cif_writer import open_mmcif
+from PDBToolkit.PDBOps.compression import open_input, open_output, strip_compression
+from PDBToolkit.PDBOps.pdb_writer import atom_line, chain_sort_key, format_serial, ter_line
+from PDBToolkit.PDBOps.structure_cache import active_cache
+from PDBToolkit.tracing import count, traced
+
+FIELDS = (
+    "hetatm", "name", "altloc", "resname", "chain_id", "resseq", "icode",
+    "coord", "occupancy", "bfactor", "element", "segid",
+)
+# String widths are minimums: a column is widened to its longest value, never truncated.
+DTYPES = {
+    "hetatm": bool,
+    "name": "U4",
+    "altloc": "U1",
+    "resname": "U5",
+    "chain_id": "U4",
+    "resseq": np.int32,
+    "icode": "U1",
+    "coord": np.float32,
+    "occupancy": np.float64,
+    "bfactor": np.float64,
+    "element": "U2",
+    "segid": "U4",
+}
+
+
+class AtomTable:
+    """
+    Atoms of one model stored as parallel arrays.
+
+    Coordinates are an (N, 3) float32 array like Biopython's `Atom.coord`;
+    every other field is a length-N array. Atoms of one chain are expected to be
+    contiguous; use `reorder_chains` to group them if they are not.
+    """
+
+    def __init__(self, **fields):
+        missing = set(FIELDS) - set(fields)
+        if missing:
+            raise ValueError(f"Missing fields: {sorted(missing)}")
+        for field in FIELDS:
+            setattr(self, field, _as_field(field, fields[field]))
+        n_atoms = len(self.name)
+        self.coord = self.coord.reshape(n_atoms, 3)
+        for field in FIELDS:
+            if len(getattr(self, field)) != n_atoms:
+                raise ValueError(f"Field {field} has {len(getattr(self, field))} entries, expected {n_atoms}.")
+        self._chain_starts = None
+        self._residue_starts = None
+
+    def __len__(self):
+        return len(self.name)
+
+    def __getitem__(self, index):
+        """
+        Return a new table with the atoms selected by a boolean mask, slice or index array.
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+        return AtomTable(**{field: getattr(self, field)[index] for field in FIELDS})
+
+    def __repr__(self):
+        return f"<AtomTable atoms={len(self)} residues={self.n_residues} chains={len(self.chain_ids)}>"
+
+    @property
+    def chain_starts(self):
+        """
+        Start offsets of contiguous chain blocks, followed by the number of atoms.
+        """
+        if self._chain_starts is None:
+            changed = self.chain_id[1:] != self.chain_id[:-1]
+            self._chain_starts = np.concatenate(([0], np.flatnonzero(changed) + 1, [len(self)]))
+            if len(self) == 0:
+                self._chain_starts = np.array([0])
+        return self._chain_starts
+
+    @property
+    def residue_starts(self):
+        """
+        Start offsets of residues, followed by the number of atoms.
+        """
+        if self._residue_starts is None:
+            if len(self) == 0:
+                self._residue_starts = np.array([0])
+            else:
+                changed = np.zeros(len(self) - 1, dtype=bool)
+                for field in ("chain_id", "resseq", "icode", "resname", "hetatm"):
+                    values = getattr(self, field)
+                    changed |= values[1:] != values[:-1]
+                self._residue_starts = np.concatenate(([0], np.flatnonzero(changed) + 1, [len(self)]))
+        return self._residue_starts
+
+    @property
+    def n_residues(self):
+        return len(self.residue_starts) - 1
+
+    @property
+    def chain_ids(self):
+        """
+        Chain ids in order of first appearance.
+        """
+        chain_ids, first = np.unique(self.chain_id, return_index=True)
+        return chain_ids[np.argsort(first)].tolist()
+
+    def iter_chains(self):
+        """
+        Yield `(chain_id, table)` for each contiguous chain block.
+        """
+        starts = self.chain_starts
+        for start, end in zip(starts[:-1], starts[1:]):
+            yield str(self.chain_id[start]), self[start:end]
+
+    def select(self, **criteria):
+        """
+        Select atoms by field values, e.g. `select(chain_id="A", hetatm=False)`.
+
+        A list or tuple of values matches any of them.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for field, value in criteria.items():
+            if field not in FIELDS or field == "coord":
+                raise ValueError(f"Cannot select on field {field}.")
+            if isinstance(value, (list, tuple, set)):
+                mask &= np.isin(getattr(self, field), list(value))
+            else:
+                mask &= getattr(self, field) == value
+        return self[mask]
+
+    def chain(self, chain_id):
+        return self[self.chain_id == chain_id]
+
+    def reorder_chains(self, chain_order = None):
+        """
+        Return a table with chains sorted by `chain_order` (or letters first, then digits).
+
+        Sorting is stable, so atom order within a chain is kept and split blocks of
+        the same chain are merged, as Biopython does when parsing.
+        """
+        chain_ids = sorted(self.chain_ids, key=lambda chain_id: chain_sort_key(chain_id, chain_order))
+        rank = {chain_id: i for i, chain_id in enumerate(chain_ids)}
+        uniq, inverse = np.unique(self.chain_id, return_inverse=True)
+        keys = np.array([rank[chain_id] for chain_id in uniq.tolist()])[inverse]
+        return self[np.argsort(keys, kind="stable")]
+
+    def rename_chains(self, chain_map):
+        """
+        Return a table with chain ids replaced according to `chain_map`.
+
+        Raises KeyError for chains missing from the map.
+        """
+        uniq, inverse = np.unique(self.chain_id, return_inverse=True)
+        new_ids = _as_field("chain_id", [chain_map[chain_id] for chain_id in uniq.tolist()])
+        table = self[:]
+        table.chain_id = new_ids[inverse]
+        return table
+
+    def transform(self, rotation, translation):
+        """
+        Return a table with coordinates mapped to `coord @ rotation.T + translation`.
+        """
+        table = self[:]
+        rotation = np.asarray(rotation, dtype=np.float64)
+        translation = np.asarray(translation, dtype=np.float64)
+        table.coord = (self.coord @ rotation.T + translation).astype(np.float32)
+        return table
+
+
+def _as_field(field, values):
+    """
+    `values` as an array of the dtype of `field`; string columns are widened to fit their longest value.
+    """
+    dtype = np.dtype(DTYPES[field])
+    if dtype.kind != "U":
+        return np.asarray(values, dtype=dtype)
+    array = np.asarray(values)
+    if array.size == 0:
+        return array.astype(dtype)
+    if array.dtype.kind != "U":
+        array = array.astype(str)
+    return array.astype(f"U{max(dtype.itemsize, array.dtype.itemsize) // 4}")
+
+
+def empty_fields():
+    return {field: [] for field in FIELDS}
+
+
+def concatenate(tables):
+    """
+    Concatenate tables in order into one table.
+    """
+    tables = list(tables)
+    if not tables:
+        return AtomTable(**empty_fields())
+    return AtomTable(**{
+        field: np.concatenate([getattr(table, field) for table in tables]) for field in FIELDS
+    })
+
+
+def _fixed_width_column(buffer, start, end):
+    return buffer[:, start:end].copy().view(f"S{end - start}").ravel()
+
+
+def _parse_floats(column, default):
+    column = np.char.strip(column)
+    column[column == b""] = default
+    return column.astype(np.float64)
+
+
+def _cached(reader):
+    """
+    Decorator for path readers: look the file up in the active structure cache before parsing it.
+    """
+    def decorator(parse):
+        @functools.wraps(parse)
+        def wrapper(input_path):
+            cache = active_cache()
+            if cache is None:
+                return parse(input_path)
+            key = cache.file_key(input_path, reader)
+            arrays = cache.load(key, FIELDS)
+            if arrays is not None:
+                return AtomTable(**arrays)
+            table = parse(input_path)
+            cache.store(key, {field: getattr(table, field) for field in FIELDS})
+            return table
+        return wrapper
+    return decorator
+
+
+@_cached("pdb")
+@traced("read_pdb")
+def read_pdb(input_path):
+    """
+    Read the ATOM/HETATM records of the first model of a PDB file.
+
+    The fixed-width columns are sliced and converted for all atoms at once.
+    Missing elements are guessed from the atom name.
+    """
+    lines = []
+    with open_input(input_path, "rb") as f:
+        for line in f:
+            record = line[:6]
+            if record == b"ATOM  " or record == b"HETATM":
+                lines.append(line.rstrip(b"\r\n")[:80].ljust(80))
+            elif record == b"ENDMDL":
+                break
+    count("atoms_parsed", len(lines))
+    if not lines:
+        return AtomTable(**empty_fields())
+
+    buffer = np.frombuffer(b"".join(lines), dtype="S1").reshape(len(lines), 80)
+    column = lambda start, end: _fixed_width_column(buffer, start, end)
+    text = lambda start, end: np.char.strip(column(start, end).astype("U"))
+
+    name = text(12, 16)
+    element = text(76, 78)
+    missing = element == ""
+    if missing.any():
+        element[missing] = [atom_name.lstrip("0123456789")[:1] for atom_name in name[missing].tolist()]
+    coord = np.stack([
+        column(30, 38).astype(np.float64),
+        column(38, 46).astype(np.float64),
+        column(46, 54).astype(np.float64),
+    ], axis=1)
+    return AtomTable(
+        hetatm=column(0, 6) == b"HETATM",
+        name=name,
+        altloc=column(16, 17).astype("U"),
+        resname=text(17, 20),
+        chain_id=column(21, 22).astype("U"),
+        resseq=column(22, 26).astype(np.int64),
+        icode=column(26, 27).astype("U"),
+        coord=coord,
+        occupancy=_parse_floats(column(54, 60), b"1.0"),
+        bfactor=_parse_floats(column(60, 66), b"0.0"),
+        element=np.char.upper(element),
+        segid=column(72, 76).astype("U"),
+    )
+
+
+@_cached("mmcif")
+def read_mmcif(input_path):
+    """
+    Read the `_atom_site` loop of the first model of an mmCIF file.
+
+    Fields are mapped the way Biopython's MMCIFParser does: author chain ids and
+    residue numbers, label atom and residue names. Atoms without a residue number
+    are skipped; missing occupancies and B-factors default to 1.0 and 0.0.
+    """
+    with open_input(input_path, "r") as f:
+        return read_mmcif_handle(f)
+
+
+@traced("read_mmcif")
+def read_mmcif_handle(handle):
+    """
+    Same as `read_mmcif` for an open text handle, e.g. a member of a zip archive.
+    """
+    fields = empty_fields()
+    columns, rows = read_loop(handle, "_atom_site")
+    index = {column: i for i, column in enumerate(columns)}
+    seq_column = "auth_seq_id" if "auth_seq_id" in index else "label_seq_id"
+    get = lambda column, default = None: index.get(column, default)
+    i_group, i_name, i_resname = get("group_PDB"), get("label_atom_id"), get("label_comp_id")
+    i_chain, i_seq, i_icode = get("auth_asym_id"), get(seq_column), get("pdbx_PDB_ins_code")
+    i_alt, i_element, i_model = get("label_alt_id"), get("type_symbol"), get("pdbx_PDB_model_num")
+    i_x, i_y, i_z = get("Cartn_x"), get("Cartn_y"), get("Cartn_z")
+    i_occupancy, i_bfactor = get("occupancy"), get("B_iso_or_equiv")
+
+    first_model = None
+    for row in rows:
+        if i_model is not None:
+            if first_model is None:
+                first_model = row[i_model]
+            elif row[i_model] != first_model:
+                break
+        if row[i_seq] == ".":
+            continue
+        altloc = row[i_alt] if i_alt is not None else "."
+        icode = row[i_icode] if i_icode is not None else "?"
+        fields["hetatm"].append(row[i_group] == "HETATM")
+        fields["name"].append(row[i_name])
+        fields["altloc"].append(" " if altloc in (".", "?") else altloc)
+        fields["resname"].append(row[i_resname])
+        fields["chain_id"].append(row[i_chain])
+        fields["resseq"].append(row[i_seq])
+        fields["icode"].append(" " if icode in (".", "?") else icode)
+        fields["coord"].append((row[i_x], row[i_y], row[i_z]))
+        fields["occupancy"].append(row[i_occupancy] if i_occupancy is not None else 1.0)
+        fields["bfactor"].append(row[i_bfactor] if i_bfactor is not None else 0.0)
+        fields["element"].append(row[i_element].upper() if i_element is not None else "")
+        fields["segid"].append(" ")
+
+    fields["resseq"] = np.array(fields["resseq"], dtype=np.int64)
+    fields["coord"] = np.array(fields["coord"], dtype=np.float64).reshape(-1, 3)
+    fields["occupancy"] = np.array(fields["occupancy"], dtype=np.float64)
+    fields["bfactor"] = np.array(fields["bfactor"], dtype=np.float64)
+    count("atoms_parsed", len(fields["name"]))
+    return AtomTable(**fields)
+
+
+def read_structure(input_path):
+    """
+    Read a PDB or mmCIF file (optionally compressed, `.pdb.gz`) into an AtomTable based on its extension.
+    """
+    file_extension = os.path.splitext(strip_compression(input_path))[1].lower()
+    if file_extension == ".pdb":
+        return read_pdb(input_path)
+    if file_extension in (".cif", ".mmcif"):
+        return read_mmcif(input_path)
+    raise ValueError("Unsupported file format. Please provide a PDB or mmCIF file.")
+
+
+@traced("write_pdb")
+def write_pdb(table, output_path, chain_order = None, hybrid36 = False, renumber = True):
+    """
+    Write a table as PDB with chains in order and a TER record after each chain.
+
+    Atom serials restart at 1 for every chain, or run continuously in hybrid-36
+    notation with `hybrid36=True`, matching `renumber_atom`. With `renumber=False`
+    chains keep their order in the table and serials run continuously over the
+    file, as PDBIO writes them.
+    """
+    if not renumber and chain_order is None:
+        chain_order = table.chain_ids
+    table = table.reorder_chains(chain_order)
+    columns = [
+        getattr(table, field).tolist()
+        for field in ("hetatm", "name", "altloc", "resname", "chain_id", "resseq", "icode")
+    ]
+    columns += [table.coord[:, 0].tolist(), table.coord[:, 1].tolist(), table.coord[:, 2].tolist()]
+    columns += [getattr(table, field).tolist() for field in ("occupancy", "bfactor", "segid", "element")]
+    rows = list(zip(*columns))
+
+    with open_output(output_path) as handle:
+        serial = 1
+        starts = table.chain_starts
+        for start, end in zip(starts[:-1], starts[1:]):
+            if renumber and not hybrid36:
+                serial = 1
+            for hetatm, name, altloc, resname, chain_id, resseq, icode, x, y, z, occupancy, bfactor, segid, element in rows[start:end]:
+                if len(chain_id) > 1:
+                    raise ValueError(f"Chain id ('{chain_id}') exceeds PDB format limit.")
+                if resseq > 9999:
+                    raise ValueError(f"Residue number ('{resseq}') exceeds PDB format limit.")
+                handle.write(atom_line(
+                    hetatm, format_serial(serial, hybrid36), name, altloc, resname, chain_id,
+                    resseq, icode, x, y, z, occupancy, bfactor, segid, element,
+                ))
+                serial += 1
+            handle.write(ter_line(format_serial(serial, hybrid36), resname, chain_id, resseq, icode))
+            if hybrid36:
+                serial += 1
+        handle.write("END\n")
+    count("bytes_written", os.path.getsize(output_path))
+
+
+@traced("write_mmcif")
+def write_mmcif(table, output_path, data_name = "structure"):
+    """
+    Write a table as an mmCIF `_atom_site` loop. Chain ids of any length are kept.
+    """
+    with open_mmcif(output_path, data_name) as writer:
+        writer.write_table(table)
+
+
+def from_biopython(structure):
+    """
+    Build an AtomTable from the first model of a Biopython structure (or a model/chain).
+    """
+    fields = empty_fields()
+    entity = structure
+    if entity.level == "S":
+        entity = entity[0]
+    chains = [entity] if entity.level == "C" else list(entity)
+    for chain in chains:
+        for residue in chain.get_unpacked_list():
+            hetfield, resseq, icode = residue.id
+            for atom in residue.get_unpacked_list():
+                fields["hetatm"].append(hetfield != " ")
+                fields["name"].append(atom.get_name())
+                fields["altloc"].append(atom.altloc)
+                fields["resname"].append(residue.resname)
+                fields["chain_id"].append(chain.id)
+                fields["resseq"].append(resseq)
+                fields["icode"].append(icode)
+                fields["coord"].append(atom.coord)
+                fields["occupancy"].append(atom.occupancy)
+                fields["bfactor"].append(atom.bfactor)
+                fields["element"].append(atom.element or "")
+                fields["segid"].append(residue.segid)
+    fields["coord"] = np.array(fields["coord"], dtype=np.float32).reshape(-1, 3)
+    return AtomTable(**fields)
+
+
+def to_biopython(table, structure_id = "structure"):
+    """
+    Build a Biopython Structure with one model from an AtomTable.
+    """
+    from Bio.PDB.StructureBuilder import StructureBuilder
+
+    builder = StructureBuilder()
+    builder.init_structure(structure_id)
+    builder.init_model(0)
+    for chain_id, chain in table.reorder_chains(table.chain_ids).iter_chains():
+        builder.init_chain(chain_id)
+        starts = chain.residue_starts
+        for start, end in zip(starts[:-1], starts[1:]):
+            builder.init_seg(str(chain.segid[start]))
+            resname = str(chain.resname[start])
+            hetfield = " "
+            if chain.hetatm[start]:
+                hetfield = "W" if resname in ("HOH", "WAT") else "H"
+            builder.init_residue(resname, hetfield, int(chain.resseq[start]), str(chain.icode[start]))
+            for i in range(start, end):
+                name = str(chain.name[i])
+                builder.init_atom(
+                    name, chain.coord[i], float(chain.bfactor[i]), float(chain.occupancy[i]),
+                    str(chain.altloc[i]), name, element=str(chain.element[i]) or None,
+                )
+    return builder.get_structure()
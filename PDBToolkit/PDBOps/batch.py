@@ -0,0 +1,180 @@
+"""
+Run a per-file function over many input files with a process pool.
+
+Workers receive the function and the arguments shared by all files once, when
+they start; each task is only an `(input_path, output_path)` pair, dispatched in
+chunks through `imap_unordered`. A file that raises is recorded with its error and
+the batch goes on; failures are written to a report next to the outputs.
+
+Each output is written under a temporary name and moved into place when complete,
+so a killed run never leaves a truncated output behind. With a manifest, files
+whose input is unchanged since they were written by the same function with the
+same arguments are skipped unless `force` is set, so an interrupted batch resumes
+where it stopped and a rerun with other arguments redoes everything.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+from multiprocessing import Pool
+
+from PDBToolkit.tracing import count, span
+
+FAILURES_NAME = "failures.tsv"
+MANIFEST_NAME = "batch_manifest.json"
+PROGRESS_SECONDS = 10.0
+
+_worker = {}
+
+
+def batch_settings(function, shared_args):
+    """
+    JSON-able description of `function` and its shared arguments; outputs of other settings are stale.
+    """
+    name = f"{function.__module__}.{function.__qualname__}"
+    return json.loads(json.dumps({"function": name, "args": list(shared_args)}, default=repr))
+
+
+def input_stamp(input_path):
+    stat = os.stat(input_path)
+    return {"input": os.path.abspath(input_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(manifest_path, settings):
+    """
+    Read the manifest at `manifest_path`; a missing one, or one written with other settings, is empty.
+    """
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = None
+    if manifest is None or manifest.get("settings") != settings:
+        manifest = {"settings": settings, "outputs": {}}
+    return manifest
+
+
+def save_manifest(manifest, manifest_path):
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, manifest_path)
+
+
+def is_up_to_date(manifest, input_path, output_path):
+    """
+    True if the manifest records `output_path` as written from the current `input_path` and it still exists.
+    """
+    entry = manifest["outputs"].get(os.path.abspath(output_path))
+    try:
+        return entry == input_stamp(input_path) and os.path.exists(output_path)
+    except FileNotFoundError:
+        return False
+
+
+def _init_worker(function, shared_args):
+    _worker["function"] = function
+    _worker["shared_args"] = shared_args
+
+
+def _run_job(job):
+    input_path, output_path = job
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    # same file name in a private directory: writers derive the format from it
+    temp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=output_dir)
+    try:
+        temp_path = os.path.join(temp_dir, os.path.basename(output_path))
+        with span("batch_job", input=os.path.basename(input_path)):
+            _worker["function"](input_path, temp_path, *_worker["shared_args"])
+        os.replace(temp_path, output_path)
+    except Exception as e:
+        return input_path, f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return input_path, None
+
+
+def default_chunksize(n_jobs, n_cpu):
+    """
+    About eight chunks per worker, capped so that progress keeps flowing on huge batches.
+    """
+    return max(1, min(64, n_jobs // (8 * max(1, n_cpu))))
+
+
+def write_failures(failures, report_path):
+    with open(report_path, "w") as f:
+        f.write("input_path\terror\n")
+        for input_path, error in sorted(failures):
+            error = " ".join(error.split())
+            f.write(f"{input_path}\t{error}\n")
+
+
+def run_batch(function, jobs, shared_args = (), n_cpu = 1, force = False, report_path = None, chunksize = None, manifest_path = None):
+    """
+    Call `function(input_path, output_path, *shared_args)` for every `(input_path, output_path)` in `jobs`.
+
+    Progress and throughput are logged every `PROGRESS_SECONDS`. Failed files are
+    written to `report_path` (a stale report is removed when nothing failed).
+    Completed outputs are recorded in `manifest_path`; jobs it records as done with
+    the same function and shared arguments on an unchanged input are skipped unless
+    `force` is set. Without a manifest every job runs. Returns the list of
+    `(input_path, error)` failures.
+    """
+    jobs = sorted(jobs)
+    manifest = None
+    if manifest_path is not None:
+        manifest = load_manifest(manifest_path, batch_settings(function, shared_args))
+    if force or manifest is None:
+        pending = jobs
+    else:
+        pending = [job for job in jobs if not is_up_to_date(manifest, *job)]
+    if len(pending) < len(jobs):
+        logging.info(f"Skipping {len(jobs) - len(pending)} of {len(jobs)} files with up-to-date outputs.")
+    count("files_skipped", len(jobs) - len(pending))
+    outputs = dict(pending)
+    stamps = {}
+    for input_path, _ in pending:
+        try:
+            stamps[input_path] = input_stamp(input_path)
+        except FileNotFoundError:
+            pass
+
+    failures = []
+    start = last_report = time.perf_counter()
+    if pending:
+        if chunksize is None:
+            chunksize = default_chunksize(len(pending), n_cpu)
+        with span("batch", files=len(pending), n_cpu=n_cpu, chunksize=chunksize), \
+                Pool(n_cpu, initializer=_init_worker, initargs=(function, tuple(shared_args))) as pool:
+            for done, (input_path, error) in enumerate(pool.imap_unordered(_run_job, pending, chunksize), start=1):
+                if error is not None:
+                    logging.warning(f"{input_path}: {error}")
+                    failures.append((input_path, error))
+                    # an output left from an earlier run no longer matches the input
+                    if os.path.exists(outputs[input_path]):
+                        os.remove(outputs[input_path])
+                    if manifest is not None:
+                        manifest["outputs"].pop(os.path.abspath(outputs[input_path]), None)
+                elif manifest is not None and input_path in stamps:
+                    manifest["outputs"][os.path.abspath(outputs[input_path])] = stamps[input_path]
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_SECONDS or done == len(pending):
+                    last_report = now
+                    if manifest is not None:
+                        save_manifest(manifest, manifest_path)
+                    logging.info(
+                        f"{done}/{len(pending)} files, {done / max(now - start, 1e-9):.1f} files/s, {len(failures)} failed"
+                    )
+    count("files_processed", len(pending) - len(failures))
+    count("files_failed", len(failures))
+
+    if report_path is not None:
+        if failures:
+            write_failures(failures, report_path)
+            logging.error(f"{len(failures)} of {len(pending)} files failed, see {report_path}")
+        elif os.path.exists(report_path):
+            os.remove(report_path)
+    return failures
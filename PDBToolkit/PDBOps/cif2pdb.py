@@ -1,62 +1,458 @@
 """
 Convert CIF to PDB.
+
+numpy, Biopython and the batch runner are imported where they are used, so
+that `--help` and the streaming converters start quickly.
 """
 import os
-from Bio import PDB
+import sys
 import logging
 import argparse
-from multiprocessing import Pool
-from renumber_atom import renumber_atom
+from functools import lru_cache
+from PDBToolkit.PDBOps.cif_reader import LineReader, read_loop, split_line
+from PDBToolkit.PDBOps.pdb_writer import CHAIN_IDS, atom_line, chain_sort_key, format_serial, ter_line
+from PDBToolkit.PDBOps.cif_writer import open_mmcif
+from PDBToolkit.PDBOps.compression import COMPRESSIONS, decompressed, has_extension, open_input, open_output, plain_output, strip_compression, with_compression
+from PDBToolkit.tracing import count, traced, tracing
+from PDBToolkit.shard import parse_shard, select_shard, shard_path
 
 logging.basicConfig(level=logging.INFO)
 
+ATOM_SITE_COLUMNS = {
+    "group": "group_PDB",
+    "name": "label_atom_id",
+    "altloc": "label_alt_id",
+    "resname": "label_comp_id",
+    "chain_id": "auth_asym_id",
+    "icode": "pdbx_PDB_ins_code",
+    "x": "Cartn_x",
+    "y": "Cartn_y",
+    "z": "Cartn_z",
+    "occupancy": "occupancy",
+    "bfactor": "B_iso_or_equiv",
+    "element": "type_symbol",
+    "model": "pdbx_PDB_model_num",
+}
+
 
+@traced("cif_to_pdb")
 def cif_to_pdb(input_path, output_path, renumber = False):
+    from Bio import PDB
+    from PDBToolkit.PDBOps.renumber_atom import renumber_atom
+
     directory = os.path.dirname(output_path)
     os.makedirs(directory, exist_ok=True)
 
     parser = PDB.MMCIFParser(QUIET=True)
-    structure = parser.get_structure('structure', input_path)
+    with open_input(input_path, "r") as handle:
+        structure = parser.get_structure('structure', handle)
     
     if renumber:
         renumber_atom(structure, output_path)
     else:
         io = PDB.PDBIO()
         io.set_structure(structure)
-        io.save(output_path)
+        with plain_output(output_path) as plain_path:
+            io.save(plain_path)
+    count("bytes_written", os.path.getsize(output_path))
+
+
+def atom_site_index(columns):
+    """
+    Map the `_atom_site` items used for PDB records to their column index (None if absent).
+
+    Residue numbers come from `auth_seq_id` when present, as in MMCIFParser.
+    """
+    index = {column: i for i, column in enumerate(columns)}
+    result = {key: index.get(column) for key, column in ATOM_SITE_COLUMNS.items()}
+    result["resseq"] = index["auth_seq_id"] if "auth_seq_id" in index else index["label_seq_id"]
+    for column in ("label_asym_id", "label_entity_id", "label_seq_id"):
+        result[column] = index.get(column)
+    return result
+
+
+def hetero_flag(group, resname):
+    if group == "HETATM":
+        return "W" if resname in ("HOH", "WAT") else "H"
+    return " "
+
+
+@lru_cache(maxsize=None)
+def assign_element(name, element):
+    """
+    Return the element Biopython's Atom would end up with, guessing it from the name if needed.
+    """
+    from Bio.Data.IUPACData import atom_weights
+
+    if element and element.capitalize() in atom_weights:
+        return element
+    if name[0].isalpha() and not name[2:].isdigit():
+        putative_element = name
+    elif name[0].isdigit():
+        putative_element = name[1]
+    else:
+        putative_element = name[0]
+    if putative_element.capitalize() in atom_weights:
+        return putative_element
+    return "X"
+
+
+def scan_atom_site(input_path):
+    """
+    Locate the `_atom_site` rows of every model and chain in one pass without keeping them.
+
+    Returns `(columns, models)` where `models` is a list of `(model_num, chains)` and
+    `chains` maps each chain id, in order of first appearance, to the byte spans of
+    its contiguous blocks of rows. Returns None for layouts the streaming writer
+    cannot reproduce exactly: rows not written one per line, or a residue defined
+    twice in a chain (point mutations, residues split across blocks).
+    """
+    with open(input_path, "rb") as f:
+        lines = LineReader(f)
+        columns, rows = read_loop(lines, "_atom_site")
+        index = atom_site_index(columns)
+        i_group, i_resname, i_chain = index["group"], index["resname"], index["chain_id"]
+        i_seq, i_icode, i_model = index["resseq"], index["icode"], index["model"]
+
+        models = []
+        chains = residues = blocks = None
+        current_model = current_chain = current_residue = None
+        row_end = lines.line_start
+        for row in rows:
+            if lines.line_start != row_end or (not models and split_line(lines.line) != row):
+                return None
+            row_end = lines.offset
+            if row[i_seq] == ".":
+                continue
+
+            model = int(row[i_model]) if i_model is not None else None
+            if not models or model != current_model:
+                current_model = model
+                current_chain = None
+                chains = {}
+                residues = {}
+                models.append((model, chains))
+
+            chain_id = row[i_chain]
+            if chain_id != current_chain:
+                current_chain = chain_id
+                current_residue = None
+                blocks = chains.setdefault(chain_id, [])
+                blocks.append([lines.line_start, row_end])
+                chain_residues = residues.setdefault(chain_id, set())
+            else:
+                blocks[-1][1] = row_end
+
+            resname = row[i_resname]
+            flag = hetero_flag(row[i_group], resname)
+            icode = row[i_icode] if i_icode is not None else "?"
+            residue = (flag, int(row[i_seq]), icode, resname)
+            if residue != current_residue:
+                current_residue = residue
+                residue_id = ("H_" + resname if flag == "H" else flag, residue[1], icode)
+                if residue_id in chain_residues:
+                    return None
+                chain_residues.add(residue_id)
+    return columns, models
+
+
+def remap_chain_ids(models):
+    """
+    Map chain ids longer than one character to unused single-character ids.
+
+    Returns the mapping for every chain id, unchanged ids mapping to themselves.
+    Raises ValueError if there are not enough free ids.
+    """
+    chain_ids = list(dict.fromkeys(chain_id for _, chains in models for chain_id in chains))
+    free_ids = [chain_id for chain_id in CHAIN_IDS if chain_id not in chain_ids]
+    chain_map = {}
+    for chain_id in chain_ids:
+        if len(chain_id) == 1:
+            chain_map[chain_id] = chain_id
+        elif free_ids:
+            chain_map[chain_id] = free_ids.pop(0)
+        else:
+            raise ValueError(f"Not enough single-character chain ids to remap chain {chain_id}.")
+    return chain_map
+
+
+def _add_atom(atoms, name, altloc, atom):
+    """
+    Add an atom to a residue the way Biopython's StructureBuilder does.
+
+    Atoms with an altloc are grouped under their name, at the position of the first
+    occurrence, and written sorted by altloc. An atom without an altloc whose name is already taken is an error.
+    """
+    if altloc == " ":
+        if name in atoms:
+            raise ValueError(f"Atom {name} defined twice in a residue.")
+        atoms[name] = atom
+    elif name not in atoms:
+        atoms[name] = {altloc: atom}
+    elif isinstance(atoms[name], dict):
+        atoms[name][altloc] = atom
+    else:
+        blank_atom = atoms.pop(name)
+        atoms[name] = {altloc: atom, " ": blank_atom}
+
+
+def _write_residue(handle, atoms, residue, chain_id, serial, hybrid36):
+    hetatm, resname, resseq, icode = residue
+    if resseq > 9999:
+        raise ValueError(f"Residue number ('{resseq}') exceeds PDB format limit.")
+    for entry in atoms.values():
+        unpacked = [entry[altloc] for altloc in sorted(entry)] if isinstance(entry, dict) else (entry,)
+        for name, altloc, x, y, z, occupancy, bfactor, element in unpacked:
+            handle.write(atom_line(
+                hetatm, format_serial(serial, hybrid36), name, altloc, resname, chain_id,
+                resseq, icode, x, y, z, occupancy, bfactor, " ", element,
+            ))
+            serial += 1
+    return serial
+
 
+def _write_chain_blocks(lines, index, blocks, chain_id, handle, serial, hybrid36):
+    """
+    Re-read the rows of one chain from its blocks and write them as ATOM/HETATM and TER records.
+
+    Only one residue is held in memory at a time. Returns the next free serial number.
+    """
+    import numpy as np
+
+    i_group, i_name, i_altloc, i_resname = index["group"], index["name"], index["altloc"], index["resname"]
+    i_seq, i_icode, i_x, i_y, i_z = index["resseq"], index["icode"], index["x"], index["y"], index["z"]
+    i_occupancy, i_bfactor, i_element = index["occupancy"], index["bfactor"], index["element"]
+
+    residue = None
+    for start, end in blocks:
+        lines.seek(start)
+        current = None
+        atoms = {}
+        for line in lines:
+            if lines.line_start >= end:
+                break
+            row = split_line(line)
+            if row[i_seq] == ".":
+                continue
+            resname = row[i_resname]
+            icode = row[i_icode] if i_icode is not None else "?"
+            key = (row[i_group], row[i_seq], icode, resname)
+            if key != current:
+                if atoms:
+                    serial = _write_residue(handle, atoms, residue, chain_id, serial, hybrid36)
+                current = key
+                atoms = {}
+                residue = (
+                    hetero_flag(row[i_group], resname) != " ", resname, int(row[i_seq]),
+                    " " if icode in (".", "?") else icode,
+                )
+            name = row[i_name]
+            altloc = row[i_altloc] if i_altloc is not None else "."
+            altloc = " " if altloc in (".", "?") else altloc
+            element = row[i_element].upper() if i_element is not None else None
+            _add_atom(atoms, name, altloc, (
+                name, altloc,
+                float(np.float32(row[i_x])), float(np.float32(row[i_y])), float(np.float32(row[i_z])),
+                float(row[i_occupancy]), float(row[i_bfactor]), assign_element(name, element),
+            ))
+        if atoms:
+            serial = _write_residue(handle, atoms, residue, chain_id, serial, hybrid36)
+
+    if residue is not None:
+        _, resname, resseq, icode = residue
+        handle.write(ter_line(format_serial(serial, hybrid36), resname, chain_id, resseq, icode))
+        if hybrid36:
+            serial += 1
+    return serial
+
+
+@traced("stream_cif_to_pdb")
+def stream_cif_to_pdb(input_path, output_path, renumber = False, hybrid36 = False):
+    """
+    Convert the `_atom_site` loop of an mmCIF file to PDB without building a structure.
+
+    The file is scanned once for the byte spans of each chain, then the rows are
+    re-read chain by chain and written as PDB records, so only one residue is held
+    in memory at a time. The output is byte-identical to `cif_to_pdb`. Chain ids
+    longer than one character are remapped to free single-character ids, and with
+    `hybrid36=True` serials beyond 99,999 are written in hybrid-36 notation.
+    Layouts that cannot be streamed (see `scan_atom_site`) fall back to `cif_to_pdb`.
+
+    Returns the chain id mapping.
+    """
+    directory = os.path.dirname(output_path)
+    os.makedirs(directory, exist_ok=True)
+
+    # the rows are re-read by offset, so compressed input is decompressed to scratch once
+    with decompressed(input_path) as plain_path:
+        scan = scan_atom_site(plain_path)
+        if scan is None:
+            logging.info(f"{input_path}: irregular _atom_site layout, using MMCIFParser.")
+            cif_to_pdb(input_path, output_path, renumber)
+            return {}
+        columns, models = scan
+        index = atom_site_index(columns)
+
+        chain_map = remap_chain_ids(models)
+        remapped = {chain_id: new_id for chain_id, new_id in chain_map.items() if chain_id != new_id}
+        if remapped:
+            report = ", ".join(f"{chain_id}->{new_id}" for chain_id, new_id in remapped.items())
+            logging.warning(f"{input_path}: remapped chain ids {report}")
+
+        try:
+            with open(plain_path, "rb") as infile, open_output(output_path) as outfile:
+                lines = LineReader(infile)
+                if renumber:
+                    chains = models[0][1] if models else {}
+                    serial = 1
+                    for chain_id in sorted(chains, key=lambda chain_id: chain_sort_key(chain_map[chain_id])):
+                        if not hybrid36:
+                            serial = 1
+                        serial = _write_chain_blocks(lines, index, chains[chain_id], chain_map[chain_id], outfile, serial, hybrid36)
+                    outfile.write("END\n")
+                else:
+                    for model_num, chains in models:
+                        if len(models) > 1:
+                            outfile.write(f"MODEL      {model_num}\n")
+                        serial = 1
+                        for chain_id, blocks in chains.items():
+                            serial = _write_chain_blocks(lines, index, blocks, chain_map[chain_id], outfile, serial, hybrid36)
+                        if len(models) > 1:
+                            outfile.write("ENDMDL\n")
+                    outfile.write("END   \n")
+        except Exception:
+            os.remove(output_path)
+            raise
+        count("bytes_written", os.path.getsize(output_path))
+
+    return chain_map
+
+
+@traced("stream_cif_to_mmcif")
+def stream_cif_to_mmcif(input_path, output_path):
+    """
+    Rewrite the `_atom_site` loop of an mmCIF file as a plain mmCIF of all models, row by row.
+
+    Author chain ids and residue numbers are kept, serials are renumbered and all
+    other categories are dropped. Label chain, entity and sequence ids are copied
+    when the input has them and rebuilt otherwise (see `cif_writer`). Coordinates
+    and B-factors are copied as text.
+    """
+    directory = os.path.dirname(output_path)
+    os.makedirs(directory, exist_ok=True)
+
+    with open_input(input_path, "r") as infile, open_mmcif(output_path) as writer:
+        columns, rows = read_loop(infile, "_atom_site")
+        index = atom_site_index(columns)
+        i_group, i_name, i_altloc, i_resname = index["group"], index["name"], index["altloc"], index["resname"]
+        i_chain, i_seq, i_icode, i_model = index["chain_id"], index["resseq"], index["icode"], index["model"]
+        i_x, i_y, i_z, i_element = index["x"], index["y"], index["z"], index["element"]
+        i_occupancy, i_bfactor = index["occupancy"], index["bfactor"]
+        i_labels = [index["label_asym_id"], index["label_entity_id"], index["label_seq_id"]]
+        for row in rows:
+            if row[i_seq] == ".":
+                continue
+            name = row[i_name]
+            altloc = row[i_altloc] if i_altloc is not None else "."
+            icode = row[i_icode] if i_icode is not None else "?"
+            element = row[i_element].upper() if i_element is not None else None
+            writer.write_atom(
+                hetero_flag(row[i_group], row[i_resname]) != " ", assign_element(name, element), name,
+                " " if altloc in (".", "?") else altloc, row[i_resname], row[i_chain], int(row[i_seq]),
+                " " if icode in (".", "?") else icode, row[i_x], row[i_y], row[i_z],
+                row[i_occupancy] if i_occupancy is not None else "1.00",
+                row[i_bfactor] if i_bfactor is not None else "0.00",
+                row[i_model] if i_model is not None else 1,
+                *(row[i] if i is not None else None for i in i_labels),
+            )
+
+
+def cif_to_pdb_in_parallel(input_dir, output_dir, renumber = False, n_cpu = 1, stream = False, hybrid36 = False, mmcif = False, force = False, shard = None, compression = None):
+    """
+    Convert every CIF file of `input_dir` (of one `shard` only, if given) with `run_batch`.
+
+    Compressed inputs (`.cif.gz`, ...) are converted too; outputs are compressed
+    with `compression` ("gz", "bz2", "xz" or "zst").
+
+    Files already converted from an unchanged input with the same options (see
+    `batch_manifest.json`) are skipped unless `force` is set.
+    Files that fail are listed in `failures.tsv` in `output_dir` (per shard, see
+    `shard_path`); returns the failures.
+    """
+    from PDBToolkit.PDBOps.batch import FAILURES_NAME, MANIFEST_NAME, run_batch
 
-def cif_to_pdb_in_parallel(input_dir, output_dir, renumber = False, n_cpu = 1):
     os.makedirs(output_dir, exist_ok=True)
-    total_args = []
+    jobs = []
     for filename in os.listdir(input_dir):
-        if filename.lower().endswith('.cif'):
+        if has_extension(filename, '.cif'):
             input_path = os.path.join(input_dir, filename)
-            output_filename = os.path.splitext(filename)[0] + '.pdb'
-            output_path = os.path.join(output_dir, output_filename)
-            total_args.append((input_path, output_path, renumber))
+            output_filename = with_compression(os.path.splitext(strip_compression(filename))[0] + ('.cif' if mmcif else '.pdb'), compression)
+            jobs.append((input_path, os.path.join(output_dir, output_filename)))
+    if shard is not None:
+        outputs = dict(jobs)
+        jobs = [(input_path, outputs[input_path]) for input_path in select_shard(list(outputs), shard)]
 
-    with Pool(n_cpu) as pool:
-        pool.starmap(cif_to_pdb, total_args)
+    if mmcif:
+        function, shared_args = stream_cif_to_mmcif, ()
+    elif stream:
+        function, shared_args = stream_cif_to_pdb, (renumber, hybrid36)
+    else:
+        function, shared_args = cif_to_pdb, (renumber,)
+    return run_batch(
+        function, jobs, shared_args, n_cpu, force, shard_path(os.path.join(output_dir, FAILURES_NAME), shard),
+        manifest_path=shard_path(os.path.join(output_dir, MANIFEST_NAME), shard),
+    )
 
 
 def main(args):
     input_path = os.path.abspath(args.input_path)
     output_path = os.path.abspath(args.output_path)
     if os.path.isfile(input_path):
-        cif_to_pdb(input_path, output_path, args.renumber)
+        if args.compress:
+            output_path = with_compression(output_path, args.compress)
+        if args.mmcif:
+            stream_cif_to_mmcif(input_path, output_path)
+        elif args.stream:
+            stream_cif_to_pdb(input_path, output_path, args.renumber, args.hybrid36)
+        else:
+            cif_to_pdb(input_path, output_path, args.renumber)
     else:
-        cif_to_pdb_in_parallel(input_path, output_path, args.renumber, args.n_cpu)
+        failures = cif_to_pdb_in_parallel(
+            input_path, output_path, args.renumber, args.n_cpu, args.stream, args.hybrid36, args.mmcif, args.force, args.shard,
+            args.compress,
+        )
+        if failures:
+            sys.exit(1)
     logging.info("Done.")
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Convert CIF files to PDB files.')
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Convert CIF files to PDB files.')
     parser.add_argument('input_path', type=str, help='Path to the input CIF file or directory.')
     parser.add_argument('output_path', type=str, help='Path to the output PDB file or directory.')
     parser.add_argument('--renumber', action='store_true', help='Renumber atoms in the structure.')
     parser.add_argument('--n_cpu', type=int, default=1, help='Number of CPUs to use for parallel processing.')
-    args = parser.parse_args()
+    parser.add_argument('--stream', action='store_true', help=
+                        'Convert the _atom_site loop in a streaming pass without MMCIFParser. '
+                        'Chain ids longer than one character are remapped.')
+    parser.add_argument('--hybrid36', action='store_true', help=
+                        'Write atom serials beyond 99,999 in hybrid-36 notation (with --stream).')
+    parser.add_argument('--mmcif', action='store_true', help=
+                        'Write a plain mmCIF of the _atom_site loop (all models, renumbered serials) instead of PDB. '
+                        'Chain ids and atom counts are not limited.')
+    parser.add_argument('--force', action='store_true', help=
+                        'Convert all files of a directory, also those already done with the same options.')
+    parser.add_argument('--shard', type=parse_shard, default=None, help=
+                        'Convert only shard I of N (0-based, e.g. 3/8) of the files of a directory.')
+    parser.add_argument('--compress', choices=COMPRESSIONS, default=None, help=
+                        'Compress the output (adds .gz, .bz2, .xz or .zst; zst needs the zstandard package). '
+                        'Compressed inputs are detected and read without any option.')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -64,4 +460,9 @@ if __name__ == '__main__':
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
 
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,139 @@
+"""
+Stream rows of a single mmCIF category loop without building the full mmCIF dictionary.
+"""
+import re
+
+_TOKEN_PATTERN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(#)|(\S+)""")
+
+
+def split_line(line):
+    """
+    Split one line of mmCIF data into tokens, honouring single and double quotes.
+
+    A quote only closes a token when followed by whitespace or the end of the line,
+    so values such as "O5'" are kept intact.
+    """
+    if '"' not in line and "'" not in line and "#" not in line:
+        return line.split()
+
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(line):
+        kind = match.lastindex
+        if kind == 3:
+            break
+        token = match.group(kind)
+        if kind == 4 and token[0] in "'\"":
+            raise ValueError(f"Unterminated quoted token in line: {line.rstrip()}")
+        tokens.append(token)
+    return tokens
+
+
+def _read_text_field(first_line, handle):
+    """
+    Read a semicolon-delimited text field; `first_line` is the line starting with ';'.
+    """
+    parts = [first_line[1:].rstrip("\r\n")]
+    for line in handle:
+        if line.startswith(";"):
+            return "\n".join(parts), line[1:]
+        parts.append(line.rstrip("\r\n"))
+    raise ValueError("Unterminated text field.")
+
+
+def _iter_rows(handle, n_columns, line):
+    row = []
+    while line is not None:
+        if line.startswith(";"):
+            value, line = _read_text_field(line, handle)
+            row.append(value)
+            continue
+        stripped = line.lstrip()
+        if stripped.startswith(("_", "loop_", "data_", "#")) and not row:
+            return
+        row.extend(split_line(line))
+        while len(row) >= n_columns:
+            yield row[:n_columns]
+            row = row[n_columns:]
+        line = next(handle, None)
+    if row:
+        raise ValueError(f"Incomplete row at end of loop: {row}")
+
+
+def _pair_value(line, handle):
+    tokens = split_line(line)
+    if len(tokens) > 1:
+        return tokens[1]
+    line = next(handle)
+    if line.startswith(";"):
+        return _read_text_field(line, handle)[0]
+    return split_line(line)[0]
+
+
+def read_loop(handle, category):
+    """
+    Find the first occurrence of `category` (e.g. "_atom_site") in an open mmCIF file.
+
+    Returns `(columns, rows)` where `columns` is the list of item names without the
+    category prefix and `rows` is a generator of token lists, one per row. Only the
+    lines of this loop are ever held in memory. A category written as plain
+    key-value pairs is returned as a single row. Raises KeyError if the category
+    is not present.
+    """
+    prefix = category + "."
+    in_loop_header = False
+    columns = []
+    values = []
+    for line in handle:
+        stripped = line.lstrip()
+        if stripped.startswith(prefix):
+            columns.append(stripped.split(None, 1)[0][len(prefix):])
+            if not in_loop_header:
+                values.append(_pair_value(stripped, handle))
+            continue
+        if columns:
+            if values:
+                return columns, iter([values])
+            return columns, _iter_rows(handle, len(columns), line)
+        if stripped.startswith("loop_"):
+            in_loop_header = True
+        elif not stripped.startswith("_"):
+            in_loop_header = False
+
+    if not columns:
+        raise KeyError(f"Category {category} not found.")
+    if values:
+        return columns, iter([values])
+    return columns, iter([])
+
+
+class LineReader:
+    """
+    Iterate the decoded lines of a file opened in binary mode, keeping byte offsets.
+
+    `line` is the last line returned, `line_start` its offset and `offset` the offset
+    of the next one, so positions found while reading can later be revisited with
+    `seek`. Can be passed to `read_loop` in place of a text handle.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.offset = handle.tell()
+        self.line_start = self.offset
+        self.line = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.handle.readline()
+        if not line:
+            raise StopIteration
+        self.line_start = self.offset
+        self.offset += len(line)
+        self.line = line.decode()
+        return self.line
+
+    def seek(self, offset):
+        self.handle.seek(offset)
+        self.offset = offset
+        self.line_start = offset
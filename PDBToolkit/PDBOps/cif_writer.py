@@ -0,0 +1,193 @@
+"""
+Stream mmCIF `_atom_site` loops row by row.
+
+`AtomSiteWriter` writes each atom as soon as it is given, from an `AtomTable`, a
+Biopython structure or PDB ATOM/HETATM lines, so memory does not grow with the
+structure and there are no atom serial or chain id limits. Author fields
+(`auth_*`) keep the residue numbers, names and chain ids of the input. Label
+fields given by the caller (from an mmCIF input) are written as they are;
+otherwise the polymer of each chain is labelled with the author chain id and
+`label_seq_id` numbers its residues from 1, while each non-polymer residue (all
+waters of a chain together) gets its own `label_asym_id`, `<chain>_<n>`, and
+`label_seq_id` `.`.
+"""
+import os
+from contextlib import contextmanager
+
+from PDBToolkit.PDBOps.pdb_writer import chain_sort_key
+from PDBToolkit.PDBOps.compression import open_output, strip_compression
+from PDBToolkit.tracing import count
+
+ATOM_SITE_COLUMNS = (
+    "group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+    "label_asym_id", "label_entity_id", "label_seq_id", "pdbx_PDB_ins_code",
+    "Cartn_x", "Cartn_y", "Cartn_z", "occupancy", "B_iso_or_equiv",
+    "auth_seq_id", "auth_comp_id", "auth_asym_id", "auth_atom_id", "pdbx_PDB_model_num",
+)
+WATER_NAMES = ("HOH", "WAT", "DOD")
+
+
+def cif_token(value):
+    """
+    Quote a value where mmCIF requires it; empty values become '.'.
+    """
+    if value == "":
+        return "."
+    if " " in value or value[0] in "_#$'\";[]" or value in (".", "?"):
+        return f'"{value}"' if '"' not in value else f"'{value}'"
+    return value
+
+
+def _label_token(value):
+    # '.' and '?' given for label fields are null values, not text
+    return value if value in (".", "?") else cif_token(value)
+
+
+def atom_site_header(data_name = "structure"):
+    return f"data_{cif_token(data_name)}\n#\nloop_\n" + "".join(f"_atom_site.{column}\n" for column in ATOM_SITE_COLUMNS)
+
+
+class AtomSiteWriter:
+    """
+    Write the rows of one `_atom_site` loop to an open text handle.
+
+    Use as a context manager; the loop is closed on exit. Serial numbers run from
+    1 over all rows. Chains may be written in any order and more than once (e.g. a
+    ligand block after all polymer chains); generated `label_seq_id` and
+    non-polymer `label_asym_id` continue per chain.
+    """
+
+    def __init__(self, handle, data_name = "structure"):
+        self.handle = handle
+        self.serial = 0
+        self._model = None
+        self._residue = None
+        self._label_seq = {}
+        self._label_asym = {}
+        self._n_nonpolymer = {}
+        self._current_seq = "."
+        self._current_asym = "."
+        handle.write(atom_site_header(data_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.handle.write("#\n")
+
+    def write_atom(
+        self, hetatm, element, name, altloc, resname, chain_id, resseq, icode,
+        x, y, z, occupancy, bfactor, model_num = 1,
+        label_asym_id = None, label_entity_id = None, label_seq_id = None
+    ):
+        """
+        Write one atom. Coordinates, occupancy and B-factor must already be formatted as text.
+
+        Label fields left as None are generated (see the module docstring).
+        """
+        if model_num != self._model:
+            self._model = model_num
+            self._residue = None
+            self._label_seq = {}
+            self._label_asym = {}
+            self._n_nonpolymer = {}
+        residue = (chain_id, resseq, icode, resname)
+        if residue != self._residue:
+            self._residue = residue
+            if hetatm:
+                self._current_seq = "."
+                self._current_asym = self._nonpolymer_asym(chain_id, resname, residue)
+            else:
+                self._current_seq = self._label_seq[chain_id] = self._label_seq.get(chain_id, 0) + 1
+                self._current_asym = cif_token(chain_id)
+        self.serial += 1
+        name = cif_token(name)
+        resname = cif_token(resname)
+        chain_id = cif_token(chain_id)
+        label_asym_id = self._current_asym if label_asym_id is None else _label_token(label_asym_id)
+        label_entity_id = "." if label_entity_id is None else _label_token(label_entity_id)
+        label_seq_id = self._current_seq if label_seq_id is None else _label_token(label_seq_id)
+        self.handle.write(
+            f"{'HETATM' if hetatm else 'ATOM'} {self.serial} {element or '?'} {name} {altloc.strip() or '.'} "
+            f"{resname} {label_asym_id} {label_entity_id} {label_seq_id} {icode.strip() or '?'} "
+            f"{x} {y} {z} {occupancy} {bfactor} {resseq} {resname} {chain_id} {name} {model_num}\n"
+        )
+
+    def _nonpolymer_asym(self, chain_id, resname, residue):
+        key = (chain_id, "water") if resname in WATER_NAMES else residue
+        if key not in self._label_asym:
+            n = self._n_nonpolymer[chain_id] = self._n_nonpolymer.get(chain_id, 0) + 1
+            self._label_asym[key] = cif_token(f"{chain_id}_{n}")
+        return self._label_asym[key]
+
+    def write_record(self, line, chain_id = None, model_num = 1):
+        """
+        Write a PDB ATOM/HETATM line, optionally under a new chain id.
+
+        Numeric columns are copied as text; a missing element is taken from the atom name.
+        """
+        name = line[12:16].strip()
+        self.write_atom(
+            line[:6] == "HETATM", line[76:78].strip().upper() or name.lstrip("0123456789")[:1],
+            name, line[16:17], line[17:20].strip(), line[21:22] if chain_id is None else chain_id,
+            int(line[22:26]), line[26:27], line[30:38].strip(), line[38:46].strip(), line[46:54].strip(),
+            line[54:60].strip() or "1.00", line[60:66].strip() or "0.00", model_num,
+        )
+
+    def write_table(self, table, model_num = 1):
+        rows = zip(
+            table.hetatm.tolist(), table.element.tolist(), table.name.tolist(), table.altloc.tolist(),
+            table.resname.tolist(), table.chain_id.tolist(), table.resseq.tolist(), table.icode.tolist(),
+            table.coord.tolist(), table.occupancy.tolist(), table.bfactor.tolist(),
+        )
+        for hetatm, element, name, altloc, resname, chain_id, resseq, icode, (x, y, z), occupancy, bfactor in rows:
+            self.write_atom(
+                hetatm, element, name, altloc, resname, chain_id, resseq, icode,
+                f"{x:.3f}", f"{y:.3f}", f"{z:.3f}", f"{occupancy:.2f}", f"{bfactor:.2f}", model_num,
+            )
+
+    def write_chain(self, chain, chain_id = None, model_num = 1):
+        """
+        Write a Biopython chain, unpacking disordered residues and atoms the way PDBIO does.
+        """
+        chain_id = chain.id if chain_id is None else chain_id
+        for residue in chain.get_unpacked_list():
+            hetfield, resseq, icode = residue.id
+            for atom in residue.get_unpacked_list():
+                x, y, z = atom.coord
+                occupancy = atom.occupancy if atom.occupancy is not None else 1.0
+                self.write_atom(
+                    hetfield != " ", (atom.element or "").strip().upper(), atom.get_name(), atom.altloc,
+                    residue.resname, chain_id, resseq, icode,
+                    f"{x:.3f}", f"{y:.3f}", f"{z:.3f}", f"{occupancy:.2f}", f"{atom.bfactor:.2f}", model_num,
+                )
+
+
+@contextmanager
+def open_mmcif(output_path, data_name = None):
+    """
+    Open `output_path` for writing and yield an `AtomSiteWriter` on it.
+
+    `data_name` defaults to the file name without extension. A compression
+    extension (`.cif.gz`) compresses the file.
+    """
+    if data_name is None:
+        data_name = os.path.splitext(os.path.basename(strip_compression(output_path)))[0]
+    with open_output(output_path) as handle:
+        with AtomSiteWriter(handle, data_name) as writer:
+            yield writer
+    count("bytes_written", os.path.getsize(output_path))
+
+
+def write_structure_mmcif(structure, output_path, chain_order = None):
+    """
+    Write the first model of a Biopython structure as mmCIF, chains in the requested order.
+    """
+    chains = sorted(structure[0], key=lambda chain: chain_sort_key(chain.id, chain_order))
+    with open_mmcif(output_path) as writer:
+        for chain in chains:
+            writer.write_chain(chain)
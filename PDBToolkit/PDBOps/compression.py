@@ -0,0 +1,208 @@
+"""
+Transparent compression of structure files.
+
+`open_input` recognises gzip, bzip2, xz and Zstandard files by their magic bytes,
+whatever their name, and decompresses them while they are read; plain files are
+opened as before. `open_output` compresses according to the extension of the
+output path (`model.pdb.gz`), so writers only have to be given a compressed name.
+Readers that seek back into the file (the streaming converters scan it once for
+offsets, then copy blocks) and external binaries get a decompressed copy in a
+scratch directory from `decompressed` instead, placed on tmpfs (/dev/shm) when
+available or in PDBTOOLKIT_SCRATCH, so the compressed file is read only once.
+
+Zstandard needs the optional `zstandard` package.
+"""
+import os
+import io
+import bz2
+import gzip
+import lzma
+import shutil
+import tempfile
+import contextlib
+
+from PDBToolkit.tracing import count
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ("gz", "bz2", "xz", "zst")
+MAGIC = {
+    "gz": b"\x1f\x8b",
+    "bz2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+    "zst": b"\x28\xb5\x2f\xfd",
+}
+SCRATCH_ENV = "PDBTOOLKIT_SCRATCH"
+TMPFS_DIR = "/dev/shm"
+# gzip level 6 (as the gzip tool) instead of the module default 9
+GZIP_LEVEL = 6
+CHUNK_SIZE = 1 << 20
+
+
+def detect_compression(path):
+    """
+    The compression of `path` ("gz", "bz2", "xz" or "zst") from its first bytes, or None for a plain file.
+    """
+    with open(path, "rb") as f:
+        head = f.read(6)
+    for compression, magic in MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def compression_from_name(path):
+    """
+    The compression implied by the extension of `path`, or None.
+    """
+    extension = os.path.splitext(path)[1].lower()[1:]
+    return extension if extension in COMPRESSIONS else None
+
+
+def strip_compression(path):
+    """
+    `model.pdb.gz` -> `model.pdb`; other names are returned unchanged.
+    """
+    return os.path.splitext(path)[0] if compression_from_name(path) else path
+
+
+def with_compression(path, compression):
+    """
+    `path` with the extension of `compression` (None keeps it plain), replacing any compression extension.
+    """
+    path = strip_compression(path)
+    return f"{path}.{compression}" if compression else path
+
+
+def has_extension(filename, extensions):
+    """
+    `str.endswith` on the name without its compression extension, ignoring case.
+    """
+    return strip_compression(filename).lower().endswith(extensions)
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError("Zstandard files need the 'zstandard' package (pip install zstandard).")
+    return zstandard
+
+
+def _open_binary(path, compression, mode):
+    if compression == "gz":
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL) if mode == "wb" else gzip.open(path, mode)
+    if compression == "bz2":
+        return bz2.open(path, mode)
+    if compression == "xz":
+        return lzma.open(path, mode)
+    if mode == "wb":
+        return _zstandard().ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+    return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+
+
+def open_input(path, mode = "rb"):
+    """
+    Open `path` for reading ("rb" or "r"), decompressing it on the fly if it is compressed.
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, mode)
+    count("compressed_bytes_read", os.path.getsize(path))
+    handle = _open_binary(path, compression, "rb")
+    return handle if "b" in mode else io.TextIOWrapper(handle)
+
+
+def open_output(path, mode = "w", compression = None):
+    """
+    Open `path` for writing ("w" or "wb"), compressed with `compression` or as its extension says.
+    """
+    compression = compression or compression_from_name(path)
+    if compression is None:
+        return open(path, mode)
+    handle = _open_binary(path, compression, "wb")
+    return handle if "b" in mode else io.TextIOWrapper(handle)
+
+
+def scratch_dir():
+    """
+    Directory for decompressed copies: PDBTOOLKIT_SCRATCH, else /dev/shm if writable, else the temp directory.
+    """
+    directory = os.environ.get(SCRATCH_ENV)
+    if directory:
+        return directory
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+@contextlib.contextmanager
+def decompressed(path):
+    """
+    Yield a plain copy of `path` in the scratch directory, removed on exit; plain files are yielded as is.
+
+    The copy keeps the name of `path` without the compression extension, as
+    external binaries may look at the extension (`.pdb`, `.cif`).
+    """
+    if detect_compression(path) is None:
+        yield path
+        return
+    temp_dir = tempfile.mkdtemp(prefix="pdbtoolkit_", dir=scratch_dir())
+    try:
+        yield decompress_to(path, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def decompress_to(path, directory):
+    """
+    Write a plain copy of `path` into `directory`, named without the compression extension; returns its path.
+    """
+    plain_path = os.path.join(directory, os.path.basename(strip_compression(path)))
+    with open_input(path) as infile, open(plain_path, "wb") as outfile:
+        shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+    return plain_path
+
+
+@contextlib.contextmanager
+def plain_output(path):
+    """
+    Yield a path for writers that need a plain, seekable file (e.g. PDBIO), compressed into `path` on exit.
+
+    Paths without a compression extension are yielded as is.
+    """
+    if compression_from_name(path) is None:
+        yield path
+        return
+    temp_dir = tempfile.mkdtemp(prefix="pdbtoolkit_", dir=scratch_dir())
+    try:
+        plain_path = os.path.join(temp_dir, os.path.basename(strip_compression(path)))
+        yield plain_path
+        with open(plain_path, "rb") as infile, open_output(path, "wb") as outfile:
+            shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def decompressed_all(paths):
+    """
+    `decompressed` for several files at once; yields the list of plain paths.
+    """
+    with contextlib.ExitStack() as stack:
+        yield [stack.enter_context(decompressed(path)) for path in paths]
+
+
+@contextlib.asynccontextmanager
+async def decompressed_async(path):
+    """
+    `decompressed` for coroutines: the copy is written in a worker thread, so the event loop keeps running.
+    """
+    import asyncio
+    context = decompressed(path)
+    plain_path = await asyncio.to_thread(context.__enter__)
+    try:
+        yield plain_path
+    finally:
+        await asyncio.to_thread(context.__exit__, None, None, None)
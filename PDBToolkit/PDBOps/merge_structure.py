@@ -2,60 +2,159 @@
 Merge structures into one.
 """
 from typing import List
-from Bio import PDB
 import os
 import argparse
 import logging
+import contextlib
 
-from renumber_atom import renumber_atom
+from PDBToolkit.PDBOps.pdb_writer import CHAIN_IDS, chain_label, format_serial, ter_line
+from PDBToolkit.PDBOps.cif_writer import open_mmcif
+from PDBToolkit.PDBOps.compression import COMPRESSIONS, compression_from_name, decompressed, has_extension, open_output, strip_compression, with_compression
+from PDBToolkit.PDBOps.reassign_chain_id import scan_chain_blocks
+from PDBToolkit.tracing import count, traced, tracing
 
 
 logging.basicConfig(level=logging.INFO)
 
 
-def merge_structures(input_files: List, output_file, renumber = True):
+class _TooManyChains(Exception):
+    pass
+
+
+def iter_chains(input_files):
+    """
+    Yield the ATOM/HETATM lines of every chain of the first model of each input, one chain at a time.
+
+    Chains come in input order and, within a file, in order of first appearance;
+    blocks of a chain that is split in the file are joined. Only one file is open
+    and only the lines of one chain are held in memory. Compressed inputs are
+    decompressed to scratch one at a time.
+    """
+    for input_file in input_files:
+        with decompressed(input_file) as plain_file, open(plain_file, "rb") as f:
+            blocks = scan_chain_blocks(plain_file)
+            for chain_blocks in blocks.values():
+                lines = []
+                for start, end in chain_blocks:
+                    f.seek(start)
+                    lines.extend(f.read(end - start).decode().splitlines())
+                yield lines
+
+
+def _write_pdb(chains, handle, renumber):
+    serial = 1
+    for index, lines in enumerate(chains):
+        if index == len(CHAIN_IDS):
+            raise _TooManyChains()
+        chain_id = CHAIN_IDS[index]
+        if renumber:
+            serial = 1
+        for line in lines:
+            handle.write(f"{line[:6]}{format_serial(serial):>5}{line[11:21]}{chain_id}{line[22:]}\n")
+            serial += 1
+        handle.write(ter_line(format_serial(serial), line[17:20], chain_id, int(line[22:26]), line[26:27] or " "))
+    handle.write("END\n")
+
+
+def _write_mmcif(chains, output_file):
+    with open_mmcif(output_file) as writer:
+        for index, lines in enumerate(chains):
+            chain_id = chain_label(index)
+            for line in lines:
+                writer.write_record(line, chain_id)
+
+
+def merge_tables(tables):
+    """
+    Merge AtomTables into one, naming the chains A, B, ... in input order like `merge_structures`.
+
+    Chains of a table come in order of first appearance with split blocks joined.
+    Past 62 chains the ids continue as AA, AB, ... (see `chain_label`), which only
+    `write_mmcif` can write.
+    """
+    from PDBToolkit.PDBOps.atom_table import concatenate
+
+    chains = [(chain_id, table.chain(chain_id)) for table in tables for chain_id in table.chain_ids]
+    return concatenate(
+        chain.rename_chains({chain_id: chain_label(index)}) for index, (chain_id, chain) in enumerate(chains)
+    )
+
+
+@traced("merge_structures")
+def merge_structures(input_files: List, output_file, renumber = True, mmcif = False):
+    """
+    Merge the first models of PDB files into one file, naming the chains A, B, ... in input order.
+
+    Records are streamed from one input at a time with only the chain id and the
+    serial number rewritten; all other columns are copied unchanged. With `renumber`
+    serials restart at 1 for every chain like `renumber_atom`, otherwise they run
+    over the whole file like PDBIO. With `mmcif`, or when `output_file` ends in .cif,
+    an mmCIF file with chain ids AA, AB, ... after the one-character ids is written
+    instead. PDB output with more than 62 chains falls back to mmCIF, with the
+    extension of `output_file` changed to .cif. A compression extension
+    (`merged.pdb.gz`) compresses the output.
+
+    Returns the path of the written file.
+    """
     output_file = os.path.abspath(output_file)
     directory = os.path.dirname(output_file)
     os.makedirs(directory, exist_ok=True)
-    
-    parser = PDB.PDBParser(QUIET=True)
-    structure = PDB.Structure.Structure('structure')
-    model = PDB.Model.Model(0)
-    structure.add(model)
-    chain_ids = list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
 
-    for input_file in input_files:
-        sub_model = parser.get_structure('sub_model', input_file)[0]
-        for chain in sub_model:
-            new_chain = chain.copy()
-            new_chain.id = chain_ids.pop(0)
-            model.add(new_chain)
-
-    if renumber:
-        renumber_atom(structure, output_file)
-    else:
-        io = PDB.PDBIO()
-        io.set_structure(structure)
-        io.save(output_file)
-    
+    mmcif = mmcif or has_extension(output_file, ".cif")
+    if not mmcif:
+        try:
+            with open_output(output_file) as handle:
+                _write_pdb(iter_chains(input_files), handle, renumber)
+            count("bytes_written", os.path.getsize(output_file))
+        except _TooManyChains:
+            os.remove(output_file)
+            output_file = with_compression(os.path.splitext(strip_compression(output_file))[0] + ".cif", compression_from_name(output_file))
+            logging.warning(f"More than {len(CHAIN_IDS)} chains do not fit in PDB format, writing {output_file}")
+            mmcif = True
+        except Exception:
+            # open_output may have failed before creating the file
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(output_file)
+            raise
+    if mmcif:
+        _write_mmcif(iter_chains(input_files), output_file)
+
     logging.info(f"Successfully merged structures into {output_file}")
+    return output_file
 
 def main(args):
     input_files = [os.path.join(args.input_dir, file) for file in os.listdir(args.input_dir)]
-    merge_structures(input_files, args.output_file, not args.no_renumber)
-    
+    output_file = with_compression(args.output_file, args.compress) if args.compress else args.output_file
+    merge_structures(input_files, output_file, not args.no_renumber, args.mmcif)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Merge multiple PDB files into one')
+
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Merge multiple PDB files into one')
     parser.add_argument('input_dir', help='Input directory')
-    parser.add_argument('output_file', help='Output merged PDB file')
+    parser.add_argument('output_file', help=
+                        'Output merged PDB file. More than 62 chains are written as mmCIF with a .cif extension.')
     parser.add_argument('--no_renumber', action='store_true', help='Do not renumber atoms in the structure.')
-    args = parser.parse_args()
+    parser.add_argument('--mmcif', action='store_true', help=
+                        'Write mmCIF without chain id or atom serial limits.')
+    parser.add_argument('--compress', choices=COMPRESSIONS, default=None, help=
+                        'Compress the output (adds .gz, .bz2, .xz or .zst; zst needs the zstandard package). '
+                        'Compressed inputs are detected and read without any option.')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
     for key, value in vars(args).items():
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
-    
-    main(args)
+
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == '__main__':
+    cli()
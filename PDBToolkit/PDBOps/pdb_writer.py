@@ -0,0 +1,192 @@
+"""
+Format and stream PDB records without going through PDBIO.
+"""
+import os
+
+from PDBToolkit.PDBOps.compression import open_output
+from PDBToolkit.tracing import traced
+
+ATOM_FORMAT = "%s%5s %-4s%c%3s %c%4i%c   %8.3f%8.3f%8.3f%s%s      %4s%2s%2s\n"
+TER_FORMAT = "TER   %5s      %3s %c%4i%c                                                      \n"
+
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+_HY36_DIGITS_UPPER = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_HY36_DIGITS_LOWER = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _encode_base(value, digits):
+    base = len(digits)
+    result = []
+    while True:
+        value, rest = divmod(value, base)
+        result.append(digits[rest])
+        if value == 0:
+            break
+    return "".join(reversed(result))
+
+
+def hy36encode(width, value):
+    """
+    Encode an integer in hybrid-36 so that it fits in a field of the given width.
+
+    Values up to 10**width - 1 are written as plain decimals, larger values
+    continue with upper-case and then lower-case base-36 numbers.
+    """
+    if value < 10 ** width:
+        return str(value)
+    value -= 10 ** width
+    n_upper = 26 * 36 ** (width - 1)
+    if value < n_upper:
+        return _encode_base(value + 10 * 36 ** (width - 1), _HY36_DIGITS_UPPER)
+    value -= n_upper
+    if value < n_upper:
+        return _encode_base(value + 10 * 36 ** (width - 1), _HY36_DIGITS_LOWER)
+    raise ValueError(f"Value {value} is out of range for hybrid-36 with width {width}.")
+
+
+def format_serial(serial, hybrid36 = False):
+    if hybrid36:
+        return hy36encode(5, serial)
+    if serial > 99999:
+        raise ValueError(f"Atom serial number ('{serial}') exceeds PDB format limit.")
+    return str(serial)
+
+
+def format_bfactor(value):
+    """
+    Format a B-factor into the 6 columns allowed by the PDB format, as PDBIO does.
+    """
+    if value < 1000:
+        if len(f"{value:.2f}") > 6:
+            return f"{value:6.1f}"
+        return f"{value:6.2f}"
+    if value < 10000:
+        if len(f"{value:.1f}") > 6:
+            return f"{value:6.0f}"
+        return f"{value:6.1f}"
+    if value < 999999:
+        return f"{int(value):6d}"
+    return f"{999999:6d}"
+
+
+def format_occupancy(value):
+    if value is None:
+        return " " * 6
+    return f"{value:6.2f}"
+
+
+def format_element(element):
+    if element:
+        return element.strip().upper().rjust(2)
+    return "  "
+
+
+def format_atom_name(name, element):
+    """
+    Pad the atom name the way PDBIO does: names shorter than 4 characters that start
+    with a letter and belong to a one-letter element are shifted by one column.
+    """
+    name = name.strip()
+    if len(name) < 4 and name[:1].isalpha() and len(element.strip()) < 2:
+        name = " " + name
+    return name
+
+
+def atom_line(
+    hetatm, serial, name, altloc, resname, chain_id, resseq, icode,
+    x, y, z, occupancy, bfactor, segid, element, charge = "  "
+):
+    """
+    Return one ATOM/HETATM line. `serial` must already be formatted (see `format_serial`).
+    """
+    element = format_element(element)
+    record_type = "HETATM" if hetatm else "ATOM  "
+    return ATOM_FORMAT % (
+        record_type, serial, format_atom_name(name, element), altloc, resname,
+        chain_id, resseq, icode, x, y, z,
+        format_occupancy(occupancy), format_bfactor(bfactor), segid, element, charge,
+    )
+
+
+def ter_line(serial, resname, chain_id, resseq, icode):
+    return TER_FORMAT % (serial, resname, chain_id, resseq, icode)
+
+
+def chain_label(index):
+    """
+    Chain id of the `index`-th chain: the 62 one-character ids of `CHAIN_IDS`, then
+    AA, AB, ... and longer ids (mmCIF only).
+    """
+    if index < len(CHAIN_IDS):
+        return CHAIN_IDS[index]
+    return chain_label(index // len(CHAIN_IDS) - 1) + CHAIN_IDS[index % len(CHAIN_IDS)]
+
+
+def chain_sort_key(chain_id, chain_order = None):
+    """
+    Key used to order chains: by `chain_order` if given, otherwise letters first
+    and then digits, each alphabetically.
+    """
+    if chain_order:
+        return chain_order.index(chain_id)
+    return (chain_id.isdigit(), chain_id)
+
+
+def write_chain(chain, handle, serial = 1, hybrid36 = False):
+    """
+    Write the atoms of a Biopython chain followed by a TER record.
+
+    Returns the next free serial number. Disordered residues and atoms are
+    unpacked the same way PDBIO does.
+    """
+    chain_id = chain.id
+    if len(chain_id) > 1:
+        raise ValueError(f"Chain id ('{chain_id}') exceeds PDB format limit.")
+
+    residue = None
+    for residue in chain.get_unpacked_list():
+        hetfield, resseq, icode = residue.id
+        if resseq > 9999:
+            raise ValueError(f"Residue number ('{resseq}') exceeds PDB format limit.")
+        resname = residue.resname
+        segid = residue.segid
+        hetatm = hetfield != " "
+        for atom in residue.get_unpacked_list():
+            x, y, z = atom.coord
+            handle.write(atom_line(
+                hetatm, format_serial(serial, hybrid36), atom.fullname, atom.altloc,
+                resname, chain_id, resseq, icode, x, y, z,
+                atom.occupancy, atom.bfactor, segid, atom.element,
+            ))
+            serial += 1
+
+    if residue is not None:
+        _, resseq, icode = residue.id
+        handle.write(ter_line(format_serial(serial, hybrid36), residue.resname, chain_id, resseq, icode))
+        if hybrid36:
+            serial += 1
+
+    return serial
+
+
+@traced("write_structure")
+def write_structure(structure, output_path, chain_order = None, hybrid36 = False):
+    """
+    Write the first model of a structure as PDB in a single pass, chains in the requested order.
+
+    By default atom serial numbers restart at 1 for every chain, which keeps each
+    chain below the 99,999 limit. With `hybrid36=True` serials run continuously
+    across chains and overflow into hybrid-36 notation instead.
+    """
+    model = structure[0]
+    chains = sorted(model, key=lambda chain: chain_sort_key(chain.id, chain_order))
+
+    output_path = os.path.abspath(output_path)
+    with open_output(output_path) as handle:
+        serial = 1
+        for chain in chains:
+            if not hybrid36:
+                serial = 1
+            serial = write_chain(chain, handle, serial, hybrid36)
+        handle.write("END\n")
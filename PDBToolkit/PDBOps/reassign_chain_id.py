@@ -1,12 +1,14 @@
 """
 Modify chain ids in PDB files.
 """
-from Bio import PDB
 import os
+import sys
 import argparse
 import logging
-from multiprocessing import Pool
-from renumber_atom import renumber_atom
+from PDBToolkit.PDBOps.pdb_writer import chain_sort_key, format_serial, ter_line
+from PDBToolkit.PDBOps.cif_writer import open_mmcif, write_structure_mmcif
+from PDBToolkit.PDBOps.compression import COMPRESSIONS, decompressed, has_extension, open_input, open_output, plain_output, strip_compression, with_compression
+from PDBToolkit.tracing import count, traced, tracing
 
 logging.basicConfig(level=logging.INFO)
 
@@ -20,22 +22,29 @@ def sort_chains(model, chain_order = None):
     else:
         sorted_chains = sorted(model, key=lambda chain: (chain.id.isdigit(), chain.id))
 
-    for chain in model:
+    for chain in list(model):
         model.detach_child(chain.id)
 
     for chain in sorted_chains:
         model.add(chain)
 
 
-def reassign_chain_id(input_path, output_path, chain_map, chain_order = None, renumber = True):
+@traced("reassign_chain_id")
+def reassign_chain_id(input_path, output_path, chain_map, chain_order = None, renumber = True, mmcif = False):
     """
     Reassign chain ids of a PDB file according to the given chain map.
+
+    With `mmcif` the output is written as mmCIF, where new chain ids may have any length.
     """
+    from Bio import PDB
+    from PDBToolkit.PDBOps.renumber_atom import renumber_atom
+
     directory = os.path.dirname(output_path)
     os.makedirs(directory, exist_ok=True)
 
     parser = PDB.PDBParser(QUIET=True)
-    model = parser.get_structure('structure', input_path)[0]
+    with open_input(input_path, "r") as handle:
+        model = parser.get_structure('structure', handle)[0]
 
     new_structure = PDB.Structure.Structure('new_structure')
     new_model = PDB.Model.Model(0)
@@ -48,60 +57,215 @@ def reassign_chain_id(input_path, output_path, chain_map, chain_order = None, re
             new_chain.add(residue.copy())
         new_model.add(new_chain)
 
-    if renumber:
+    if mmcif:
+        write_structure_mmcif(new_structure, output_path, chain_order=chain_order)
+    elif renumber:
         renumber_atom(new_structure, output_path, chain_order=chain_order)
     else:
         sort_chains(new_model, chain_order=chain_order)
         io = PDB.PDBIO()
         io.set_structure(new_structure)
-        io.save(output_path)
+        with plain_output(output_path) as plain_path:
+            io.save(plain_path)
+
+
+def scan_chain_blocks(input_path):
+    """
+    Return the byte spans of the coordinate records of each chain in the first model.
+
+    The result maps each chain id to a list of (start, end) offsets of contiguous
+    ATOM/HETATM lines, in file order. Chains split over several blocks (e.g. a
+    ligand listed after all polymers) keep all of their blocks.
+    """
+    blocks = {}
+    offset = 0
+    block_chain = None
+    block_start = 0
+    with open(input_path, "rb") as f:
+        for line in f:
+            record = line[:6]
+            if record == b"ATOM  " or record == b"HETATM":
+                chain_id = line[21:22].decode()
+                if chain_id != block_chain:
+                    if block_chain is not None:
+                        blocks.setdefault(block_chain, []).append((block_start, offset))
+                    block_chain = chain_id
+                    block_start = offset
+            else:
+                if block_chain is not None:
+                    blocks.setdefault(block_chain, []).append((block_start, offset))
+                    block_chain = None
+                if record == b"ENDMDL":
+                    break
+            offset += len(line)
+    if block_chain is not None:
+        blocks.setdefault(block_chain, []).append((block_start, offset))
+    return blocks
+
+
+@traced("reassign_chain_id_fast")
+def reassign_chain_id_fast(input_path, output_path, chain_map, chain_order = None, renumber = True, mmcif = False, hybrid36 = False):
+    """
+    Reassign chain ids of a PDB file by rewriting the fixed-width records directly.
+
+    Produces the same chains, order, serial numbering and TER records as
+    `reassign_chain_id` without building a Biopython structure: the file is scanned
+    once for chain block offsets, then each block is copied in the requested chain
+    order with column 22 (and the serial number) rewritten. All other columns are
+    kept exactly as in the input. With `mmcif` the records are streamed into an
+    mmCIF file instead.
+
+    Serials beyond 99,999 raise ValueError unless `hybrid36=True`, which writes them
+    in hybrid-36 notation running over the whole file, TER records included, as
+    `write_pdb` does.
+    """
+    directory = os.path.dirname(output_path)
+    os.makedirs(directory, exist_ok=True)
+
+    # blocks are re-read by offset, so compressed input is decompressed to scratch once
+    with decompressed(input_path) as plain_path:
+        blocks = scan_chain_blocks(plain_path)
+        new_ids = {chain_id: chain_map[chain_id] for chain_id in blocks}
+        chains = sorted(blocks, key=lambda chain_id: chain_sort_key(new_ids[chain_id], chain_order))
+
+        if mmcif:
+            with open(plain_path, "rb") as infile, open_mmcif(output_path) as writer:
+                for chain_id in chains:
+                    for start, end in blocks[chain_id]:
+                        infile.seek(start)
+                        for line in infile.read(end - start).decode().splitlines():
+                            writer.write_record(line, new_ids[chain_id])
+            return
 
+        with open(plain_path, "rb") as infile, open_output(output_path) as outfile:
+            serial = 1
+            for chain_id in chains:
+                new_chain_id = new_ids[chain_id]
+                if renumber and not hybrid36:
+                    serial = 1
+                line = None
+                for start, end in blocks[chain_id]:
+                    infile.seek(start)
+                    for line in infile.read(end - start).decode().splitlines():
+                        outfile.write(f"{line[:6]}{format_serial(serial, hybrid36):>5}{line[11:21]}{new_chain_id}{line[22:]}\n")
+                        serial += 1
+                if line is not None:
+                    outfile.write(ter_line(format_serial(serial, hybrid36), line[17:20], new_chain_id, int(line[22:26]), line[26:27] or " "))
+                    if hybrid36:
+                        serial += 1
+            outfile.write("END\n")
+        count("bytes_written", os.path.getsize(output_path))
 
-def reassign_chain_id_in_parallel(input_dir, output_dir, chain_map, chain_order = None, renumber = True, n_cpu = 1):
+
+def reassign_table(table, chain_map, chain_order = None):
     """
-    Reassign chain ids of PDB files in a directory in parallel.
+    Return an AtomTable with chain ids replaced according to `chain_map` and chains sorted by `chain_order`.
+
+    The table counterpart of `reassign_chain_id`: write the result with `write_pdb`
+    (`renumber` as there) or `write_mmcif`. Raises KeyError for chains missing from the map.
     """
+    return table.rename_chains(chain_map).reorder_chains(chain_order)
+
+
+def reassign_chain_id_in_parallel(input_dir, output_dir, chain_map, chain_order = None, renumber = True, n_cpu = 1, fast = False, mmcif = False, force = False, compression = None, hybrid36 = False):
+    """
+    Reassign chain ids of PDB files in a directory in parallel with `run_batch`. With `mmcif` the outputs are named `.cif`.
+
+    Compressed inputs (`.pdb.gz`, ...) are processed too; outputs are compressed
+    with `compression` ("gz", "bz2", "xz" or "zst"). `hybrid36` applies with `fast`.
+
+    Files already processed from an unchanged input with the same options (see
+    `batch_manifest.json`) are skipped unless `force` is set.
+    Files that fail (e.g. a chain missing from `chain_map`) are listed in
+    `failures.tsv` in `output_dir`; returns the failures.
+    """
+    from PDBToolkit.PDBOps.batch import FAILURES_NAME, MANIFEST_NAME, run_batch
+
     os.makedirs(output_dir, exist_ok=True)
-    total_args = []
+    jobs = []
     for file in os.listdir(input_dir):
-        if file.endswith('.pdb'):
+        if has_extension(file, '.pdb'):
             input_path = os.path.join(input_dir, file)
-            output_path = os.path.join(output_dir, file)
-            total_args.append((input_path, output_path, chain_map, chain_order, renumber))
+            output_file = strip_compression(file)
+            output_file = with_compression(output_file[:-4] + ".cif" if mmcif else output_file, compression)
+            jobs.append((input_path, os.path.join(output_dir, output_file)))
 
-    with Pool(n_cpu) as pool:
-        pool.starmap(reassign_chain_id, total_args)
+    if fast:
+        function, shared_args = reassign_chain_id_fast, (chain_map, chain_order, renumber, mmcif, hybrid36)
+    else:
+        function, shared_args = reassign_chain_id, (chain_map, chain_order, renumber, mmcif)
+    return run_batch(
+        function, jobs, shared_args, n_cpu, force, os.path.join(output_dir, FAILURES_NAME),
+        manifest_path=os.path.join(output_dir, MANIFEST_NAME),
+    )
+
+
+def parse_chain_ids(value):
+    """
+    Split a chain id argument: comma-separated ids ("AA,AB") or one id per character ("ABC").
+    """
+    if value is None:
+        return None
+    return value.split(",") if "," in value else list(value)
 
 
 def main(args):
-    chain_map = dict(zip(args.orig_chain_ids, args.new_chain_ids))
-    chain_order = args.chain_order
+    chain_map = dict(zip(parse_chain_ids(args.orig_chain_ids), parse_chain_ids(args.new_chain_ids)))
+    chain_order = parse_chain_ids(args.chain_order)
     renumber = not args.no_renumber
     input_path = os.path.abspath(args.input_path)
     output_path = os.path.abspath(args.output_path)
     n_cpu = args.n_cpu
+    if args.compress and not os.path.isdir(input_path):
+        output_path = with_compression(output_path, args.compress)
 
     if os.path.isdir(input_path):
-        reassign_chain_id_in_parallel(input_path, output_path, chain_map, chain_order, renumber, n_cpu)
+        failures = reassign_chain_id_in_parallel(
+            input_path, output_path, chain_map, chain_order, renumber, n_cpu, args.fast, args.mmcif, args.force, args.compress,
+            args.hybrid36,
+        )
+        if failures:
+            sys.exit(1)
+    elif args.fast:
+        reassign_chain_id_fast(input_path, output_path, chain_map, chain_order, renumber, args.mmcif, args.hybrid36)
     else:
-        reassign_chain_id(input_path, output_path, chain_map, chain_order, renumber)
+        reassign_chain_id(input_path, output_path, chain_map, chain_order, renumber, args.mmcif)
     logging.info("Done.")
 
 
-if __name__ == "__main__":
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=
         "Modify chain names in a PDB file using a mapping of original chain IDs "
         "to new chain IDs."
     )
     parser.add_argument('input_path', type=str, help='Path to the input PDB file.')
     parser.add_argument('output_path', type=str, help='Path to save the modified PDB file.')
-    parser.add_argument('orig_chain_ids', type=str, help='Original chain IDs.')
-    parser.add_argument('new_chain_ids', type=str, help='New chain IDs.')
+    parser.add_argument('orig_chain_ids', type=str, help='Original chain IDs (e.g. ABC, or A,B,C).')
+    parser.add_argument('new_chain_ids', type=str, help=
+                        'New chain IDs (e.g. XYZ, or AA,AB,AC for multi-character ids with --mmcif).')
     parser.add_argument('--no_renumber', action='store_true', help='Do not renumber atoms in the structure.')
     parser.add_argument('--chain_order', type=str, default=None, help='Order of chains in the structure.')
     parser.add_argument('--n_cpu', type=int, default=1, help='Number of CPUs to use for parallel processing.')
-    args = parser.parse_args()
+    parser.add_argument('--fast', action='store_true', help=
+                        'Rewrite chain ids line by line without parsing the structure. '
+                        'Other columns are copied from the input unchanged.')
+    parser.add_argument('--mmcif', action='store_true', help=
+                        'Write mmCIF without chain id or atom serial limits.')
+    parser.add_argument('--hybrid36', action='store_true', help=
+                        'Write atom serials beyond 99,999 in hybrid-36 notation (with --fast).')
+    parser.add_argument('--force', action='store_true', help=
+                        'Process all files of a directory, also those already done with the same options.')
+    parser.add_argument('--compress', choices=COMPRESSIONS, default=None, help=
+                        'Compress the output (adds .gz, .bz2, .xz or .zst; zst needs the zstandard package). '
+                        'Compressed inputs are detected and read without any option.')
+    parser.add_argument('--trace', type=str, default=None, help=
+                        'Write a Chrome trace JSON of the run to this path and print a timing summary.')
+    args = parser.parse_args(argv)
 
     print("-----------------------------------------------------------------------------", flush=True)
     print("User settings:", flush=True)
@@ -109,4 +273,9 @@ if __name__ == "__main__":
         print(f"{key}: {value}", flush=True)
     print("-----------------------------------------------------------------------------", flush=True)
 
-    main(args)
+    with tracing(args.trace):
+        main(args)
+
+
+if __name__ == "__main__":
+    cli()
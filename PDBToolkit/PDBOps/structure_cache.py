@@ -0,0 +1,134 @@
+"""
+Persistent cache of parsed structures as memory-mapped NumPy arrays.
+
+`read_pdb` and `read_mmcif` consult the active cache before parsing: each parsed
+`AtomTable` is stored as one `.npy` file per field, and a later read of the same
+file maps those arrays copy-on-write instead of parsing the text again, which
+takes about a millisecond whatever the number of atoms. Entries are keyed by the
+reader, the absolute path, the size and the modification time of the file, so an
+edited or replaced file is parsed again; entries of files that no longer change
+are evicted least recently used first once the cache exceeds its size bound.
+
+The cache is enabled with `enable` or by setting PDBTOOLKIT_STRUCTURE_CACHE to a
+directory (and optionally PDBTOOLKIT_STRUCTURE_CACHE_GB to a size bound), which
+`Pool` workers and job arrays inherit. Storage, atomic publication and eviction
+are those of `ResultCache`, so concurrent processes may share the directory.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import shutil
+
+import numpy as np
+
+from PDBToolkit.cache import ResultCache
+from PDBToolkit.tracing import count
+
+CACHE_DIR_ENV = "PDBTOOLKIT_STRUCTURE_CACHE"
+CACHE_GB_ENV = "PDBTOOLKIT_STRUCTURE_CACHE_GB"
+FORMAT_VERSION = 2
+# Stores between two evictions, as a fraction of the size bound.
+PRUNE_FRACTION = 0.1
+
+_state = {"cache": None}
+
+
+class StructureCache(ResultCache):
+    """
+    Cache of parsed structures, one entry directory of `<field>.npy` files per file and reader.
+    """
+
+    def __init__(self, cache_dir, max_bytes = None):
+        super().__init__(cache_dir, max_bytes)
+        self._stored_bytes = 0
+
+    def file_key(self, input_path, reader):
+        """
+        Key of `input_path` as parsed by `reader`; changes whenever the file is rewritten.
+        """
+        stat = os.stat(input_path)
+        payload = json.dumps({
+            "version": FORMAT_VERSION,
+            "reader": reader,
+            "path": os.path.abspath(input_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        })
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def load(self, key, fields):
+        """
+        Return `{field: array}` memory-mapped from the entry of `key`, or None on a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            arrays = {}
+            for field in fields:
+                path = os.path.join(entry_dir, f"{field}.npy")
+                try:
+                    arrays[field] = np.load(path, mmap_mode="c")
+                except ValueError:
+                    # empty arrays cannot be mapped
+                    arrays[field] = np.load(path)
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            count("structure_cache_misses")
+            return None
+        count("structure_cache_hits")
+        return arrays
+
+    def store(self, key, arrays):
+        """
+        Write `{field: array}` as the entry of `key`, evicting old entries now and then.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+        try:
+            for field, array in arrays.items():
+                np.save(os.path.join(temp_dir, f"{field}.npy"), np.ascontiguousarray(array))
+                self._stored_bytes += array.nbytes
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another writer created the entry first, or the disk is full.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if self.max_bytes is not None and self._stored_bytes > self.max_bytes * PRUNE_FRACTION:
+            self._stored_bytes = 0
+            self.prune()
+
+
+def enable(cache_dir, max_bytes = None):
+    """
+    Cache the structures parsed by this process and its workers in `cache_dir`.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    os.environ[CACHE_DIR_ENV] = cache_dir
+    if max_bytes is not None:
+        os.environ[CACHE_GB_ENV] = str(max_bytes / 2 ** 30)
+    else:
+        os.environ.pop(CACHE_GB_ENV, None)
+    _state["cache"] = StructureCache(cache_dir, max_bytes)
+    return _state["cache"]
+
+
+def disable():
+    os.environ.pop(CACHE_DIR_ENV, None)
+    os.environ.pop(CACHE_GB_ENV, None)
+    _state["cache"] = None
+
+
+def active_cache():
+    """
+    The cache readers should consult, or None when caching is off.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    cache = _state["cache"]
+    if cache is None or cache.cache_dir != os.path.abspath(cache_dir):
+        max_gb = os.environ.get(CACHE_GB_ENV)
+        cache = _state["cache"] = StructureCache(cache_dir, int(float(max_gb) * 2 ** 30) if max_gb else None)
+    return cache
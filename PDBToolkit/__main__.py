@@ -0,0 +1,3 @@
+from PDBToolkit.cli import main
+
+main()
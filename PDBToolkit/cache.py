@@ -0,0 +1,161 @@
+"""
+Content-addressed on-disk cache for results of external binaries.
+
+Shared by the CASP tools (USalign and phenix.clashscore results) and by
+`PDBOps.structure_cache`, which stores parsed structures in the same layout.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import time
+from functools import lru_cache
+
+from PDBToolkit.tracing import count
+
+CHUNK_SIZE = 1 << 20
+STALE_SECONDS = 3600
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    """
+    SHA-256 of the file content. Memoized per process on path, size and mtime.
+    """
+    stat = os.stat(path)
+    return _hash_file(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+class ResultCache:
+    """
+    Cache of parsed results (and optionally output files) keyed by inputs and command.
+
+    Each entry is a directory `<cache_dir>/<key[:2]>/<key>` holding `result.json` and
+    any output files. Entries are built in a private temporary directory and moved
+    into place with an atomic rename, so `Pool` workers or jobs on several nodes
+    sharing the directory never see a partial entry; when two writers race, the
+    first rename wins and the other copy is discarded. A hit touches the entry, and
+    `prune` evicts the least recently used entries until the cache fits `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes = None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, command, input_files):
+        """
+        Key for running `command` (binary path and arguments, without input or output paths) on `input_files`.
+        """
+        payload = json.dumps({
+            "command": [str(arg) for arg in command],
+            "inputs": [hash_file(path) for path in input_files],
+        })
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the cached result for `key`, or None on a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "result.json"), "r") as f:
+                result = json.load(f)
+            os.utime(entry_dir)
+        except (FileNotFoundError, json.JSONDecodeError):
+            count("cache_misses")
+            return None
+        count("cache_hits")
+        return result
+
+    def restore(self, key, output_prefix):
+        """
+        Copy the output files of an entry to `output_prefix + suffix`. Returns False if they are gone.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "outputs.json"), "r") as f:
+                suffixes = json.load(f)
+            for i, suffix in enumerate(suffixes):
+                shutil.copyfile(os.path.join(entry_dir, f"output_{i}"), output_prefix + suffix)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return True
+
+    def put(self, key, result, outputs = None):
+        """
+        Store a JSON-serialisable result and optionally output files given as `{suffix: path}`.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+        try:
+            if outputs is not None:
+                for i, path in enumerate(outputs.values()):
+                    shutil.copyfile(path, os.path.join(temp_dir, f"output_{i}"))
+                with open(os.path.join(temp_dir, "outputs.json"), "w") as f:
+                    json.dump(list(outputs), f)
+            with open(os.path.join(temp_dir, "result.json"), "w") as f:
+                json.dump(result, f)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another writer created the entry first.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def prune(self):
+        """
+        Evict least recently used entries until the cache is below `max_bytes`.
+
+        Entries are renamed out of place before they are deleted, so concurrent
+        readers see either the whole entry or a miss. Temporary directories left
+        behind by killed writers are removed once they are an hour old.
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        total = 0
+        for shard in os.scandir(self.cache_dir):
+            if shard.name.startswith(".tmp_"):
+                if time.time() - shard.stat().st_mtime > STALE_SECONDS:
+                    shutil.rmtree(shard.path, ignore_errors=True)
+                continue
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    continue
+                total += size
+
+        entries.sort()
+        n_evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            trash = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+            try:
+                os.rename(path, os.path.join(trash, "entry"))
+            except OSError:
+                pass
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+            n_evicted += 1
+        if n_evicted:
+            logging.info(f"Evicted {n_evicted} cache entries from {self.cache_dir}.")
@@ -0,0 +1,49 @@
+"""
+Single `pdbtoolkit` entry point with one subcommand per tool.
+
+    python -m PDBToolkit <command> [options]
+    python -m PDBToolkit cif2pdb model.cif model.pdb --stream
+
+Only the module of the chosen subcommand is imported, and the tools import
+pandas and Biopython inside the functions that use them, so listing the commands
+and short single-file runs do not pay for dependencies they never touch.
+"""
+import argparse
+import importlib
+
+# subcommand: (module, summary); the module provides `cli(argv, prog)`
+COMMANDS = {
+    "cif2pdb": ("PDBToolkit.PDBOps.cif2pdb", "Convert mmCIF files to PDB (or plain mmCIF)."),
+    "reassign_chain_id": ("PDBToolkit.PDBOps.reassign_chain_id", "Rename chains of PDB files."),
+    "merge_structure": ("PDBToolkit.PDBOps.merge_structure", "Merge PDB files into one structure."),
+    "qa_af3": ("PDBToolkit.CASP.qa_af3", "Convert and rank AlphaFold3 models."),
+    "sup_template": ("PDBToolkit.CASP.sup_template", "Superpose models onto a template and score TM-score."),
+    "all_vs_all": ("PDBToolkit.CASP.all_vs_all", "All-vs-all TM-scores with consensus ranking and clustering."),
+    "sup_assemble": ("PDBToolkit.CASP.sup_assemble", "Superpose a source structure onto targets and assemble."),
+    "sup_homooligo": ("PDBToolkit.CASP.sup_homooligo", "Superpose homooligomers chain by chain."),
+    "phenix_clashscore": ("PDBToolkit.CASP.phenix_clashscore", "Score clashes with phenix or the native engine."),
+    "shard": ("PDBToolkit.shard", "Generate job-array scripts and merge sharded outputs."),
+}
+
+
+def build_parser():
+    epilog = "commands:\n" + "".join(f"  {name:<20}{summary}\n" for name, (_, summary) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="pdbtoolkit",
+        description="Protein structure handling and CASP workflows.",
+        epilog=epilog + "\nRun 'pdbtoolkit <command> --help' for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="Tool to run.")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the tool.")
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    module.cli(args.args, prog=f"pdbtoolkit {args.command}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Split a campaign over independent jobs: deterministic input shards, job-array scripts
+and the reduction of the per-shard outputs.
+
+Every command-line tool that takes `--shard I/N` processes only shard I (0-based)
+of its inputs and writes its tables to `<name>.shard<I>-of-<N>.<ext>` (see
+`shard_path`). The partition depends only on the input names and sizes, so all
+jobs agree on it without talking to each other, and it is stable: adding or
+removing inputs moves only a few of the others to another shard.
+
+    python -m PDBToolkit.shard generate --n_shards 16 --scheduler slurm \\
+        --reduce "python -m PDBToolkit.shard reduce csv out/tmscore.csv --n_shards 16" \\
+        -- python PDBToolkit/CASP/sup_template.py models ref.pdb --output_file out/tmscore.csv
+
+writes a job-array script running the command once per shard, and a submit script
+that runs the reduce step after all shards succeeded.
+"""
+import os
+import json
+import shlex
+import hashlib
+import argparse
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+LOCAL_TEMPLATE = """#!/usr/bin/env bash
+# {job_name}: {n_shards} shards, {n_parallel} at a time
+set -euo pipefail
+mkdir -p {log_dir}
+run_shard() {{
+    {command} --shard "$1/{n_shards}" > {log_dir}/{job_name}.shard"$1".log 2>&1
+}}
+export -f run_shard
+seq 0 {last_shard} | xargs -P {n_parallel} -I SHARD bash -c 'run_shard SHARD'
+{reduce_command}
+"""
+
+SLURM_TEMPLATE = """#!/usr/bin/env bash
+#SBATCH --job-name={job_name}
+#SBATCH --array=0-{last_shard}%{n_parallel}
+#SBATCH --output={log_dir}/{job_name}.shard%a.log
+set -euo pipefail
+{command} --shard "$SLURM_ARRAY_TASK_ID/{n_shards}"
+"""
+
+SLURM_SUBMIT_TEMPLATE = """#!/usr/bin/env bash
+set -euo pipefail
+mkdir -p {log_dir}
+job_id=$(sbatch --parsable {array_script})
+echo "Submitted array job $job_id"
+{reduce_submit}
+"""
+
+TEMPLATES = {"local": LOCAL_TEMPLATE, "slurm": SLURM_TEMPLATE}
+
+
+def parse_shard(value):
+    """
+    Parse `I/N` into `(I, N)` with `0 <= I < N`; usable as an argparse `type`.
+    """
+    try:
+        index, n_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like I/N, got '{value}'.")
+    if not 0 <= index < n_shards:
+        raise argparse.ArgumentTypeError(f"Shard index must be in [0, {n_shards}), got {index}.")
+    return index, n_shards
+
+
+def _name_hash(path):
+    return hashlib.sha1(os.path.basename(path).encode()).hexdigest()
+
+
+def assign_shards(paths, n_shards):
+    """
+    Partition `paths` into `n_shards` lists of roughly equal total file size.
+
+    Files are ordered by a hash of their name, and the order is cut into
+    `n_shards` runs of equal total size; a file goes to the run holding the middle
+    of its bytes. A file's place in the order does not depend on the other files,
+    so adding or removing one only shifts the cuts by its size and moves the few
+    files next to them, instead of reshuffling the whole partition as size-greedy
+    placement does. Each shard is returned sorted by name.
+    """
+    # one extra byte per file so that empty or missing files are spread too
+    weights = {path: (os.path.getsize(path) if os.path.exists(path) else 0) + 1 for path in paths}
+    total = sum(weights.values())
+    shards = [[] for _ in range(n_shards)]
+    position = 0
+    for path in sorted(paths, key=lambda path: (_name_hash(path), path)):
+        middle = position + weights[path] / 2
+        shards[min(int(middle * n_shards / total), n_shards - 1)].append(path)
+        position += weights[path]
+    return [sorted(shard) for shard in shards]
+
+
+def select_shard(paths, shard):
+    """
+    The paths of `shard` (an `(index, n_shards)` pair), or all paths when `shard` is None.
+    """
+    if shard is None:
+        return list(paths)
+    index, n_shards = shard
+    selected = assign_shards(paths, n_shards)[index]
+    logging.info(f"Shard {index}/{n_shards}: {len(selected)} of {len(paths)} inputs")
+    return selected
+
+
+def shard_path(path, shard):
+    """
+    `out/tmscore.csv` -> `out/tmscore.shard3-of-8.csv` for shard (3, 8); `path` itself when `shard` is None.
+    """
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard[0]}-of-{shard[1]}{ext}"
+
+
+def shard_paths(path, n_shards):
+    return [shard_path(path, (index, n_shards)) for index in range(n_shards)]
+
+
+def _check_complete(paths):
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} shard output(s) missing, e.g. {missing[0]}")
+
+
+def reduce_csv(output_path, n_shards, sep = "\t"):
+    """
+    Concatenate the shard tables of `output_path` (tab-separated, as written by the tools) into it.
+    """
+    import pandas as pd
+
+    paths = shard_paths(output_path, n_shards)
+    _check_complete(paths)
+    data = pd.concat([pd.read_csv(path, sep=sep) for path in paths], ignore_index=True)
+    data.to_csv(output_path, index=False, sep=sep)
+    logging.info(f"Merged {len(data)} rows from {n_shards} shards into {output_path}")
+
+
+def reduce_json(output_path, n_shards):
+    """
+    Merge the shard JSON objects of `output_path` (e.g. clashscores per file) into it.
+    """
+    paths = shard_paths(output_path, n_shards)
+    _check_complete(paths)
+    merged = {}
+    for path in paths:
+        with open(path, "r") as f:
+            merged.update(json.load(f))
+    with open(output_path, "w") as f:
+        json.dump(merged, f, indent=4)
+    logging.info(f"Merged {len(merged)} entries from {n_shards} shards into {output_path}")
+
+
+def write_job_scripts(command, n_shards, output_dir, scheduler = "local", template = None, job_name = "pdbtoolkit", n_parallel = None, reduce_command = None):
+    """
+    Write the scripts running `command` (an argument list) once per shard.
+
+    `local` gives `<job_name>.local.sh`, which runs the shards with up to
+    `n_parallel` at a time and then `reduce_command`. `slurm` gives an array job
+    `<job_name>.array.sh` and `<job_name>.submit.sh`, which submits it and the
+    reduce step as a dependent job. A custom `template` (a file using the same
+    placeholders as `LOCAL_TEMPLATE`) replaces the built-in job template. Returns
+    the paths of the written scripts.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if template is not None:
+        with open(template, "r") as f:
+            job_template = f.read()
+    else:
+        job_template = TEMPLATES[scheduler]
+    fields = {
+        "job_name": job_name,
+        "n_shards": n_shards,
+        "last_shard": n_shards - 1,
+        "n_parallel": n_parallel or n_shards,
+        "log_dir": shlex.quote(os.path.join(os.path.abspath(output_dir), "logs")),
+        "command": shlex.join(command),
+        "reduce_command": reduce_command or "",
+    }
+    suffix = "local" if scheduler == "local" else "array"
+    job_script = os.path.join(output_dir, f"{job_name}.{suffix}.sh")
+    scripts = [job_script]
+    with open(job_script, "w") as f:
+        f.write(job_template.format(**fields))
+
+    if scheduler == "slurm":
+        reduce_submit = ""
+        if reduce_command:
+            reduce_submit = (
+                f"sbatch --dependency=afterok:$job_id --job-name={job_name}_reduce "
+                f"--output={fields['log_dir']}/{job_name}.reduce.log --wrap {shlex.quote(reduce_command)}"
+            )
+        submit_script = os.path.join(output_dir, f"{job_name}.submit.sh")
+        with open(submit_script, "w") as f:
+            f.write(SLURM_SUBMIT_TEMPLATE.format(array_script=shlex.quote(os.path.abspath(job_script)), reduce_submit=reduce_submit, **fields))
+        scripts.append(submit_script)
+
+    for script in scripts:
+        os.chmod(script, 0o755)
+    return scripts
+
+
+def main(args):
+    if args.mode == "generate":
+        command = args.command[1:] if args.command[:1] == ["--"] else args.command
+        if not command:
+            raise ValueError("Give the command to shard after '--'.")
+        scripts = write_job_scripts(
+            command, args.n_shards, args.output_dir, args.scheduler, args.template,
+            args.job_name, args.n_parallel, args.reduce,
+        )
+        for script in scripts:
+            logging.info(f"Wrote {script}")
+    elif args.kind == "csv":
+        reduce_csv(os.path.abspath(args.output_path), args.n_shards)
+    elif args.kind == "json":
+        reduce_json(os.path.abspath(args.output_path), args.n_shards)
+    elif args.kind == "tm_matrix":
+        from PDBToolkit.CASP.all_vs_all import reduce_shards
+        reduce_shards(os.path.abspath(args.output_path), args.n_shards, args.cluster_threshold)
+    else:
+        from PDBToolkit.CASP.qa_af3 import reduce_shards
+        reduce_shards(os.path.abspath(args.output_path), args.n_shards, args.only_ptm, args.no_clash)
+
+
+def cli(argv = None, prog = None):
+    """
+    Parse the command line (`argv`, default `sys.argv[1:]`) and run `main`.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="Generate job-array scripts for sharded runs and merge their outputs.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    generate = subparsers.add_parser("generate", help="Write scripts that run a command once per shard.")
+    generate.add_argument("--n_shards", type=int, required=True, help="Number of shards (jobs).")
+    generate.add_argument("--output_dir", default="jobs", help="Directory of the scripts and logs.")
+    generate.add_argument("--scheduler", choices=sorted(TEMPLATES), default="local", help=
+                          "'local' runs the shards with xargs on this machine, 'slurm' writes an array job.")
+    generate.add_argument("--template", default=None, help=
+                          "Job script template (Python format string, literal braces doubled) with {command}, "
+                          "{n_shards}, {last_shard}, {n_parallel}, {job_name}, {log_dir} and {reduce_command} placeholders.")
+    generate.add_argument("--job_name", default="pdbtoolkit", help="Name of the job and its scripts.")
+    generate.add_argument("--n_parallel", type=int, default=None, help="Shards running at the same time (default all).")
+    generate.add_argument("--reduce", default=None, help="Command merging the shard outputs, run after all shards succeeded.")
+    generate.add_argument("command", nargs=argparse.REMAINDER, help="Command to run per shard, after '--'.")
+
+    reduce = subparsers.add_parser("reduce", help="Merge the per-shard outputs into one file.")
+    reduce.add_argument("kind", choices=["csv", "json", "qa", "tm_matrix"], help=
+                        "'csv' concatenates tables such as tmscore.csv, 'json' merges objects such as "
+                        "clashscores, 'qa' ranks the models of all qa_af3 shards of an output directory, "
+                        "'tm_matrix' merges the all_vs_all matrices of an output directory and ranks the models.")
+    reduce.add_argument("output_path", help="Unsharded output path (the output directory for 'qa' and 'tm_matrix').")
+    reduce.add_argument("--n_shards", type=int, required=True, help="Number of shards.")
+    reduce.add_argument("--only_ptm", action="store_true", help="Rank by ptm only ('qa').")
+    reduce.add_argument("--no_clash", action="store_true", help="Drop models with clashes from the ranking ('qa').")
+    reduce.add_argument("--cluster_threshold", type=float, default=0.5, help="Clustering threshold ('tm_matrix').")
+    args = parser.parse_args(argv)
+
+    print("-----------------------------------------------------------------------------", flush=True)
+    print("User settings:", flush=True)
+    for key, value in vars(args).items():
+        print(f"{key}: {value}", flush=True)
+    print("-----------------------------------------------------------------------------", flush=True)
+
+    main(args)
+
+
+if __name__ == "__main__":
+    cli()
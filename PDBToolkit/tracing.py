@@ -0,0 +1,205 @@
+"""
+Lightweight span and counter instrumentation, exported as a Chrome/Perfetto trace.
+
+Tracing is off by default, and then `span` returns a shared no-op context manager
+and `count` returns immediately. `enable` turns it on for this process and, through
+the PDBTOOLKIT_TRACE_DIR environment variable and inherited state, for `Pool`
+workers: every process appends its events to its own JSON-lines file in the trace
+directory as they complete, so spans of workers that are terminated still reach
+the trace. `export` merges the files into one `traceEvents` JSON (open it in
+chrome://tracing or ui.perfetto.dev) and prints a per-span summary table.
+"""
+import os
+import sys
+import json
+import functools
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+TRACE_DIR_ENV = "PDBTOOLKIT_TRACE_DIR"
+
+_NULL_SPAN = nullcontext()
+_state = {"dir": None, "pid": None, "file": None, "counters": {}}
+
+
+def enabled():
+    return _state["dir"] is not None
+
+
+def enable(trace_dir = None):
+    """
+    Start recording into `trace_dir` (a new temporary directory by default).
+    """
+    if trace_dir is None:
+        trace_dir = tempfile.mkdtemp(prefix="pdbtoolkit_trace_")
+    os.makedirs(trace_dir, exist_ok=True)
+    os.environ[TRACE_DIR_ENV] = trace_dir
+    _state["dir"] = trace_dir
+    return trace_dir
+
+
+def disable():
+    os.environ.pop(TRACE_DIR_ENV, None)
+    if _state["file"] is not None:
+        _state["file"].close()
+    _state.update(dir=None, pid=None, file=None, counters={})
+
+
+def _now():
+    return time.perf_counter_ns() // 1000
+
+
+def _process_file():
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        # First event of this process (or of a forked child): open its own file.
+        _state["pid"] = pid
+        _state["counters"] = {}
+        _state["file"] = open(os.path.join(_state["dir"], f"trace_{pid}.jsonl"), "a")
+        name = os.path.basename(sys.argv[0]) if pid == _state.get("main_pid") else f"worker {pid}"
+        _state["file"].write(json.dumps({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}}) + "\n")
+    return _state["file"]
+
+
+def _emit(event):
+    handle = _process_file()
+    event["pid"] = _state["pid"]
+    handle.write(json.dumps(event) + "\n")
+    handle.flush()
+
+
+class _Span:
+    def __init__(self, name, category, args, tid):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.tid = tid
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        _emit({
+            "name": self.name, "cat": self.category, "ph": "X", "ts": self.start, "dur": _now() - self.start,
+            "tid": self.tid if self.tid is not None else threading.get_ident(), "args": self.args,
+        })
+        return False
+
+
+def span(name, category = "pdbtoolkit", tid = None, **args):
+    """
+    Context manager timing a block. Keyword arguments are stored with the span and
+    can be updated through the returned object's `args` inside the block.
+    """
+    if _state["dir"] is None:
+        return _NULL_SPAN
+    return _Span(name, category, args, tid)
+
+
+def traced(name, category = "pdbtoolkit"):
+    """
+    Decorator running every call of the function inside `span(name)`.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _state["dir"] is None:
+                return function(*args, **kwargs)
+            with _Span(name, category, {}, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value = 1):
+    """
+    Add `value` to the counter `name` of this process (atoms parsed, bytes written, ...).
+    """
+    if _state["dir"] is None:
+        return
+    _process_file()
+    counters = _state["counters"]
+    counters[name] = counters.get(name, 0) + value
+    _emit({"name": name, "ph": "C", "ts": _now(), "tid": 0, "args": {name: counters[name]}})
+
+
+def load_events(trace_dir):
+    events = []
+    for filename in sorted(os.listdir(trace_dir)):
+        if filename.startswith("trace_") and filename.endswith(".jsonl"):
+            with open(os.path.join(trace_dir, filename), "r") as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+    return events
+
+
+def summarize(events):
+    """
+    Return `(spans, counters)`: per span name `[count, total_s, max_s]`, and counter totals over processes.
+    """
+    spans = {}
+    final = {}
+    for event in events:
+        if event["ph"] == "X":
+            entry = spans.setdefault(event["name"], [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += event["dur"] / 1e6
+            entry[2] = max(entry[2], event["dur"] / 1e6)
+        elif event["ph"] == "C":
+            final[event["pid"], event["name"]] = event["args"][event["name"]]
+    counters = {}
+    for (_, name), value in final.items():
+        counters[name] = counters.get(name, 0) + value
+    return spans, counters
+
+
+def print_summary(events, file = sys.stdout):
+    spans, counters = summarize(events)
+    print(f"{'span':<32}{'count':>8}{'total (s)':>12}{'mean (s)':>12}{'max (s)':>12}", file=file)
+    for name, (n, total, longest) in sorted(spans.items(), key=lambda item: -item[1][1]):
+        print(f"{name:<32}{n:>8}{total:>12.3f}{total / n:>12.4f}{longest:>12.3f}", file=file)
+    for name, value in sorted(counters.items()):
+        print(f"{name:<32}{value:>20,.6g}" if isinstance(value, float) else f"{name:<32}{value:>20,}", file=file)
+
+
+def export(output_path, summary = True):
+    """
+    Merge the events of all processes into a Chrome trace JSON at `output_path`.
+    """
+    events = load_events(_state["dir"])
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    if summary:
+        print_summary(events)
+    return events
+
+
+@contextmanager
+def tracing(output_path):
+    """
+    Record the block and export it to `output_path`; does nothing when `output_path` is None.
+
+    Used by the command-line tools as `with tracing(args.trace): ...`.
+    """
+    if output_path is None:
+        yield
+        return
+    _state["main_pid"] = os.getpid()
+    trace_dir = enable()
+    try:
+        with span("main", args=" ".join(sys.argv[1:])):
+            yield
+    finally:
+        export(output_path)
+        disable()
+        shutil.rmtree(trace_dir, ignore_errors=True)
+
+
+if os.environ.get(TRACE_DIR_ENV) and os.path.isdir(os.environ[TRACE_DIR_ENV]):
+    # Spawned worker of a traced run.
+    _state["dir"] = os.environ[TRACE_DIR_ENV]
@@ -0,0 +1,189 @@
+"""
+Check the streaming mmCIF-to-PDB converter against MMCIFParser/PDBIO and benchmark both.
+
+Every fixture is converted with and without renumbering by `cif_to_pdb` and
+`stream_cif_to_pdb`; the outputs must be byte-identical (tests/test_cif2pdb.py
+runs the same check under pytest). The fixtures cover
+quoted atom names, HETATM and water residues, chains split over several blocks,
+alternate locations, insertion codes, unplaced atoms and multiple models.
+
+Usage:
+    python benchmarks/bench_cif2pdb.py --n_chains 40 --n_residues 300
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PDBToolkit.PDBOps.cif2pdb import cif_to_pdb, stream_cif_to_pdb
+
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+NUCLEOTIDE = [("P", "P"), ("OP1", "O"), ("O5'", "O"), ("C5'", "C"), ("C4'", "C"), ("O4'", "O"), ("C1'", "C")]
+COLUMNS = [
+    "group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+    "label_asym_id", "label_entity_id", "label_seq_id", "pdbx_PDB_ins_code",
+    "Cartn_x", "Cartn_y", "Cartn_z", "occupancy", "B_iso_or_equiv",
+    "auth_seq_id", "auth_asym_id", "pdbx_PDB_model_num",
+]
+
+
+def quote(value):
+    return f'"{value}"' if "'" in value else value
+
+
+class CifWriter:
+    def __init__(self, handle, seed = 0):
+        self.handle = handle
+        self.rng = np.random.default_rng(seed)
+        self.serial = 0
+        handle.write("data_bench\n#\nloop_\n")
+        for column in COLUMNS:
+            handle.write(f"_atom_site.{column}\n")
+
+    def atom(self, chain_id, resseq, resname, name, element, group = "ATOM", altloc = ".", icode = "?", model = 1, label_seq = None):
+        self.serial += 1
+        x, y, z = self.rng.uniform(-999, 999, 3)
+        bfactor = self.rng.uniform(0, 100)
+        label_seq = resseq if label_seq is None else label_seq
+        self.handle.write(
+            f"{group:<6} {self.serial} {element} {quote(name)} {altloc} {resname} {chain_id} 1 {label_seq} {icode} "
+            f"{x:.3f} {y:.3f} {z:.3f} 1.0 {bfactor:.2f} {resseq} {chain_id} {model}\n"
+        )
+
+    def residue(self, chain_id, resseq, resname = "G", **kwargs):
+        for name, element in NUCLEOTIDE:
+            self.atom(chain_id, resseq, resname, name, element, **kwargs)
+
+    def close(self):
+        self.handle.write("#\n")
+
+
+def write_assembly(path, n_chains, n_residues):
+    with open(path, "w") as f:
+        writer = CifWriter(f)
+        for chain_id in CHAIN_IDS[:n_chains]:
+            for resseq in range(1, n_residues + 1):
+                writer.residue(chain_id, resseq, "AUGC"[resseq % 4])
+        writer.close()
+
+
+def write_fixtures(directory):
+    """
+    Write small fixtures exercising the layouts MMCIFParser handles specially.
+    """
+    fixtures = {}
+
+    path = os.path.join(directory, "mixed.cif")
+    with open(path, "w") as f:
+        writer = CifWriter(f, seed=1)
+        for chain_id in "B1A":
+            for resseq in range(1, 6):
+                writer.residue(chain_id, resseq)
+            writer.residue(chain_id, 5, icode="A")
+        writer.atom("B", 101, "MG", "MG", "MG", group="HETATM")
+        writer.atom("B", 102, "HOH", "O", "O", group="HETATM")
+        writer.atom("B", 103, "HOH", "O", "O", group="HETATM")
+        writer.atom("A", 101, "UNL", "C1", "?", group="HETATM")
+        writer.atom("A", ".", "HOH", "O", "O", group="HETATM")
+        writer.close()
+    fixtures["mixed"] = path
+
+    path = os.path.join(directory, "altloc.cif")
+    with open(path, "w") as f:
+        writer = CifWriter(f, seed=2)
+        writer.residue("A", 1)
+        for altloc in "AB":
+            for name, element in NUCLEOTIDE[:3]:
+                writer.atom("A", 2, "G", name, element, altloc=altloc)
+        writer.atom("A", 3, "G", "P", "P")
+        writer.atom("A", 3, "G", "P", "P", altloc="B")
+        writer.atom("A", 3, "G", "OP1", "O", altloc="A")
+        writer.atom("A", 3, "G", "OP1", "O", altloc="A")
+        writer.close()
+    fixtures["altloc"] = path
+
+    path = os.path.join(directory, "models.cif")
+    with open(path, "w") as f:
+        writer = CifWriter(f, seed=3)
+        for model in (1, 2, 3):
+            for chain_id in "AB":
+                for resseq in range(1, 4):
+                    writer.residue(chain_id, resseq, model=model)
+        writer.close()
+    fixtures["models"] = path
+
+    path = os.path.join(directory, "assembly.cif")
+    write_assembly(path, 12, 40)
+    fixtures["assembly"] = path
+    return fixtures
+
+
+def measure(func, *args):
+    """
+    Time one call, then trace the peak memory of a second call (tracing slows it down).
+    """
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def check_equivalence(directory):
+    """
+    Convert every fixture both ways and return the names whose outputs differ.
+    """
+    failures = []
+    for name, path in write_fixtures(directory).items():
+        for renumber in (False, True):
+            reference = os.path.join(directory, f"{name}_{renumber}_reference.pdb")
+            streamed = os.path.join(directory, f"{name}_{renumber}_stream.pdb")
+            cif_to_pdb(path, reference, renumber)
+            stream_cif_to_pdb(path, streamed, renumber)
+            identical = read_bytes(reference) == read_bytes(streamed)
+            print(f"{name:<12}renumber={renumber!s:<8}identical: {identical}")
+            if not identical:
+                failures.append(f"{name} (renumber={renumber})")
+    return failures
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        failures = check_equivalence(temp_dir)
+
+        input_path = os.path.join(temp_dir, "bench.cif")
+        write_assembly(input_path, args.n_chains, args.n_residues)
+        n_atoms = args.n_chains * args.n_residues * len(NUCLEOTIDE)
+        print(f"\n{args.n_chains} chains, {n_atoms} atoms, best of {args.repeat}")
+        print(f"{'path':<12}{'time (s)':>12}{'peak (MB)':>12}")
+        for name, func in [("MMCIFParser", cif_to_pdb), ("streaming", stream_cif_to_pdb)]:
+            output_path = os.path.join(temp_dir, f"{name}.pdb")
+            runs = [measure(func, input_path, output_path, True) for _ in range(args.repeat)]
+            elapsed = min(run[0] for run in runs)
+            peak = min(run[1] for run in runs)
+            print(f"{name:<12}{elapsed:>12.3f}{peak / 2 ** 20:>12.1f}")
+
+    if failures:
+        sys.exit(f"Outputs differ for: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark stream_cif_to_pdb.")
+    parser.add_argument("--n_chains", type=int, default=40, help="Number of chains (at most 62).")
+    parser.add_argument("--n_residues", type=int, default=300, help="Residues per chain.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per path.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,104 @@
+"""
+Benchmark the streaming renumber_atom writer against the previous temp-dir-per-chain path.
+
+Usage:
+    python benchmarks/bench_renumber_atom.py --n_chains 40 --n_residues 300
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import argparse
+
+import numpy as np
+from Bio import PDB
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PDBToolkit.PDBOps.renumber_atom import renumber_atom
+
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+BACKBONE = [("N", "N"), ("CA", "C"), ("C", "C"), ("O", "O"), ("CB", "C")]
+
+
+def build_structure(n_chains, n_residues, seed = 0):
+    rng = np.random.default_rng(seed)
+    builder = PDB.StructureBuilder.StructureBuilder()
+    builder.init_structure("bench")
+    builder.init_model(0)
+    for chain_id in CHAIN_IDS[:n_chains]:
+        builder.init_chain(chain_id)
+        builder.init_seg("    ")
+        for resseq in range(1, n_residues + 1):
+            builder.init_residue("ALA", " ", resseq, " ")
+            for name, element in BACKBONE:
+                coord = rng.uniform(-100, 100, 3).astype("f")
+                builder.init_atom(name, coord, 50.0, 1.0, " ", f" {name:<3}", element=element)
+    return builder.get_structure()
+
+
+def renumber_atom_legacy(structure, output_path, chain_order = None):
+    """
+    The previous implementation: one PDBIO.save per chain copy, then concatenate.
+    """
+    def save_chain_as_structure(chain, output_file):
+        new_structure = PDB.Structure.Structure("structure")
+        new_model = PDB.Model.Model(0)
+        new_model.add(chain.copy())
+        new_structure.add(new_model)
+        pdb_io = PDB.PDBIO()
+        pdb_io.set_structure(new_structure)
+        pdb_io.save(output_file, preserve_atom_numbering=False)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model = structure[0]
+        if chain_order:
+            sorted_chains = sorted(model, key=lambda chain: chain_order.index(chain.id))
+        else:
+            sorted_chains = sorted(model, key=lambda chain: (chain.id.isdigit(), chain.id))
+        for i, chain in enumerate(sorted_chains, start=1):
+            save_chain_as_structure(chain, os.path.join(temp_dir, f"{i:02}_{chain.id}.pdb"))
+        with open(output_path, "w") as outfile:
+            for file in sorted(os.listdir(temp_dir)):
+                with open(os.path.join(temp_dir, file)) as infile:
+                    for line in infile:
+                        if not line.startswith("END"):
+                            outfile.write(line)
+            outfile.write("END\n")
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(args):
+    structure = build_structure(args.n_chains, args.n_residues)
+    n_atoms = len(list(structure.get_atoms()))
+    print(f"{args.n_chains} chains, {n_atoms} atoms, best of {args.repeat}")
+    print(f"{'path':<12}{'time (s)':>12}{'peak (MB)':>12}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        outputs = {}
+        for name, func in [("legacy", renumber_atom_legacy), ("streaming", renumber_atom)]:
+            output_path = os.path.join(temp_dir, f"{name}.pdb")
+            runs = [measure(func, structure, output_path) for _ in range(args.repeat)]
+            elapsed = min(run[0] for run in runs)
+            peak = min(run[1] for run in runs)
+            print(f"{name:<12}{elapsed:>12.3f}{peak / 2 ** 20:>12.1f}")
+            with open(output_path, "rb") as f:
+                outputs[name] = f.read()
+        print("identical output:", outputs["legacy"] == outputs["streaming"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark renumber_atom.")
+    parser.add_argument("--n_chains", type=int, default=40, help="Number of chains (at most 62).")
+    parser.add_argument("--n_residues", type=int, default=300, help="Residues per chain.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per path.")
+    args = parser.parse_args()
+    main(args)
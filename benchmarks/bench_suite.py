@@ -0,0 +1,349 @@
+"""
+Benchmark every PDBOps and CASP operation on synthetic assemblies.
+
+Inputs come from `synthetic.py` (chains x residues x models) and the external
+binaries are replaced by the stubs in `benchmarks/stubs`, which emulate their
+output and latency (STUB_LATENCY seconds). Each case runs in a fresh spawned
+process, which reports wall time, its peak RSS, the peak RSS of its worker
+processes and the files it wrote. A case that raises is recorded with its error,
+so scaling cliffs show up as failures instead of aborting the suite.
+
+Results go to a JSON file together with the commit; `--compare` prints the
+wall-time and memory ratios against an earlier results file.
+
+Usage:
+    python benchmarks/bench_suite.py --n_chains 40 --n_residues 300 --output results.json
+    python benchmarks/bench_suite.py --cases merge_structures --n_chains 100 --compare results.json
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, "stubs")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "PDBToolkit", "PDBOps"))
+sys.path.insert(0, os.path.join(REPO_DIR, "PDBToolkit", "CASP"))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+
+def prepare_inputs(directory, args):
+    """
+    Write the synthetic inputs shared by all cases and return their paths.
+    """
+    table = synthetic.build_table(args.n_chains, args.n_residues)
+    inputs = {"n_chains": args.n_chains}
+    inputs["cif"] = os.path.join(directory, "assembly.cif")
+    synthetic.write_cif_models(inputs["cif"], table, args.n_models)
+    inputs["cif_gz"] = inputs["cif"] + ".gz"
+    with open(inputs["cif"], "rb") as infile, gzip.open(inputs["cif_gz"], "wb", compresslevel=6) as outfile:
+        shutil.copyfileobj(infile, outfile)
+    if args.n_chains <= len(synthetic.CHAIN_IDS):
+        inputs["pdb"] = os.path.join(directory, "assembly.pdb")
+        synthetic.write_pdb_models(inputs["pdb"], table, args.n_models)
+
+    small = synthetic.build_table(args.n_small_chains, args.n_residues)
+    inputs["cif_dir"] = os.path.join(directory, "cif_files")
+    inputs["pdb_dir"] = os.path.join(directory, "pdb_files")
+    os.makedirs(inputs["cif_dir"])
+    os.makedirs(inputs["pdb_dir"])
+    for i in range(args.n_files):
+        synthetic.write_cif_models(os.path.join(inputs["cif_dir"], f"model_{i:04}.cif"), small, 1, seed=i)
+        synthetic.write_pdb_models(os.path.join(inputs["pdb_dir"], f"model_{i:04}.pdb"), small, 1, seed=i)
+    inputs["reference"] = os.path.join(inputs["pdb_dir"], "model_0000.pdb")
+
+    inputs["subunits"] = synthetic.write_subunits(os.path.join(directory, "subunits"), args.n_chains, args.n_residues)
+
+    inputs["zip_dir"] = os.path.join(directory, "af3")
+    os.makedirs(inputs["zip_dir"])
+    for i in range(args.n_zips):
+        synthetic.write_af3_zip(os.path.join(inputs["zip_dir"], f"job_{i:03}.zip"), small, f"job_{i:03}", seed=i)
+
+    # warm structure cache for the *_cached cases
+    from PDBToolkit.PDBOps import structure_cache
+    from PDBToolkit.PDBOps.atom_table import read_structure
+    inputs["structure_cache"] = os.path.join(directory, "structure_cache")
+    structure_cache.enable(inputs["structure_cache"])
+    for key in ("cif", "pdb"):
+        if key in inputs:
+            read_structure(inputs[key])
+    structure_cache.disable()
+    return inputs
+
+
+def case_cif_to_pdb(inputs, output_dir, args):
+    from cif2pdb import cif_to_pdb
+    cif_to_pdb(inputs["cif"], os.path.join(output_dir, "out.pdb"), True)
+
+
+def case_stream_cif_to_pdb(inputs, output_dir, args):
+    from cif2pdb import stream_cif_to_pdb
+    stream_cif_to_pdb(inputs["cif"], os.path.join(output_dir, "out.pdb"), True)
+
+
+def case_cif_to_pdb_in_parallel(inputs, output_dir, args):
+    from cif2pdb import cif_to_pdb_in_parallel
+    cif_to_pdb_in_parallel(inputs["cif_dir"], output_dir, True, args.n_cpu)
+
+
+def _chain_map(n_chains):
+    from pdb_writer import chain_label
+    chain_ids = [chain_label(i) for i in range(n_chains)]
+    return dict(zip(chain_ids, reversed(chain_ids)))
+
+
+def case_reassign_chain_id(inputs, output_dir, args):
+    from reassign_chain_id import reassign_chain_id
+    reassign_chain_id(inputs["pdb"], os.path.join(output_dir, "out.pdb"), _chain_map(inputs["n_chains"]))
+
+
+def case_reassign_chain_id_fast(inputs, output_dir, args):
+    from reassign_chain_id import reassign_chain_id_fast
+    reassign_chain_id_fast(inputs["pdb"], os.path.join(output_dir, "out.pdb"), _chain_map(inputs["n_chains"]))
+
+
+def case_reassign_chain_id_in_parallel(inputs, output_dir, args):
+    from reassign_chain_id import reassign_chain_id_in_parallel
+    reassign_chain_id_in_parallel(inputs["pdb_dir"], output_dir, _chain_map(args.n_small_chains), n_cpu=args.n_cpu)
+
+
+def case_merge_structures(inputs, output_dir, args):
+    from merge_structure import merge_structures
+    merge_structures(inputs["subunits"], os.path.join(output_dir, "merged.pdb"))
+
+
+def case_read_structure(inputs, output_dir, args):
+    from PDBToolkit.PDBOps.atom_table import read_structure
+    read_structure(inputs["cif"])
+
+
+def case_read_structure_gz(inputs, output_dir, args):
+    from PDBToolkit.PDBOps.atom_table import read_structure
+    read_structure(inputs["cif_gz"])
+
+
+def case_read_structure_cached(inputs, output_dir, args):
+    from PDBToolkit.PDBOps import structure_cache
+    from PDBToolkit.PDBOps.atom_table import read_structure
+    structure_cache.enable(inputs["structure_cache"])
+    read_structure(inputs["cif"])
+
+
+def case_renumber_atom(inputs, output_dir, args):
+    from renumber_atom import renumber_atom
+    from PDBToolkit.PDBOps.atom_table import read_pdb
+    renumber_atom(read_pdb(inputs["pdb"]), os.path.join(output_dir, "out.pdb"))
+
+
+def case_calc_plddt(inputs, output_dir, args):
+    from PDBToolkit.CASP.qa_af3 import calc_plddt
+    for file in sorted(os.listdir(inputs["pdb_dir"])):
+        calc_plddt(os.path.join(inputs["pdb_dir"], file))
+
+
+def case_qa_pipeline(inputs, output_dir, args):
+    from PDBToolkit.CASP.qa_af3 import qa_pipeline
+    qa_pipeline(inputs["zip_dir"], output_dir, n_cpu=args.n_cpu)
+
+
+def case_sup_template(inputs, output_dir, args):
+    from PDBToolkit.CASP.sup_template import process_in_parallel
+    process_in_parallel(inputs["pdb_dir"], inputs["reference"], output_dir, n_cpu=args.n_cpu)
+
+
+def case_sup_template_batch(inputs, output_dir, args):
+    from PDBToolkit.CASP.sup_template import process_in_parallel
+    process_in_parallel(inputs["pdb_dir"], inputs["reference"], n_cpu=args.n_cpu, backend="batch")
+
+
+def case_sup_template_native(inputs, output_dir, args):
+    from PDBToolkit.CASP.sup_template import process_in_parallel
+    process_in_parallel(inputs["pdb_dir"], inputs["reference"], output_dir, backend="native")
+
+
+def case_all_vs_all(inputs, output_dir, args):
+    from PDBToolkit.CASP.all_vs_all import all_vs_all
+    models = [os.path.join(inputs["pdb_dir"], file) for file in sorted(os.listdir(inputs["pdb_dir"]))]
+    all_vs_all(models, output_dir, n_cpu=args.n_cpu)
+
+
+def case_all_vs_all_native(inputs, output_dir, args):
+    from PDBToolkit.CASP.all_vs_all import all_vs_all
+    models = [os.path.join(inputs["pdb_dir"], file) for file in sorted(os.listdir(inputs["pdb_dir"]))]
+    all_vs_all(models, output_dir, backend="native", n_cpu=args.n_cpu)
+
+
+def case_sup_assemble(inputs, output_dir, args):
+    from PDBToolkit.CASP.sup_assemble import sup_assemble
+    sup_assemble(inputs["subunits"][0], inputs["pdb_dir"], os.path.join(output_dir, "assembly.pdb"), matrix=True, n_cpu=args.n_cpu)
+
+
+def case_phenix_clashscore(inputs, output_dir, args):
+    from PDBToolkit.CASP.phenix_clashscore import process_in_parallel
+    files = [os.path.join(inputs["pdb_dir"], file) for file in sorted(os.listdir(inputs["pdb_dir"]))]
+    process_in_parallel(files, os.path.join(output_dir, "clashscore.json"), args.n_cpu)
+
+
+def case_native_clashscore(inputs, output_dir, args):
+    from PDBToolkit.CASP.phenix_clashscore import process_in_parallel
+    files = [os.path.join(inputs["pdb_dir"], file) for file in sorted(os.listdir(inputs["pdb_dir"]))]
+    process_in_parallel(files, os.path.join(output_dir, "clashscore.json"), args.n_cpu, backend="native")
+
+
+CASES = {name[len("case_"):]: function for name, function in list(globals().items()) if name.startswith("case_")}
+
+
+def _run_case(name, inputs, output_dir, args, start_method, queue):
+    """
+    Body of the spawned process: point the config at the stubs, run the case, report usage.
+
+    The case's own worker pools use the platform's start method again, as in production.
+    """
+    import logging
+    multiprocessing.set_start_method(start_method, force=True)
+    import PDBToolkit.config as config
+    config.USALIGN_PATH = os.path.join(STUB_DIR, "USalign")
+    config.PHENIX_CLASHSCORE_PATH = os.path.join(STUB_DIR, "phenix.clashscore")
+    os.environ["STUB_LATENCY"] = str(args.stub_latency)
+    logging.disable(logging.CRITICAL)
+
+    error = None
+    start = time.perf_counter()
+    try:
+        CASES[name](inputs, output_dir, args)
+    except Exception:
+        error = traceback.format_exc(limit=3).strip().splitlines()[-1]
+    elapsed = time.perf_counter() - start
+    queue.put({
+        "wall_s": elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "error": error,
+    })
+
+
+def files_written(directory):
+    count, size = 0, 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            count += 1
+            size += os.path.getsize(os.path.join(root, file))
+    return count, size
+
+
+def run_case(name, inputs, work_dir, args):
+    """
+    Run one case `args.repeat` times in fresh processes and keep the best run.
+    """
+    context = multiprocessing.get_context("spawn")
+    start_method = multiprocessing.get_start_method()
+    runs = []
+    for _ in range(args.repeat):
+        output_dir = os.path.join(work_dir, name)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        queue = context.Queue()
+        process = context.Process(target=_run_case, args=(name, inputs, output_dir, args, start_method, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        result["files_written"], result["bytes_written"] = files_written(output_dir)
+        runs.append(result)
+        if result["error"]:
+            break
+    best = min(runs, key=lambda run: run["wall_s"])
+    best["peak_rss_mb"] = min(run["peak_rss_mb"] for run in runs)
+    return {"case": name, **best}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous = None):
+    previous = {result["case"]: result for result in (previous or [])}
+    header = f"{'case':<32}{'time (s)':>10}{'RSS (MB)':>10}{'workers':>10}{'files':>8}{'MB out':>9}"
+    if previous:
+        header += f"{'time x':>9}{'RSS x':>8}"
+    print(header)
+    for result in results:
+        if result["error"]:
+            print(f"{result['case']:<32}FAILED: {result['error']}")
+            continue
+        line = (
+            f"{result['case']:<32}{result['wall_s']:>10.3f}{result['peak_rss_mb']:>10.1f}"
+            f"{result['peak_child_rss_mb']:>10.1f}{result['files_written']:>8}{result['bytes_written'] / 2 ** 20:>9.1f}"
+        )
+        old = previous.get(result["case"])
+        if old and not old["error"]:
+            line += f"{result['wall_s'] / old['wall_s']:>9.2f}{result['peak_rss_mb'] / old['peak_rss_mb']:>8.2f}"
+        print(line)
+
+
+def main(args):
+    names = args.cases or list(CASES)
+    unknown = set(names) - set(CASES)
+    if unknown:
+        sys.exit(f"Unknown cases: {', '.join(sorted(unknown))}. Choose from {', '.join(CASES)}.")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, "inputs")
+        os.makedirs(input_dir)
+        inputs = prepare_inputs(input_dir, args)
+        results = []
+        for name in names:
+            if name in ("reassign_chain_id", "reassign_chain_id_fast", "renumber_atom") and "pdb" not in inputs:
+                results.append({"case": name, "error": f"PDB input not written for {args.n_chains} chains"})
+                continue
+            results.append(run_case(name, inputs, temp_dir, args))
+            print(f"{name}: {'failed' if results[-1]['error'] else 'done'}", file=sys.stderr, flush=True)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)["results"]
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "parameters": vars(args),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDBOps and CASP operations on synthetic assemblies.")
+    parser.add_argument("--cases", nargs="*", default=None, help=f"Cases to run (default all): {', '.join(CASES)}.")
+    parser.add_argument("--n_chains", type=int, default=40, help="Chains of the large assembly.")
+    parser.add_argument("--n_residues", type=int, default=300, help="Residues per chain.")
+    parser.add_argument("--n_models", type=int, default=1, help="Models of the large assembly.")
+    parser.add_argument("--n_files", type=int, default=32, help="Files for the parallel drivers.")
+    parser.add_argument("--n_small_chains", type=int, default=4, help="Chains per file for the parallel drivers.")
+    parser.add_argument("--n_zips", type=int, default=8, help="AF3 zip files for qa_pipeline.")
+    parser.add_argument("--n_cpu", type=int, default=4, help="Workers for the parallel drivers.")
+    parser.add_argument("--stub_latency", type=float, default=0.05, help="Seconds each stub binary sleeps.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest is kept.")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against.")
+    args = parser.parse_args()
+    main(args)
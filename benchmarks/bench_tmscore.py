@@ -0,0 +1,99 @@
+"""
+Validate the native TM-score engine against USalign and benchmark its throughput.
+
+A reference chain is perturbed into a fixture set of models (rigid motion plus
+increasing noise, some with displaced segments). The models are scored with
+`score_models`; if USalign is available at `USALIGN_PATH` they are also scored
+with `run_usalign` and the largest TM-score difference is reported.
+
+Usage:
+    python benchmarks/bench_tmscore.py --n_models 500 --n_residues 300
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PDBToolkit.config import USALIGN_PATH
+from PDBToolkit.PDBOps.atom_table import AtomTable, write_pdb
+from PDBToolkit.CASP.tmscore import score_models
+from PDBToolkit.CASP.sup_template import run_usalign
+
+
+def random_chain(n_residues, rng):
+    """
+    A protein-like CA trace: a random walk with 3.8 A steps.
+    """
+    steps = rng.normal(size=(n_residues, 3))
+    steps *= 3.8 / np.linalg.norm(steps, axis=1)[:, None]
+    coord = np.cumsum(steps, axis=0)
+    return AtomTable(
+        hetatm=np.zeros(n_residues, dtype=bool), name=["CA"] * n_residues, altloc=[" "] * n_residues,
+        resname=["ALA"] * n_residues, chain_id=["A"] * n_residues, resseq=np.arange(1, n_residues + 1),
+        icode=[" "] * n_residues, coord=coord, occupancy=np.ones(n_residues), bfactor=np.zeros(n_residues),
+        element=["C"] * n_residues, segid=[" "] * n_residues,
+    )
+
+
+def write_fixtures(directory, n_models, n_residues, seed = 0):
+    rng = np.random.default_rng(seed)
+    reference = random_chain(n_residues, rng)
+    reference_file = os.path.join(directory, "reference.pdb")
+    write_pdb(reference, reference_file)
+
+    model_files = []
+    for i in range(n_models):
+        rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        rotation *= np.sign(np.linalg.det(rotation))
+        model = reference.transform(rotation, rng.normal(size=3) * 20)
+        noise = rng.normal(size=model.coord.shape) * (4.0 * i / max(n_models - 1, 1))
+        model.coord = (model.coord + noise).astype(np.float32)
+        if i % 5 == 0:
+            model.coord[: n_residues // 3] += rng.normal(size=3).astype(np.float32) * 8
+        model_file = os.path.join(directory, f"model_{i}.pdb")
+        write_pdb(model, model_file)
+        model_files.append(model_file)
+    return reference_file, model_files
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        reference_file, model_files = write_fixtures(temp_dir, args.n_models, args.n_residues)
+
+        start = time.perf_counter()
+        native = score_models(model_files, reference_file)
+        elapsed = time.perf_counter() - start
+        print(f"native: {len(model_files)} models of {args.n_residues} residues in {elapsed:.2f} s "
+              f"({len(model_files) / elapsed:.0f} models/s)")
+
+        if not os.path.exists(USALIGN_PATH):
+            print(f"USalign not found at {USALIGN_PATH}, skipping validation.")
+            return
+
+        n_checked = min(args.n_validate, len(model_files))
+        start = time.perf_counter()
+        usalign = {model_file: run_usalign(model_file, reference_file) for model_file in model_files[:n_checked]}
+        elapsed = time.perf_counter() - start
+        print(f"USalign: {n_checked} models in {elapsed:.2f} s ({n_checked / elapsed:.0f} models/s)")
+
+        differences = np.array([
+            abs(native[model_file]["tmscore"] - tmscore)
+            for model_file, tmscore in usalign.items() if tmscore is not None
+        ])
+        print(f"TM-score difference: max {differences.max():.4f}, mean {differences.mean():.4f}")
+        if differences.max() > args.tolerance:
+            sys.exit(f"Native TM-scores differ from USalign by more than {args.tolerance}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate and benchmark the native TM-score engine.")
+    parser.add_argument("--n_models", type=int, default=500, help="Number of models.")
+    parser.add_argument("--n_residues", type=int, default=300, help="Residues per model.")
+    parser.add_argument("--n_validate", type=int, default=50, help="Models also scored with USalign.")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Largest accepted TM-score difference.")
+    args = parser.parse_args()
+    main(args)
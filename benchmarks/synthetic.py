@@ -0,0 +1,153 @@
+"""
+Deterministic synthetic structures for the benchmarks.
+
+Every chain is a helix of N, CA, C, O and CB atoms (residue frames turn with the
+helix but the geometry is not a real backbone); chains stand side
+by side on a square grid so they do not overlap. Models are copies of the first
+with small coordinate noise, and B-factors look like pLDDT values. The same
+parameters and seed always give byte-identical files.
+"""
+import os
+import sys
+import json
+import zipfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PDBToolkit.PDBOps.atom_table import AtomTable
+from PDBToolkit.PDBOps.pdb_writer import CHAIN_IDS, atom_line, chain_label, format_serial, ter_line
+
+RESNAMES = ["ALA", "LEU", "SER", "LYS", "GLU"]
+BACKBONE = [("N", "N"), ("CA", "C"), ("C", "C"), ("O", "O"), ("CB", "C")]
+OFFSETS = np.array([[-1.2, 0.6, -0.4], [0.0, 0.0, 0.0], [1.3, 0.5, 0.4], [1.6, 1.7, 0.6], [0.1, -1.1, 1.1]])
+CHAIN_SPACING = 12.0
+MODEL_NOISE = 0.3
+CIF_COLUMNS = [
+    "group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+    "label_asym_id", "label_entity_id", "label_seq_id", "pdbx_PDB_ins_code",
+    "Cartn_x", "Cartn_y", "Cartn_z", "occupancy", "B_iso_or_equiv",
+    "auth_seq_id", "auth_asym_id", "pdbx_PDB_model_num",
+]
+
+
+def build_table(n_chains, n_residues, seed = 0):
+    """
+    An AtomTable of `n_chains` helical chains of `n_residues` residues each.
+    """
+    rng = np.random.default_rng(seed)
+    angle = np.deg2rad(100.0) * np.arange(n_residues)
+    cos, sin = np.cos(angle), np.sin(angle)
+    ca = np.stack([2.3 * cos, 2.3 * sin, 1.5 * np.arange(n_residues)], axis=1)
+    rotation = np.zeros((n_residues, 3, 3))
+    rotation[:, 0, 0], rotation[:, 0, 1], rotation[:, 1, 0], rotation[:, 1, 1], rotation[:, 2, 2] = cos, -sin, sin, cos, 1
+    residue = (ca[:, None, :] + OFFSETS[None, :, :] @ rotation.transpose(0, 2, 1)).reshape(-1, 3)
+
+    side = int(np.ceil(np.sqrt(n_chains)))
+    coords = []
+    for index in range(n_chains):
+        shift = np.array([index % side, index // side, 0.0]) * CHAIN_SPACING
+        coords.append(residue + shift + rng.normal(scale=0.05, size=residue.shape))
+
+    n_atoms = n_chains * n_residues * len(BACKBONE)
+    per_chain = n_residues * len(BACKBONE)
+    resseq = np.repeat(np.arange(1, n_residues + 1), len(BACKBONE))
+    return AtomTable(
+        hetatm=np.zeros(n_atoms, dtype=bool),
+        name=[name for name, _ in BACKBONE] * (n_chains * n_residues),
+        altloc=[" "] * n_atoms,
+        resname=np.repeat([RESNAMES[i % len(RESNAMES)] for i in range(n_residues)], len(BACKBONE)).tolist() * n_chains,
+        chain_id=[chain_label(index) for index in range(n_chains) for _ in range(per_chain)],
+        resseq=np.tile(resseq, n_chains),
+        icode=[" "] * n_atoms,
+        coord=np.concatenate(coords).astype(np.float32),
+        occupancy=np.ones(n_atoms),
+        bfactor=np.round(rng.uniform(30, 95, n_atoms), 2),
+        element=[element for _, element in BACKBONE] * (n_chains * n_residues),
+        segid=[" "] * n_atoms,
+    )
+
+
+def model_coords(table, n_models, seed = 0):
+    rng = np.random.default_rng(seed + 1)
+    for model in range(n_models):
+        noise = rng.normal(scale=MODEL_NOISE, size=table.coord.shape) if model else 0
+        yield model + 1, table.coord + noise
+
+
+def write_pdb_models(path, table, n_models = 1, seed = 0):
+    """
+    Write the table as PDB, with MODEL records when `n_models > 1`.
+    """
+    if any(len(chain) > 1 for chain in table.chain_ids):
+        raise ValueError("PDB format supports at most 62 one-character chain ids.")
+    ends = set((table.chain_starts[1:] - 1).tolist())
+    with open(path, "w") as handle:
+        for model, coords in model_coords(table, n_models, seed):
+            if n_models > 1:
+                handle.write(f"MODEL     {model:>4}\n")
+            serial = 1
+            for i, (x, y, z) in enumerate(coords.tolist()):
+                handle.write(atom_line(
+                    False, format_serial(serial, True), table.name[i], " ", table.resname[i], table.chain_id[i],
+                    int(table.resseq[i]), " ", x, y, z, 1.0, table.bfactor[i], "    ", table.element[i],
+                ))
+                serial += 1
+                if i in ends:
+                    handle.write(ter_line(format_serial(serial, True), table.resname[i], table.chain_id[i], int(table.resseq[i]), " "))
+                    serial += 1
+            if n_models > 1:
+                handle.write("ENDMDL\n")
+        handle.write("END\n")
+
+
+def write_cif_models(path, table, n_models = 1, seed = 0):
+    """
+    Write the table as an mmCIF `_atom_site` loop with `n_models` models.
+    """
+    with open(path, "w") as handle:
+        handle.write("data_synthetic\n#\nloop_\n")
+        for column in CIF_COLUMNS:
+            handle.write(f"_atom_site.{column}\n")
+        serial = 0
+        rows = list(zip(table.name.tolist(), table.resname.tolist(), table.chain_id.tolist(), table.resseq.tolist(), table.element.tolist(), table.bfactor.tolist()))
+        for model, coords in model_coords(table, n_models, seed):
+            for (name, resname, chain, resseq, element, bfactor), (x, y, z) in zip(rows, coords.tolist()):
+                serial += 1
+                handle.write(
+                    f"ATOM {serial} {element} {name} . {resname} {chain} 1 {resseq} ? "
+                    f"{x:.3f} {y:.3f} {z:.3f} 1.00 {bfactor:.2f} {resseq} {chain} {model}\n"
+                )
+        handle.write("#\n")
+
+
+def write_subunits(directory, n_chains, n_residues, seed = 0):
+    """
+    Write every chain of a synthetic assembly as its own single-chain PDB file named A.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index, (_, chain) in enumerate(build_table(n_chains, n_residues, seed).iter_chains()):
+        path = os.path.join(directory, f"subunit_{index:04}.pdb")
+        write_pdb_models(path, chain.rename_chains({chain.chain_id[0]: "A"}))
+        paths.append(path)
+    return paths
+
+
+def write_af3_zip(path, table, job_name, n_models = 5, seed = 0):
+    """
+    Write an AF3-server-like zip: per model a CIF and a summary_confidences JSON.
+    """
+    rng = np.random.default_rng(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for model in range(n_models):
+            cif_path = path + f".{model}.cif"
+            write_cif_models(cif_path, table, 1, seed + model)
+            zip_ref.write(cif_path, f"{job_name}/fold_{job_name}_model_{model}.cif")
+            os.remove(cif_path)
+            summary = {
+                "iptm": round(float(rng.uniform(0.3, 0.9)), 2),
+                "ptm": round(float(rng.uniform(0.3, 0.9)), 2),
+                "has_clash": float(rng.random() < 0.2),
+            }
+            zip_ref.writestr(f"{job_name}/fold_{job_name}_summary_confidences_{model}.json", json.dumps(summary))
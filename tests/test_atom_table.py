@@ -0,0 +1,84 @@
+"""
+The AtomTable entry points of reassign_chain_id and merge_structure against the file-based operations.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import build_table, write_subunits
+from PDBToolkit.PDBOps.atom_table import read_pdb, write_pdb
+from PDBToolkit.PDBOps import merge_structure
+from PDBToolkit.PDBOps.merge_structure import merge_structures, merge_tables
+from PDBToolkit.PDBOps.reassign_chain_id import reassign_chain_id_fast, reassign_table
+
+CHAIN_MAP = {"A": "2", "B": "C", "C": "A"}
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("renumber", [True, False])
+def test_reassign_table_matches_file(tmp_path, renumber):
+    input_path = os.path.join(tmp_path, "input.pdb")
+    table = build_table(3, 12)
+    write_pdb(table, input_path)
+    reassign_chain_id_fast(input_path, os.path.join(tmp_path, "fast.pdb"), CHAIN_MAP, renumber=renumber)
+    write_pdb(reassign_table(read_pdb(input_path), CHAIN_MAP), os.path.join(tmp_path, "table.pdb"), renumber=renumber)
+    assert read_bytes(os.path.join(tmp_path, "table.pdb")) == read_bytes(os.path.join(tmp_path, "fast.pdb"))
+
+
+@pytest.mark.parametrize("renumber", [True, False])
+def test_reassign_hybrid36_beyond_99999_atoms(tmp_path, renumber):
+    input_path = os.path.join(tmp_path, "input.pdb")
+    table = build_table(25, 800)
+    chain_map = {chain_id: chain_id for chain_id in table.chain_ids} | {"A": "B", "B": "A"}
+    write_pdb(table, input_path, hybrid36=True)
+    if not renumber:
+        with pytest.raises(ValueError, match="exceeds PDB format limit"):
+            reassign_chain_id_fast(input_path, os.path.join(tmp_path, "fast.pdb"), chain_map, renumber=False)
+    reassign_chain_id_fast(input_path, os.path.join(tmp_path, "fast.pdb"), chain_map, renumber=renumber, hybrid36=True)
+    write_pdb(
+        reassign_table(read_pdb(input_path), chain_map), os.path.join(tmp_path, "table.pdb"),
+        renumber=renumber, hybrid36=True,
+    )
+    assert read_bytes(os.path.join(tmp_path, "table.pdb")) == read_bytes(os.path.join(tmp_path, "fast.pdb"))
+
+
+def test_reassign_table_chain_order():
+    table = reassign_table(build_table(3, 4), CHAIN_MAP, chain_order=["A", "2", "C"])
+    assert table.chain_ids == ["A", "2", "C"]
+    with pytest.raises(KeyError):
+        reassign_table(build_table(3, 4), {"A": "B"})
+
+
+@pytest.mark.parametrize("renumber", [True, False])
+def test_merge_tables_matches_file(tmp_path, renumber):
+    paths = write_subunits(os.path.join(tmp_path, "subunits"), 4, 10)
+    output_file = merge_structures(paths, os.path.join(tmp_path, "merged.pdb"), renumber=renumber)
+    merged = merge_tables(read_pdb(path) for path in paths)
+    write_pdb(merged, os.path.join(tmp_path, "table.pdb"), renumber=renumber)
+    assert merged.chain_ids == ["A", "B", "C", "D"]
+    assert read_bytes(os.path.join(tmp_path, "table.pdb")) == read_bytes(output_file)
+
+
+def test_merge_tables_joins_split_chains_and_labels_past_62():
+    table = build_table(2, 3)
+    half = len(table) // 2
+    split = table[np.r_[0:5, half:half + 5, 5:half, half + 5:len(table)]]
+    merged = merge_tables([split] + [build_table(1, 2)] * 61)
+    assert merged.chain_ids[:3] == ["A", "B", "C"]
+    assert merged.chain_ids[-2:] == ["9", "AA"]
+    assert np.array_equal(merged.chain("A").coord, table.chain("A").coord)
+
+
+def test_merge_structures_reraises_when_output_was_not_created(tmp_path, monkeypatch):
+    def open_output(path):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(merge_structure, "open_output", open_output)
+    paths = write_subunits(os.path.join(tmp_path, "subunits"), 2, 4)
+    with pytest.raises(OSError, match="No space left"):
+        merge_structures(paths, os.path.join(tmp_path, "merged.pdb"))
@@ -0,0 +1,99 @@
+"""
+Manifest resume and failure reporting of run_batch.
+"""
+import os
+
+import pytest
+
+from PDBToolkit.PDBOps.batch import FAILURES_NAME, MANIFEST_NAME, run_batch
+
+
+def copy_file(input_path, output_path, calls_path, suffix = ""):
+    """
+    Copy the input with `suffix` appended, logging the call; inputs containing "bad" raise.
+    """
+    with open(calls_path, "a") as f:
+        f.write(os.path.basename(input_path) + "\n")
+    with open(input_path) as f:
+        text = f.read()
+    if "bad" in text:
+        raise ValueError("bad input")
+    with open(output_path, "w") as f:
+        f.write(text + suffix)
+
+
+@pytest.fixture
+def batch(tmp_path):
+    input_dir, output_dir = os.path.join(tmp_path, "in"), os.path.join(tmp_path, "out")
+    os.makedirs(input_dir)
+    for i in range(4):
+        with open(os.path.join(input_dir, f"{i}.txt"), "w") as f:
+            f.write(f"input {i}")
+    calls_path = os.path.join(tmp_path, "calls")
+
+    def run(suffix = "", force = False):
+        if os.path.exists(calls_path):
+            os.remove(calls_path)
+        jobs = [
+            (os.path.join(input_dir, name), os.path.join(output_dir, name)) for name in sorted(os.listdir(input_dir))
+        ]
+        failures = run_batch(
+            copy_file, jobs, (calls_path, suffix), n_cpu=2, force=force,
+            report_path=os.path.join(output_dir, FAILURES_NAME), manifest_path=os.path.join(output_dir, MANIFEST_NAME),
+        )
+        if not os.path.exists(calls_path):
+            return [], failures
+        with open(calls_path) as f:
+            return sorted(f.read().split()), failures
+
+    os.makedirs(output_dir)
+    return input_dir, output_dir, run
+
+
+def test_rerun_skips_unchanged_inputs(batch):
+    input_dir, output_dir, run = batch
+    assert run()[0] == ["0.txt", "1.txt", "2.txt", "3.txt"]
+    assert run()[0] == []
+    with open(os.path.join(input_dir, "1.txt"), "w") as f:
+        f.write("input 1, edited")
+    os.remove(os.path.join(output_dir, "2.txt"))
+    assert run()[0] == ["1.txt", "2.txt"]
+    with open(os.path.join(output_dir, "1.txt")) as f:
+        assert f.read() == "input 1, edited"
+
+
+def test_other_settings_or_force_rerun_everything(batch):
+    _, output_dir, run = batch
+    run()
+    assert run(suffix="!")[0] == ["0.txt", "1.txt", "2.txt", "3.txt"]
+    with open(os.path.join(output_dir, "0.txt")) as f:
+        assert f.read() == "input 0!"
+    assert run(suffix="!")[0] == []
+    assert run(suffix="!", force=True)[0] == ["0.txt", "1.txt", "2.txt", "3.txt"]
+
+
+def test_failures_are_reported_and_retried(batch):
+    input_dir, output_dir, run = batch
+    with open(os.path.join(input_dir, "3.txt"), "w") as f:
+        f.write("bad")
+    calls, failures = run()
+    assert failures == [(os.path.join(input_dir, "3.txt"), "ValueError: bad input")]
+    with open(os.path.join(output_dir, FAILURES_NAME)) as f:
+        assert f.read().splitlines()[1:] == [f"{os.path.join(input_dir, '3.txt')}\tValueError: bad input"]
+    # nothing partial is left behind
+    assert sorted(os.listdir(output_dir)) == sorted(["0.txt", "1.txt", "2.txt", FAILURES_NAME, MANIFEST_NAME])
+
+    assert run()[0] == ["3.txt"]
+    with open(os.path.join(input_dir, "3.txt"), "w") as f:
+        f.write("input 3")
+    calls, failures = run()
+    assert calls == ["3.txt"] and failures == []
+    assert not os.path.exists(os.path.join(output_dir, FAILURES_NAME))
+
+
+def test_unreadable_manifest_reruns_everything(batch):
+    _, output_dir, run = batch
+    run()
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        f.write('{"settings": ')
+    assert run()[0] == ["0.txt", "1.txt", "2.txt", "3.txt"]
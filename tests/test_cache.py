@@ -0,0 +1,108 @@
+"""
+Result and structure caches: keys follow the inputs, entries are evicted least recently used first.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from PDBToolkit.cache import ResultCache, hash_file
+from PDBToolkit.PDBOps import structure_cache
+from PDBToolkit.PDBOps.atom_table import read_pdb
+
+
+def write(path, text, mtime_ns = None):
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_key_follows_content_and_command(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    model = write(tmp_path / "model.pdb", "ATOM 1\n", 10 ** 18)
+    key = cache.key(["USalign"], [model])
+    assert cache.key(["USalign"], [model]) == key
+    assert cache.key(["USalign", "-mm", "1"], [model]) != key
+
+    # same content under another name hits the same entry
+    copy = write(tmp_path / "copy.pdb", "ATOM 1\n")
+    assert cache.key(["USalign"], [copy]) == key
+
+    write(model, "ATOM 2\n", 2 * 10 ** 18)
+    assert hash_file(model) != hash_file(copy)
+    assert cache.key(["USalign"], [model]) != key
+
+
+def test_put_get_restore(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    output = write(tmp_path / "sup.pdb", "superposed\n")
+    cache.put("ab" * 32, {"tmscore": 0.5}, {".pdb": output})
+    assert cache.get("ab" * 32) == {"tmscore": 0.5}
+    assert cache.get("cd" * 32) is None
+
+    prefix = str(tmp_path / "restored")
+    assert cache.restore("ab" * 32, prefix)
+    with open(prefix + ".pdb") as f:
+        assert f.read() == "superposed\n"
+
+    # the first writer wins
+    cache.put("ab" * 32, {"tmscore": 0.9})
+    assert cache.get("ab" * 32) == {"tmscore": 0.5}
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=None)
+    keys = [f"{i:02}" * 32 for i in range(4)]
+    for age, key in enumerate(keys):
+        cache.put(key, {"padding": "x" * 1000})
+        os.utime(cache._entry_dir(key), (1000 + age, 1000 + age))
+    # a hit makes the oldest entry the most recent
+    assert cache.get(keys[0]) is not None
+
+    entry_size = os.path.getsize(os.path.join(cache._entry_dir(keys[0]), "result.json"))
+    cache.max_bytes = 2 * entry_size
+    cache.prune()
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True]
+    assert not [name for name in os.listdir(cache.cache_dir) if name.startswith(".tmp_")]
+
+
+def test_prune_removes_stale_temporary_directories(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=10 ** 6)
+    stale = os.path.join(cache.cache_dir, ".tmp_killed")
+    fresh = os.path.join(cache.cache_dir, ".tmp_running")
+    os.mkdir(stale)
+    os.mkdir(fresh)
+    os.utime(stale, (0, 0))
+    cache.prune()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+
+PDB_LINE = "ATOM      1  CA  ALA A   1       1.000   2.000   3.000  1.00 50.00           C\n"
+
+
+@pytest.fixture
+def enabled_cache(tmp_path):
+    cache = structure_cache.enable(str(tmp_path / "structures"))
+    yield cache
+    structure_cache.disable()
+
+
+def n_entries(cache):
+    return sum(len(os.listdir(shard.path)) for shard in os.scandir(cache.cache_dir) if not shard.name.startswith(".tmp_"))
+
+
+def test_structure_cache_hit_and_invalidation(tmp_path, enabled_cache):
+    path = write(tmp_path / "model.pdb", PDB_LINE, 10 ** 18)
+    first = read_pdb(path)
+    cached = read_pdb(path)
+    assert n_entries(enabled_cache) == 1
+    assert np.array_equal(cached.coord, first.coord)
+    assert list(cached.chain_id) == ["A"]
+
+    # a rewritten file is parsed again, not served from the old entry
+    write(path, PDB_LINE.replace("  1.000", " 10.000", 1), 2 * 10 ** 18)
+    assert read_pdb(path).coord[0, 0] == pytest.approx(10.0)
+    assert n_entries(enabled_cache) == 2
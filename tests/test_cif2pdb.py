@@ -0,0 +1,54 @@
+"""
+The streaming converters must write exactly what the Biopython path writes.
+"""
+import os
+
+import pytest
+
+from benchmarks.bench_cif2pdb import write_fixtures
+from PDBToolkit.PDBOps.cif2pdb import cif_to_pdb, stream_cif_to_mmcif, stream_cif_to_pdb
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(scope="module")
+def fixtures(tmp_path_factory):
+    return write_fixtures(str(tmp_path_factory.mktemp("fixtures")))
+
+
+@pytest.mark.parametrize("name", ["mixed", "altloc", "models", "assembly"])
+@pytest.mark.parametrize("renumber", [False, True])
+def test_stream_matches_biopython(fixtures, tmp_path, name, renumber):
+    reference = str(tmp_path / "reference.pdb")
+    streamed = str(tmp_path / "stream.pdb")
+    cif_to_pdb(fixtures[name], reference, renumber)
+    stream_cif_to_pdb(fixtures[name], streamed, renumber)
+    assert read_bytes(streamed) == read_bytes(reference)
+
+
+def test_stream_gzip_input(fixtures, tmp_path):
+    import gzip
+    import shutil
+
+    compressed = str(tmp_path / "mixed.cif.gz")
+    with open(fixtures["mixed"], "rb") as infile, gzip.open(compressed, "wb") as outfile:
+        shutil.copyfileobj(infile, outfile)
+    plain = str(tmp_path / "plain.pdb")
+    streamed = str(tmp_path / "from_gz.pdb")
+    stream_cif_to_pdb(fixtures["mixed"], plain)
+    stream_cif_to_pdb(compressed, streamed)
+    assert read_bytes(streamed) == read_bytes(plain)
+
+
+def test_mmcif_keeps_label_columns(fixtures, tmp_path):
+    output_path = str(tmp_path / "out.cif")
+    stream_cif_to_mmcif(fixtures["mixed"], output_path)
+    with open(fixtures["mixed"]) as f:
+        source = [line.split() for line in f if line.startswith(("ATOM", "HETATM"))]
+    with open(output_path) as f:
+        written = [line.split() for line in f if line.startswith(("ATOM", "HETATM"))]
+    # label_asym_id, label_entity_id, label_seq_id of the atoms with an author residue number
+    assert [row[6:9] for row in written] == [row[6:9] for row in source if row[15] != "."]
@@ -0,0 +1,89 @@
+"""
+The cell-list clash search against brute-force distances on small fixtures.
+"""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import build_table
+from PDBToolkit.CASP import clash
+from PDBToolkit.CASP.clash import close_pairs, find_clashes
+from PDBToolkit.PDBOps.atom_table import AtomTable, concatenate
+
+
+def brute_force_pairs(coord, cutoff):
+    coord = np.asarray(coord, dtype=np.float64)
+    i, j = np.triu_indices(len(coord), 1)
+    distance = np.sqrt(((coord[i] - coord[j]) ** 2).sum(axis=1))
+    close = distance < cutoff
+    return i[close], j[close], distance[close]
+
+
+def as_dict(i, j, distance):
+    return dict(zip(zip(i.tolist(), j.tolist()), distance.tolist()))
+
+
+@pytest.mark.parametrize("cutoff", [1.0, 3.2, 5.0])
+def test_close_pairs_matches_brute_force(monkeypatch, cutoff):
+    monkeypatch.setattr(clash, "CHUNK_SIZE", 64)
+    rng = np.random.default_rng(3)
+    coord = np.concatenate([rng.uniform(-20, 5, size=(400, 3)), rng.normal(scale=1.5, size=(200, 3))])
+    found = as_dict(*close_pairs(coord, cutoff))
+    expected = as_dict(*brute_force_pairs(coord, cutoff))
+    assert found.keys() == expected.keys()
+    assert np.allclose([found[key] for key in expected], list(expected.values()))
+
+
+def test_close_pairs_small_inputs():
+    assert all(len(values) == 0 for values in close_pairs(np.zeros((1, 3)), 3.0))
+    i, j, distance = close_pairs(np.zeros((2, 3)), 3.0)
+    assert (i.tolist(), j.tolist(), distance.tolist()) == ([0], [1], [0.0])
+
+
+def test_clash_counts_match_brute_force(monkeypatch):
+    table = build_table(4, 30, seed=5)
+    # push chain B into chain A so that there are inter-chain clashes to count
+    shift = table.chain("A").coord.mean(axis=0) - table.chain("B").coord.mean(axis=0) + 3.0
+    moved = concatenate([table.chain("A"), table.chain("B").transform(np.eye(3), shift), table.chain("C"), table.chain("D")])
+    clashscore, clashes = find_clashes(moved)
+    assert clashes
+    monkeypatch.setattr(clash, "close_pairs", brute_force_pairs)
+    brute_clashscore, brute_clashes = find_clashes(moved)
+    # equal overlaps may come in another order
+    assert brute_clashscore == clashscore
+    assert sorted(brute_clashes) == sorted(clashes)
+
+
+def residue_atoms(atoms):
+    """
+    An AtomTable of `(chain, resseq, resname, name, element, altloc, hetatm, xyz)` rows.
+    """
+    chain_id, resseq, resname, name, element, altloc, hetatm, coord = zip(*atoms)
+    n_atoms = len(atoms)
+    return AtomTable(
+        hetatm=list(hetatm), name=list(name), altloc=list(altloc), resname=list(resname),
+        chain_id=list(chain_id), resseq=list(resseq), icode=[" "] * n_atoms,
+        coord=np.array(coord, dtype=np.float32), occupancy=np.ones(n_atoms), bfactor=np.zeros(n_atoms),
+        element=list(element), segid=[" "] * n_atoms,
+    )
+
+
+def test_clash_rules():
+    table = residue_atoms([
+        # two carbons of different ligands 2.5 A apart: overlap 0.9, a clash
+        ("A", 1, "LIG", "C1", "C", " ", True, (0.0, 0.0, 0.0)),
+        ("A", 2, "LIG", "C1", "C", " ", True, (2.5, 0.0, 0.0)),
+        # N/O 2.9 A apart: overlap 0.17, within the hydrogen-bond allowance
+        ("B", 1, "LIG", "N1", "N", " ", True, (20.0, 0.0, 0.0)),
+        ("B", 2, "LIG", "O1", "O", " ", True, (22.9, 0.0, 0.0)),
+        # two carbons bonded within a residue are not scored
+        ("C", 1, "LIG", "C1", "C", " ", True, (40.0, 0.0, 0.0)),
+        ("C", 1, "LIG", "C2", "C", " ", True, (41.5, 0.0, 0.0)),
+        # different alternate locations are not scored
+        ("D", 1, "LIG", "C1", "C", "A", True, (60.0, 0.0, 0.0)),
+        ("D", 2, "LIG", "C1", "C", "B", True, (61.0, 0.0, 0.0)),
+        # an ion without a radius is skipped
+        ("E", 1, "ZN", "ZN", "ZN", " ", True, (0.0, 1.0, 0.0)),
+    ])
+    clashscore, clashes = find_clashes(table)
+    assert clashes == [("A:LIG 1:C1", "A:LIG 2:C1", 0.9)]
+    assert clashscore == pytest.approx(1000 / 8)
@@ -0,0 +1,111 @@
+"""
+Timeouts, process-group kills, retries and the concurrency limit of SubprocessExecutor, with small Python commands.
+"""
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+import pytest
+
+from PDBToolkit.CASP.executor import SubprocessExecutor
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+def run(executor, command, **kwargs):
+    return asyncio.run(executor.run(command, **kwargs))
+
+
+def is_gone(pid):
+    """
+    Whether `pid` has exited (a zombie left to an init that does not reap counts as exited).
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+def test_matches_and_success():
+    result = run(SubprocessExecutor(), python("print('TM-score= 0.5'); print('TM-score= 0.7')"), pattern=r"TM-score= ([\d.]+)")
+    assert result.ok and result.attempts == 1
+    assert result.matches == ["0.5", "0.7"]
+    assert result.check() is result
+
+
+def test_exit_status_is_not_retried():
+    result = run(SubprocessExecutor(retries=2, backoff=0.01), python("import sys; sys.exit('bad input')"))
+    assert not result.ok
+    assert result.attempts == 1
+    assert result.returncode == 1
+    with pytest.raises(subprocess.SubprocessError, match="bad input"):
+        result.check()
+
+
+def test_timeout_kills_the_process_group(tmp_path):
+    pid_file = os.path.join(tmp_path, "child.pid")
+    # the command starts a grandchild that would outlive a kill of the direct child only
+    command = python(
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        f"open({pid_file!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(30)\n"
+    )
+    start = time.perf_counter()
+    result = run(SubprocessExecutor(timeout=1.0), command)
+    assert time.perf_counter() - start < 10
+    assert result.timed_out and not result.ok
+    assert "timed out after 1 attempt" in result.error()
+    with open(pid_file) as f:
+        child = int(f.read())
+    deadline = time.time() + 5
+    while not is_gone(child) and time.time() < deadline:
+        time.sleep(0.05)
+    assert is_gone(child)
+
+
+def test_timeouts_are_retried_until_exhausted():
+    result = run(SubprocessExecutor(timeout=0.3, retries=1, backoff=0.01), python("import time; time.sleep(30)"))
+    assert result.timed_out
+    assert result.attempts == 2
+
+
+def test_signal_death_is_retried(tmp_path):
+    marker = os.path.join(tmp_path, "crashed")
+    # crash with SIGKILL on the first attempt, succeed on the second
+    command = python(
+        "import os, signal\n"
+        f"if not os.path.exists({marker!r}):\n"
+        f"    open({marker!r}, 'w').close()\n"
+        "    os.kill(os.getpid(), signal.SIGKILL)\n"
+        "print('done')\n"
+    )
+    result = run(SubprocessExecutor(retries=2, backoff=0.01), command)
+    assert result.ok
+    assert result.attempts == 2
+    assert result.stdout.strip() == "done"
+
+
+def test_concurrency_limit(tmp_path):
+    log = os.path.join(tmp_path, "log")
+    command = python(
+        "import time\n"
+        f"open({log!r}, 'a').write(f'start {{time.time()}}\\n')\n"
+        "time.sleep(0.3)\n"
+        f"open({log!r}, 'a').write(f'end {{time.time()}}\\n')\n"
+    )
+    executor = SubprocessExecutor(max_concurrency=2)
+    results = executor.gather([executor.run(command) for _ in range(5)])
+    assert all(result.ok for result in results)
+    with open(log) as f:
+        events = sorted((float(time_), kind) for kind, time_ in (line.split() for line in f))
+    running = peak = 0
+    for _, kind in events:
+        running += 1 if kind == "start" else -1
+        peak = max(peak, running)
+    assert peak == 2
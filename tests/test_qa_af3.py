@@ -0,0 +1,66 @@
+"""
+Model naming and manifest checks of the qa_af3 pipeline on small synthetic AF3 zips.
+"""
+import os
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import build_table, write_af3_zip
+from PDBToolkit.CASP.qa_af3 import MANIFEST_NAME, qa_pipeline
+
+
+def write_two_job_zip(path, table, pae = False):
+    """
+    A zip with two job folders whose members have the same names, optionally with full_data JSONs.
+    """
+    write_af3_zip(path + ".one", table, "job", n_models=2)
+    n_tokens = table.n_residues
+    starts = table.residue_starts[:-1]
+    full_data = {
+        "pae": np.full((n_tokens, n_tokens), 5.0).tolist(),
+        "contact_probs": np.eye(n_tokens).tolist(),
+        "token_chain_ids": table.chain_id[starts].tolist(),
+        "token_res_ids": table.resseq[starts].tolist(),
+    }
+    with zipfile.ZipFile(path + ".one") as source, zipfile.ZipFile(path, "w") as zip_ref:
+        for folder in ("run_1", "run_2"):
+            for member in source.namelist():
+                zip_ref.writestr(f"{folder}/{os.path.basename(member)}", source.read(member))
+            if pae:
+                for model in range(2):
+                    zip_ref.writestr(f"{folder}/fold_job_full_data_{model}.json", json.dumps(full_data))
+    os.remove(path + ".one")
+
+
+def test_job_folders_do_not_collide(tmp_path):
+    input_dir, output_dir = os.path.join(tmp_path, "zips"), os.path.join(tmp_path, "out")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    write_two_job_zip(os.path.join(input_dir, "jobs.zip"), build_table(2, 3))
+    qa_pipeline(input_dir, output_dir)
+    qa = pd.read_csv(os.path.join(output_dir, "qa.csv"), sep="\t")
+    assert sorted(qa["file"]) == [
+        "run_1_fold_job_model_0.pdb", "run_1_fold_job_model_1.pdb",
+        "run_2_fold_job_model_0.pdb", "run_2_fold_job_model_1.pdb",
+    ]
+    assert all(os.path.exists(os.path.join(output_dir, file)) for file in qa["file"])
+
+
+def test_missing_matrix_is_ingested_again(tmp_path):
+    input_dir, output_dir = os.path.join(tmp_path, "zips"), os.path.join(tmp_path, "out")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    write_two_job_zip(os.path.join(input_dir, "jobs.zip"), build_table(2, 3), pae=True)
+    qa_pipeline(input_dir, output_dir, pae=True)
+    pae_file = os.path.join(output_dir, "run_2_fold_job_model_1.pae.npy")
+    with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        records = json.load(f)["zips"]["jobs.zip"]["records"]
+    assert all(record["matrices"] == ["pae", "contact_probs"] for record in records)
+    assert "matrices" not in pd.read_csv(os.path.join(output_dir, "qa.csv"), sep="\t")
+
+    os.remove(pae_file)
+    qa_pipeline(input_dir, output_dir, pae=True)
+    assert np.load(pae_file).shape == (6, 6)
@@ -0,0 +1,115 @@
+"""
+Partition, stability and reduction of the shard helpers.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+import pytest
+
+from PDBToolkit.shard import assign_shards, parse_shard, reduce_csv, reduce_json, shard_path, shard_paths, write_job_scripts
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_SHARDS = 8
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """
+    200 files of 1-20 kB.
+    """
+    rng = np.random.default_rng(7)
+    paths = []
+    for i, size in enumerate(rng.integers(1000, 20000, size=200)):
+        path = os.path.join(tmp_path, f"model_{i:03}.pdb")
+        with open(path, "wb") as f:
+            f.write(b"x" * int(size))
+        paths.append(path)
+    return paths
+
+
+def shard_of(paths, n_shards = N_SHARDS):
+    return {path: index for index, shard in enumerate(assign_shards(paths, n_shards)) for path in shard}
+
+
+def test_partition_is_complete_and_order_independent(inputs):
+    shards = assign_shards(inputs, N_SHARDS)
+    assert sorted(path for shard in shards for path in shard) == sorted(inputs)
+    assert assign_shards(list(reversed(inputs)), N_SHARDS) == shards
+    assert all(shard == sorted(shard) for shard in shards)
+
+
+def test_shards_are_balanced_by_size(inputs):
+    sizes = {path: os.path.getsize(path) + 1 for path in inputs}
+    totals = [sum(sizes[path] for path in shard) for shard in assign_shards(inputs, N_SHARDS)]
+    # each cut is off by at most one file
+    assert max(totals) - min(totals) <= 2 * max(sizes.values())
+
+
+def test_adding_or_removing_a_file_moves_few_others(inputs, tmp_path):
+    before = shard_of(inputs)
+    new_path = os.path.join(tmp_path, "model_new.pdb")
+    with open(new_path, "wb") as f:
+        f.write(b"x" * 10000)
+    after = shard_of(inputs + [new_path])
+    moved = [path for path in inputs if before[path] != after[path]]
+    assert len(moved) <= N_SHARDS
+
+    after = shard_of(inputs[1:])
+    moved = [path for path in inputs[1:] if before[path] != after[path]]
+    assert len(moved) <= N_SHARDS
+
+
+def test_missing_and_empty_files_are_spread(tmp_path):
+    paths = [os.path.join(tmp_path, f"missing_{i}.pdb") for i in range(40)]
+    assert all(len(shard) >= 2 for shard in assign_shards(paths, 4))
+    assert assign_shards([], 3) == [[], [], []]
+
+
+def test_parse_shard_and_paths():
+    assert parse_shard("2/8") == (2, 8)
+    for value in ("8/8", "-1/4", "a/4", "3"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+    assert shard_path("out/tmscore.csv", (3, 8)) == "out/tmscore.shard3-of-8.csv"
+    assert shard_path("out/tmscore.csv", None) == "out/tmscore.csv"
+
+
+def test_reduce(tmp_path):
+    output_path = os.path.join(tmp_path, "clashscores.json")
+    for index, path in enumerate(shard_paths(output_path, 2)):
+        with open(path, "w") as f:
+            json.dump({f"model_{index}.pdb": index}, f)
+    reduce_json(output_path, 2)
+    with open(output_path) as f:
+        assert json.load(f) == {"model_0.pdb": 0, "model_1.pdb": 1}
+
+    output_path = os.path.join(tmp_path, "tmscore.csv")
+    with open(shard_path(output_path, (0, 2)), "w") as f:
+        f.write("model\ttmscore\na.pdb\t0.5\n")
+    with pytest.raises(FileNotFoundError, match="1 shard output"):
+        reduce_csv(output_path, 2)
+    with open(shard_path(output_path, (1, 2)), "w") as f:
+        f.write("model\ttmscore\nb.pdb\t0.7\n")
+    reduce_csv(output_path, 2)
+    with open(output_path) as f:
+        assert f.read() == "model\ttmscore\na.pdb\t0.5\nb.pdb\t0.7\n"
+
+
+@pytest.mark.skipif(shutil.which("bash") is None or shutil.which("xargs") is None, reason="needs bash and xargs")
+def test_local_script_runs_every_shard_then_reduces(tmp_path):
+    output_path = os.path.join(tmp_path, "out.json")
+    command = [
+        sys.executable, "-c",
+        "import json, sys; index, n = sys.argv[2].split('/'); "
+        f"json.dump({{index: n}}, open({output_path!r}[:-5] + f'.shard{{index}}-of-{{n}}.json', 'w'))",
+    ]
+    reduce_command = f"{sys.executable} -m PDBToolkit.shard reduce json {output_path} --n_shards 3"
+    (script,) = write_job_scripts(command, 3, os.path.join(tmp_path, "jobs"), n_parallel=2, reduce_command=reduce_command)
+    subprocess.run(["bash", script], check=True, cwd=REPO_ROOT, capture_output=True)
+    with open(output_path) as f:
+        assert json.load(f) == {"0": "3", "1": "3", "2": "3"}
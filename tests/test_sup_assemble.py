@@ -0,0 +1,71 @@
+"""
+Assembly writing of sup_assemble and failure handling of the matrix drivers, with a fake USalign.
+"""
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import build_table
+from PDBToolkit.CASP import sup_assemble
+from PDBToolkit.CASP.sup_assemble import write_assembly
+from PDBToolkit.CASP.sup_homooligo import sup_homooligomers_parallel
+from PDBToolkit.PDBOps.atom_table import read_pdb, write_pdb
+from PDBToolkit.PDBOps.compression import detect_compression
+
+
+def test_write_assembly_falls_back_to_compressed_mmcif(tmp_path):
+    transforms = [(np.eye(3), np.array([30.0 * i, 0.0, 0.0])) for i in range(22)]
+    output_path = write_assembly(build_table(3, 4), transforms, os.path.join(tmp_path, "out.pdb.gz"))
+    assert output_path == os.path.join(tmp_path, "out.cif.gz")
+    assert detect_compression(output_path) == "gz"
+    assert not os.path.exists(os.path.join(tmp_path, "out.pdb.gz"))
+
+
+FAKE_USALIGN = """#!/usr/bin/env python3
+import os
+import sys
+
+args = sys.argv[1:]
+if os.path.basename(args[0]) == os.environ.get("FAIL_MODEL") or os.path.basename(args[1]) == os.environ.get("FAIL_REFERENCE"):
+    sys.exit("Segmentation fault")
+with open(args[args.index("-m") + 1], "w") as f:
+    f.write("0 0.0 1.0 0.0 0.0\\n1 0.0 0.0 1.0 0.0\\n2 0.0 0.0 0.0 1.0\\n")
+"""
+
+
+@pytest.fixture
+def fake_usalign(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, "USalign")
+    with open(path, "w") as f:
+        f.write(FAKE_USALIGN)
+    os.chmod(path, 0o755)
+    monkeypatch.setattr(sup_assemble, "USALIGN_PATH", path)
+    return monkeypatch
+
+
+def test_failed_pair_skips_only_its_assembly(tmp_path, fake_usalign):
+    fake_usalign.setenv("FAIL_MODEL", "chain_B.pdb")
+    write_pdb(build_table(3, 4), os.path.join(tmp_path, "source.pdb"))
+    write_pdb(build_table(2, 4, seed=1), os.path.join(tmp_path, "target.pdb"))
+    output_dir = os.path.join(tmp_path, "out")
+    failures = sup_homooligomers_parallel(
+        os.path.join(tmp_path, "source.pdb"), os.path.join(tmp_path, "target.pdb"), output_dir, n_cpu=2,
+    )
+    assert [output_path for output_path, _ in failures] == [os.path.join(output_dir, "sup_1.pdb")]
+    assert "Segmentation fault" in failures[0][1]
+    assert sorted(os.listdir(output_dir)) == ["failures.tsv", "sup_0.pdb", "sup_2.pdb"]
+    assert read_pdb(os.path.join(output_dir, "sup_0.pdb")).chain_ids == ["A", "B"]
+
+
+def test_matrix_assembly_reports_every_failed_target(tmp_path, fake_usalign, caplog):
+    fake_usalign.setenv("FAIL_REFERENCE", "t1.pdb")
+    write_pdb(build_table(1, 4), os.path.join(tmp_path, "source.pdb"))
+    targets = [os.path.join(tmp_path, f"t{i}.pdb") for i in range(3)]
+    for target in targets:
+        write_pdb(build_table(1, 4), target)
+    with pytest.raises(subprocess.SubprocessError, match="1 of 3"):
+        sup_assemble.sup_assemble_matrix(os.path.join(tmp_path, "source.pdb"), targets, os.path.join(tmp_path, "out.pdb"))
+    assert "t1.pdb" in caplog.text
+    assert not os.path.exists(os.path.join(tmp_path, "out.pdb"))
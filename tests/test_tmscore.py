@@ -0,0 +1,70 @@
+"""
+The native TM-score engine against TM-align reference scores (tests/data/tmscore).
+
+The fixtures are a CA trace and seven same-sequence models: rigid motion plus
+0.5-2 A noise, a displaced segment, and two truncated models. With the residue
+pairing fixed (`TMalign -I`), which is what the native engine computes, scores
+must agree closely. In TM-align's default mode the free alignment may shift a few
+pairs on the noisier models and find a slightly higher score.
+"""
+import os
+import json
+
+import numpy as np
+import pytest
+
+from PDBToolkit.CASP.tmscore import calc_d0, calc_score_d8, kabsch, score_models
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tmscore")
+
+
+@pytest.fixture(scope="module")
+def reference_scores():
+    with open(os.path.join(DATA_DIR, "reference_scores.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def native():
+    model_files = sorted(
+        os.path.join(DATA_DIR, name) for name in os.listdir(DATA_DIR) if name.startswith("model_")
+    )
+    results = score_models(model_files, os.path.join(DATA_DIR, "reference.pdb"))
+    return {os.path.basename(path): result for path, result in results.items()}
+
+
+def test_fixed_alignment(native, reference_scores):
+    expected = reference_scores["fixed_alignment"]["scores"]
+    assert set(native) == set(expected)
+    for name, reference in expected.items():
+        result = native[name]
+        assert result["tmscore"] == pytest.approx(reference["tmscore"], abs=0.005), name
+        assert result["tm_model"] == pytest.approx(reference["tm_model"], abs=0.005), name
+        assert result["rmsd"] == pytest.approx(reference["rmsd"], abs=0.02), name
+        assert result["aligned_length"] == reference["aligned_length"], name
+
+
+def test_default_alignment(native, reference_scores):
+    for name, reference in reference_scores["default"]["scores"].items():
+        result = native[name]
+        assert result["tmscore"] == pytest.approx(reference["tmscore"], abs=0.02), name
+        assert result["tm_model"] == pytest.approx(reference["tm_model"], abs=0.02), name
+        assert result["rmsd"] == pytest.approx(reference["rmsd"], abs=0.2), name
+        assert abs(result["aligned_length"] - reference["aligned_length"]) <= 2, name
+
+
+def test_superposition_maps_model_onto_reference():
+    rng = np.random.default_rng(0)
+    target = rng.normal(size=(30, 3)) * 10
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    rotation *= np.sign(np.linalg.det(rotation))
+    mobile = (target - 5.0) @ rotation
+    found_rotation, found_translation = kabsch(mobile[None], target, np.ones((1, 30)))
+    moved = mobile @ found_rotation[0].T + found_translation[0]
+    assert np.allclose(moved, target, atol=1e-6)
+
+
+def test_length_scales():
+    assert calc_d0(80) == pytest.approx(3.19, abs=0.005)
+    assert calc_d0(10) == 0.5
+    assert calc_score_d8(80) == pytest.approx(1.5 * 80 ** 0.3 + 3.5)